@@ -0,0 +1,546 @@
+import pandas as pd
+
+import asyncio
+import http.client
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit
+
+from batch_aggregation import BatchAggregator
+from download_manifest import DownloadManifest
+from exposure_history import VIEW_FOLDER_PATTERN
+from exposure_matrix import AGGREGATION_COLUMNS, FundExposureMatrix
+from holdings_storage import list_holdings_files, read_fund_holdings
+from instrumentation import LatencyRecorder, RunMetrics
+from security_master import CompactFundHoldings
+from yahoo_enrichment import METADATA_FIELDS, MetadataCache
+
+
+# largest request body accepted, in bytes
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+# columns a posted portfolio must have, as in example_holdings.csv
+PORTFOLIO_COLUMNS = ["ticker", "investment_amt", "holding_type"]
+
+HOLDING_TYPES = ["fund", "stock"]
+
+
+def holdings_files(manifest: DownloadManifest) -> dict:
+    """ the complete holdings files of a folder: those in its download manifest, or every holdings file if it has none
+
+    Returns:
+        dict: fund name to the file its holdings are read from
+    """
+    if not os.path.exists(manifest.pathway):
+        logging.warning(f"No download manifest in {manifest.folder_pathway}, loading every holdings file in it")
+        return list_holdings_files(manifest.folder_pathway)
+    return {fund: os.path.join(manifest.folder_pathway, entry['file']) for fund, entry in manifest.entries.items()}
+
+
+class FundUniverse:
+    """ the fund holdings of one holdings folder, loaded into an exposure matrix and ready to aggregate against
+
+    Nothing in a loaded universe changes: a reload builds a new one and swaps it in, so requests
+    being answered keep using the universe they started with.
+    """
+
+    def __init__(self, folder_pathway: str, fund_holdings: CompactFundHoldings, file_keys: dict, metadata: dict, version: int,
+                 failed_funds: dict = None, dropped_funds: list = None):
+        """
+        Args:
+            folder_pathway (str): holdings folder the universe was loaded from
+            fund_holdings (CompactFundHoldings): holdings of every fund in the folder
+            file_keys (dict): fund to the (device, inode, size, mtime) of the file it was read from
+            metadata (dict): ticker to the cached Yahoo Finance fields of the securities held by the funds
+            version (int): number of universes loaded before this one
+            failed_funds (dict, optional): fund to the reason the folder's import could not download it
+            dropped_funds (list, optional): funds of the universe this one replaced that it has no holdings for
+        """
+        self._folder_pathway = folder_pathway
+        self._fund_holdings = fund_holdings
+        self._file_keys = file_keys
+        self._metadata = metadata
+        self._version = version
+        self._failed_funds = failed_funds or {}
+        self._dropped_funds = dropped_funds or []
+        self._loaded_at = time.time()
+        self._exposure_matrix = FundExposureMatrix(fund_holdings)
+        self._exposure_matrix.weights  # built before the universe is served
+        self._aggregator = BatchAggregator(self._exposure_matrix)
+
+    @property
+    def folder_pathway(self):
+        return self._folder_pathway
+
+    @property
+    def fund_holdings(self):
+        return self._fund_holdings
+
+    @property
+    def file_keys(self):
+        return self._file_keys
+
+    @property
+    def metadata(self):
+        return self._metadata
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def failed_funds(self):
+        return self._failed_funds
+
+    @property
+    def dropped_funds(self):
+        return self._dropped_funds
+
+    @property
+    def loaded_at(self):
+        return self._loaded_at
+
+    @property
+    def aggregator(self):
+        return self._aggregator
+
+    def describe(self) -> dict:
+        return {'folder': self.folder_pathway, 'version': self.version, 'loaded_at': self.loaded_at,
+                'funds': len(self.fund_holdings), 'securities': len(self.fund_holdings.master), 'rows': self.fund_holdings.n_rows,
+                'failed_funds': self.failed_funds, 'dropped_funds': self.dropped_funds}
+
+    @classmethod
+    def load(cls, folder_pathway: str, previous: "FundUniverse" = None, metadata_cache: MetadataCache = None,
+             metrics: RunMetrics = None) -> "FundUniverse":
+        """ reads the fund holdings files recorded in a folder's download manifest
+
+        Files still being written are not in the manifest yet, so they are not read. A view folder
+        links funds whose filing has not changed to the same snapshot file as the day before, so files
+        with the same inode, size and modification time as in the previous universe are taken from it
+        rather than parsed again. Funds the previous universe served that the folder has no holdings
+        for are kept as dropped_funds, next to the funds its import recorded as failed.
+
+        Args:
+            folder_pathway (str): holdings folder to load
+            previous (FundUniverse, optional): universe being replaced
+            metadata_cache (MetadataCache, optional): Yahoo Finance cache whose fields for the held securities are kept in memory
+            metrics (RunMetrics, optional): records the load as a load_fund_universe stage
+        """
+        metrics = metrics if metrics is not None else RunMetrics()
+
+        with metrics.stage("load_fund_universe") as stage:
+            fund_holdings = CompactFundHoldings()
+            file_keys = {}
+            reused = 0
+
+            manifest = DownloadManifest(folder_pathway)
+            for fund, pathway in holdings_files(manifest).items():
+                try:
+                    stat = os.stat(pathway)
+                    key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                    if previous is not None and previous.file_keys.get(fund) == key:
+                        fund_holdings[fund] = previous.fund_holdings[fund]
+                        reused += 1
+                    else:
+                        fund_holdings[fund] = read_fund_holdings(pathway, columns=AGGREGATION_COLUMNS)
+                    file_keys[fund] = key
+                except Exception as e:
+                    logging.warning(f"Unable to import holdings for {fund} located in {pathway}: {e}")
+
+            dropped_funds = []
+            if previous is not None:
+                # reloading the same folder keeps reporting the funds dropped when it was first served
+                earlier = set(previous.fund_holdings) | (set(previous.dropped_funds) if previous.folder_pathway == folder_pathway else set())
+                dropped_funds = sorted(earlier - set(fund_holdings))
+            if dropped_funds:
+                logging.warning(f"Holdings folder {folder_pathway} has no holdings for {len(dropped_funds)} previously served funds: {dropped_funds}")
+
+            failed_funds = (manifest.import_status or {}).get('failed_funds', {})
+            metadata = metadata_cache.get_many(fund_holdings.master.keys) if metadata_cache is not None else {}
+            universe = cls(folder_pathway, fund_holdings, file_keys, metadata, previous.version + 1 if previous is not None else 0,
+                           failed_funds, dropped_funds)
+
+            stage['folder'] = folder_pathway
+            stage['funds'] = len(fund_holdings)
+            stage['funds_reused'] = reused
+            stage['funds_dropped'] = len(dropped_funds)
+            stage['securities'] = len(fund_holdings.master)
+
+        return universe
+
+
+class AggregationServer:
+    """ long-running HTTP service answering aggregation requests against a fund universe kept in memory
+
+    The latest dated holdings folder whose import has finished (or a fixed one) is loaded once and
+    polled for changes; when a newer folder finishes importing, or the manifest changes, the universe
+    is reloaded in the background and swapped in. Funds the new folder lacks are reported by /health.
+    Portfolios posted at the same time are aggregated together in one BatchAggregator product on a
+    worker thread, so the event loop keeps accepting requests while a batch is computed.
+
+    Endpoints:
+        POST /aggregate: {"holdings": [{"ticker", "investment_amt", "holding_type"}, ...], "metadata": false}
+            returns {"universe": {...}, "missing_funds": [funds not in the universe], "holdings": [{"ticker", "portfolio_holdings", <metadata fields>}, ...]}
+        GET /metrics: per-endpoint request counts and latency percentiles, batch sizes and universe loads
+        GET /health: the loaded universe, with the funds its import failed on or that it dropped
+        POST /reload: reloads the universe now
+    """
+
+    def __init__(self, holdings_root: str = "fund_holdings", folder_pathway: str = None, host: str = "127.0.0.1", port: int = 8765,
+                 metadata_cache_pathway: str = None, reload_interval: float = 5.0, max_batch: int = 64, batch_window: float = 0.001):
+        """
+        Args:
+            holdings_root (str): folder of the dated holdings folders, the latest of which is served
+            folder_pathway (str, optional): serve this holdings folder instead of the latest one in holdings_root
+            host (str): address to listen on
+            port (int): port to listen on, 0 picks a free one
+            metadata_cache_pathway (str, optional): Yahoo Finance metadata cache to answer "metadata" requests from
+            reload_interval (float): seconds between checks for a new holdings folder or snapshot. 0 turns polling off
+            max_batch (int): most portfolios aggregated in one product
+            batch_window (float): seconds a batch waits for more portfolios to arrive before it is computed
+        """
+        self._holdings_root = holdings_root
+        self._folder_pathway = folder_pathway
+        self._host = host
+        self._port = port
+        self._metadata_cache = MetadataCache(metadata_cache_pathway) if metadata_cache_pathway is not None else None
+        self._reload_interval = reload_interval
+        self._max_batch = max_batch
+        self._batch_window = batch_window
+
+        self._universe = None
+        self._signature = None
+        self._metrics = RunMetrics()
+        self._latency = LatencyRecorder()
+        self._batches = {'batches': 0, 'portfolios': 0, 'max_portfolios': 0}
+        self._pending = []
+        self._batch_task = None
+        self._watch_task = None
+        self._server = None
+        self._reload_lock = None
+        # one thread computes batches and another loads universes, so a reload does not hold up requests
+        self._aggregation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aggregate")
+        self._reload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reload")
+
+    @property
+    def universe(self):
+        return self._universe
+
+    @property
+    def latency(self):
+        return self._latency
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def port(self):
+        """ port the server listens on, once started """
+        if self._server is not None and self._server.sockets:
+            return self._server.sockets[0].getsockname()[1]
+        return self._port
+
+    def current_folder(self) -> str:
+        """ the holdings folder to serve: folder_pathway, or the latest dated folder in holdings_root that is ready
+
+        A newer folder is only moved to once its import has finished, so a folder still being written
+        does not replace a complete universe. Funds its import failed on do not hold it back.
+        """
+        if self._folder_pathway is not None:
+            return self._folder_pathway
+
+        folders = sorted(x for x in os.listdir(self._holdings_root)
+                         if VIEW_FOLDER_PATTERN.match(x) and os.path.isdir(os.path.join(self._holdings_root, x)))
+        served = self._universe.folder_pathway if self._universe is not None else None
+
+        for folder in reversed(folders):
+            folder_pathway = os.path.join(self._holdings_root, folder)
+            if folder_pathway == served or self.folder_ready(folder_pathway):
+                return folder_pathway
+            logging.info(f"Holdings folder {folder_pathway} is still being imported, not serving it yet")
+
+        raise FileNotFoundError(f"No complete dated holdings folders in {self._holdings_root}")
+
+    @staticmethod
+    def folder_ready(folder_pathway: str) -> bool:
+        """ whether a folder's download manifest lists funds and records its import as finished
+
+        Folders written before imports were recorded in the manifest are judged by their entries alone.
+        """
+        manifest = DownloadManifest(folder_pathway)
+        return len(manifest) > 0 and manifest.import_finished is not False
+
+    @staticmethod
+    def folder_signature(folder_pathway: str) -> tuple:
+        """ changes whenever a holdings file or the download manifest in the folder is added or replaced """
+        manifest = os.path.join(folder_pathway, "manifest.json")
+        manifest_mtime = os.stat(manifest).st_mtime_ns if os.path.exists(manifest) else None
+        return folder_pathway, os.stat(folder_pathway).st_mtime_ns, manifest_mtime
+
+    async def reload(self, force: bool = False) -> bool:
+        """ loads the universe again if its folder changed since it was loaded
+
+        Returns:
+            bool: whether a new universe was swapped in
+        """
+        loop = asyncio.get_running_loop()
+        async with self._reload_lock:
+            folder = self.current_folder()
+            signature = self.folder_signature(folder)
+            if not force and signature == self._signature:
+                return False
+            if not force and self._universe is not None and not self.folder_ready(folder):
+                # the served folder is being imported into again, it is reloaded once the import finishes
+                return False
+
+            # the signature is taken before loading, so files changed during the load trigger another reload
+            self._universe = await loop.run_in_executor(self._reload_executor, FundUniverse.load, folder, self._universe,
+                                                        self._metadata_cache, self._metrics)
+            self._signature = signature
+            logging.info(f"Loaded fund universe {self._universe.describe()}")
+            return True
+
+    async def watch(self) -> None:
+        while True:
+            await asyncio.sleep(self._reload_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                # keep serving the universe already loaded
+                logging.error(f"Unable to reload the fund universe: {e}")
+
+    async def start(self) -> None:
+        """ loads the universe and starts listening """
+        self._reload_lock = asyncio.Lock()
+        await self.reload(force=True)
+        self._server = await asyncio.start_server(self.handle_connection, self._host, self._port)
+        if self._reload_interval > 0:
+            self._watch_task = asyncio.create_task(self.watch())
+        logging.info(f"Aggregation server listening on {self._host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._aggregation_executor.shutdown(wait=False)
+        self._reload_executor.shutdown(wait=False)
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    def run(self) -> None:
+        """ serves until interrupted """
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+    async def aggregate(self, holdings: pd.DataFrame) -> tuple:
+        """ queues a portfolio for the next batch
+
+        Returns:
+            tuple: (DataFrame of ticker and portfolio_holdings, universe it was aggregated against)
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((holdings, future))
+        if self._batch_task is None or self._batch_task.done():
+            self._batch_task = asyncio.create_task(self.run_batches())
+        return await future
+
+    async def run_batches(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while self._pending:
+            # portfolios posted while the previous batch was computed, or within the window, join this one
+            await asyncio.sleep(self._batch_window)
+            batch, self._pending = self._pending[:self._max_batch], self._pending[self._max_batch:]
+            universe = self._universe
+            portfolios = {str(i): holdings for i, (holdings, future) in enumerate(batch)}
+
+            try:
+                results = await loop.run_in_executor(self._aggregation_executor, universe.aggregator.aggregate, portfolios, None, len(portfolios))
+            except Exception as e:
+                # aggregate the portfolios one at a time so only the one that fails gets the error
+                logging.warning(f"Batch of {len(batch)} portfolios failed, aggregating them separately: {e}")
+                results = {}
+                for client, holdings in portfolios.items():
+                    try:
+                        results.update(await loop.run_in_executor(self._aggregation_executor, universe.aggregator.aggregate, {client: holdings}))
+                    except Exception as error:
+                        results[client] = error
+
+            self._batches['batches'] += 1
+            self._batches['portfolios'] += len(batch)
+            self._batches['max_portfolios'] = max(self._batches['max_portfolios'], len(batch))
+            for i, (holdings, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if isinstance(results[str(i)], Exception):
+                    future.set_exception(results[str(i)])
+                else:
+                    future.set_result((results[str(i)], universe))
+
+    def metrics_report(self) -> dict:
+        batches = dict(self._batches)
+        batches['mean_portfolios'] = batches['portfolios'] / batches['batches'] if batches['batches'] else None
+        return {
+            'latency': self.latency.summary(),
+            'batches': batches,
+            'universe': self._universe.describe() if self._universe is not None else None,
+            'loads': [x for x in self.metrics.report()['stages'] if x['stage'] == "load_fund_universe"],
+        }
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> tuple:
+        """ returns (HTTP status, JSON-serializable payload or an already encoded JSON string) """
+        if method == "GET" and path == "/health":
+            return HTTPStatus.OK, {'status': "ok", 'universe': self._universe.describe()}
+        if method == "GET" and path == "/metrics":
+            return HTTPStatus.OK, self.metrics_report()
+        if method == "POST" and path == "/reload":
+            reloaded = await self.reload(force=True)
+            return HTTPStatus.OK, {'reloaded': reloaded, 'universe': self._universe.describe()}
+        if method == "POST" and path == "/aggregate":
+            return await self.handle_aggregate(body)
+        return HTTPStatus.NOT_FOUND, {'error': f"No endpoint {method} {path}"}
+
+    async def handle_aggregate(self, body: bytes) -> tuple:
+        try:
+            request = json.loads(body)
+            holdings = pd.DataFrame(request['holdings'])
+            missing = [x for x in PORTFOLIO_COLUMNS if x not in holdings.columns]
+            if missing:
+                raise ValueError(f"holdings are missing columns {missing}")
+            # checked here so one malformed portfolio does not fail the batch it would join
+            holdings = holdings[PORTFOLIO_COLUMNS].assign(investment_amt=pd.to_numeric(holdings['investment_amt'], errors="raise"))
+            unknown = sorted(set(holdings['holding_type']) - set(HOLDING_TYPES), key=str)
+            if unknown:
+                raise ValueError(f"holding_type must be one of {HOLDING_TYPES}, got {unknown}")
+        except (ValueError, KeyError, TypeError) as e:
+            return HTTPStatus.BAD_REQUEST, {'error': f"Invalid aggregation request: {e}"}
+
+        aggregated, universe = await self.aggregate(holdings)
+        fund_positions = universe.aggregator.exposure_matrix.fund_positions
+        missing_funds = sorted(set(x for x in holdings.loc[holdings['holding_type'] == "fund", 'ticker'] if x not in fund_positions), key=str)
+
+        if request.get('metadata'):
+            fields = [universe.metadata.get(x, {}) for x in aggregated['ticker']]
+            aggregated = aggregated.assign(**{field: [x.get(field) for x in fields] for field in METADATA_FIELDS})
+
+        # the holdings are encoded by pandas, which writes NaN as null
+        universe_json = json.dumps({'folder': universe.folder_pathway, 'version': universe.version})
+        return HTTPStatus.OK, (f'{{"universe": {universe_json}, "missing_funds": {json.dumps(missing_funds)}, '
+                               f'"holdings": {aggregated.to_json(orient="records")}}}')
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ answers HTTP/1.1 requests on one connection until the client closes it """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line in (b"\r\n", b"\n", b""):
+                            break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    await self.respond(writer, HTTPStatus.BAD_REQUEST, {'error': "Malformed request"}, keep_alive=False)
+                    break
+
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "Request body too large"}, keep_alive=False)
+                    break
+
+                body = await reader.readexactly(length)
+                path = urlsplit(target).path
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                start = time.perf_counter()
+
+                try:
+                    status, payload = await self.dispatch(method, path, body)
+                except Exception as e:
+                    logging.exception(f"Error answering {method} {path}")
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"{type(e).__name__}: {e}"}
+
+                await self.respond(writer, status, payload, keep_alive)
+                self.latency.record(f"{method} {path}", time.perf_counter() - start, success=status < HTTPStatus.INTERNAL_SERVER_ERROR)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer: asyncio.StreamWriter, status: HTTPStatus, payload, keep_alive: bool = True) -> None:
+        body = (payload if isinstance(payload, str) else json.dumps(payload, default=str)).encode()
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+class AggregationClient:
+    """ client of an AggregationServer over one kept-alive HTTP connection. Use one client per thread """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, timeout: float = 60):
+        self._connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method: str, path: str, payload: dict = None) -> dict:
+        """ sends a request and returns the decoded JSON response, raising RuntimeError for error statuses """
+        body = json.dumps(payload) if payload is not None else None
+        headers = {'Content-Type': "application/json"} if body is not None else {}
+        self._connection.request(method, path, body=body, headers=headers)
+        response = self._connection.getresponse()
+        result = json.loads(response.read())
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path} failed with {response.status}: {result.get('error')}")
+        return result
+
+    def aggregate(self, holdings: pd.DataFrame, metadata: bool = False) -> pd.DataFrame:
+        """ aggregates a portfolio (ticker, investment_amt, holding_type) on the server
+
+        Returns:
+            pd.DataFrame: ticker and portfolio_holdings, plus the cached metadata fields if requested. Its attrs hold
+                the universe it was aggregated against and the funds it has no holdings for (missing_funds)
+        """
+        records = holdings[PORTFOLIO_COLUMNS].to_dict(orient="records")
+        result = self.request("POST", "/aggregate", {'holdings': records, 'metadata': metadata})
+        if result['missing_funds']:
+            logging.warning(f"No holdings found for funds {result['missing_funds']} in {result['universe']['folder']}")
+
+        aggregated = pd.DataFrame(result['holdings'], columns=None if result['holdings'] else ["ticker", "portfolio_holdings"])
+        aggregated.attrs['universe'] = result['universe']
+        aggregated.attrs['missing_funds'] = result['missing_funds']
+        return aggregated
+
+    def metrics(self) -> dict:
+        return self.request("GET", "/metrics")
+
+    def health(self) -> dict:
+        return self.request("GET", "/health")
+
+    def reload(self) -> dict:
+        return self.request("POST", "/reload")
+
+    def close(self) -> None:
+        self._connection.close()
@@ -0,0 +1,268 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+
+from batch_aggregation import BatchAggregator
+from exposure_matrix import FundExposureMatrix
+
+
+# fund holdings carry the N-PORT country code, holdings in this country are domestic and all others international
+DOMESTIC_COUNTRY_CODE = "US"
+
+# scenario settings and their defaults. Targets, caps and allocations are percents of the amount invested
+SCENARIO_DEFAULTS = {'targets': {}, 'by': "region", 'max_security_weight': None, 'max_fund_weight': None,
+                     'funds': None, 'amount': 100.0, 'method': "lp"}
+SOLVER_METHODS = ["lp", "least_squares"]
+
+
+class AllocationSolver:
+    """ finds the fund allocation whose look-through exposure comes closest to target roll-up shares
+
+    A scenario such as 60% domestic / 40% international with at most 5% in any single stock is a
+    linear program over the fund weights: the exposure of each roll-up group (region, country or
+    an enriched attribute such as sector) is a funds x groups matrix computed once per dimension,
+    and a stock cap is one row of the funds x securities weight matrix. "lp" minimizes the sum of
+    absolute deviations from the targets with every cap enforced, "least_squares" minimizes the
+    squared deviations without stock caps. The look-through holdings of a batch of solved
+    allocations come out of one sparse product, as in BatchAggregator.
+    """
+
+    def __init__(self, exposure_matrix: FundExposureMatrix, security_attributes: pd.DataFrame = None):
+        """
+        Args:
+            exposure_matrix (FundExposureMatrix): weight matrix of the funds that can be allocated to
+            security_attributes (pd.DataFrame, optional): more roll-up dimensions per security with a ticker column, e.g.
+                the enriched aggregated holdings with sector and industry. Securities not in it are grouped as missing
+        """
+        self._exposure_matrix = exposure_matrix
+        self._security_attributes = None
+        if security_attributes is not None:
+            self._security_attributes = security_attributes.drop_duplicates("ticker").set_index("ticker")
+        self._rollups = {}
+
+    @property
+    def exposure_matrix(self):
+        return self._exposure_matrix
+
+    @property
+    def funds(self):
+        return self._exposure_matrix.funds
+
+    @property
+    def dimensions(self) -> list:
+        """ roll-up dimensions targets can be given in """
+        attributes = [] if self._security_attributes is None else list(self._security_attributes.columns)
+        return ["region"] + self._exposure_matrix.master.info_columns + attributes
+
+    def group_values(self, dimension: str) -> np.ndarray:
+        """ returns the group of every security in a roll-up dimension """
+        master = self._exposure_matrix.master
+        if dimension == "region":
+            country = np.asarray(master.info_column("country"), dtype=object)
+            return np.where(country == DOMESTIC_COUNTRY_CODE, "domestic", "international").astype(object)
+        if dimension in master.info_columns:
+            return np.asarray(master.info_column(dimension), dtype=object)
+        if self._security_attributes is not None and dimension in self._security_attributes.columns:
+            return self._security_attributes[dimension].reindex(master.keys).to_numpy(dtype=object)
+        raise ValueError(f"Unknown roll-up dimension: {dimension}. Options are {self.dimensions}")
+
+    def rollup(self, dimension: str) -> tuple:
+        """ returns (groups, funds x groups percent of each fund in each group), computed once per dimension """
+        if dimension not in self._rollups:
+            weights = self._exposure_matrix.weights
+            codes, groups = pd.factorize(self.group_values(dimension)[:weights.shape[1]], use_na_sentinel=False)
+            indicator = sparse.csr_matrix((np.ones(len(codes)), (np.arange(len(codes)), codes)), shape=(len(codes), len(groups)))
+            self._rollups[dimension] = (pd.Index(groups), np.asarray((weights @ indicator).todense()))
+        return self._rollups[dimension]
+
+    def solve(self, scenario: dict) -> dict:
+        """ solves one scenario, see solve_batch """
+        return self.solve_batch({'scenario': scenario})['scenario']
+
+    def solve_allocation(self, scenario: dict) -> tuple:
+        """ returns (percent allocated to each fund, sum of absolute deviations from the targets, solver message), allocation None if it failed """
+        from scipy.optimize import linprog, lsq_linear
+
+        settings = {**SCENARIO_DEFAULTS, **scenario}
+        if settings['method'] not in SOLVER_METHODS:
+            raise ValueError(f"Unknown solver method: {settings['method']}. Options are {SOLVER_METHODS}")
+
+        groups, group_weights = self.rollup(settings['by'])
+        unknown = [x for x in settings['targets'] if x not in groups]
+        if unknown:
+            logging.warning(f"No securities in {settings['by']} groups {unknown}, their exposure is 0")
+        # groups without a target are left free
+        targets = np.array([settings['targets'][x] for x in groups if x in settings['targets']] + [settings['targets'][x] for x in unknown], dtype=float)
+        targeted = [groups.get_loc(x) for x in groups if x in settings['targets']]
+
+        fund_positions = self._exposure_matrix.fund_positions
+        candidates = np.arange(len(self.funds)) if settings['funds'] is None else \
+            np.array([fund_positions[x] for x in settings['funds'] if x in fund_positions], dtype=np.int64)
+        n, k = len(candidates), len(targets)
+        if n == 0:
+            return None, np.nan, "No candidate funds"
+
+        # percent of each candidate fund in each targeted group, unknown groups have no exposure
+        group_matrix = np.zeros((n, k))
+        group_matrix[:, :len(targeted)] = group_weights[candidates][:, targeted]
+        max_fund_weight = 100.0 if settings['max_fund_weight'] is None else float(settings['max_fund_weight'])
+
+        if settings['method'] == "least_squares":
+            if settings['max_security_weight'] is not None:
+                raise ValueError("max_security_weight is only enforced by the 'lp' method")
+            # the budget is a heavily weighted extra residual, as lsq_linear only takes bounds
+            budget = 1000.0
+            A = np.vstack([group_matrix.T / 100, np.full((1, n), budget)])
+            b = np.append(targets, 100.0 * budget)
+            result = lsq_linear(A, b, bounds=(0, max_fund_weight))
+            allocation = np.zeros(len(self.funds))
+            allocation[candidates] = result.x
+            return allocation, float(np.abs(group_matrix.T @ result.x / 100 - targets).sum()), result.message
+
+        # variables: fund percents, then the over and under deviation of each targeted group
+        cost = np.concatenate([np.zeros(n), np.ones(2 * k)])
+        A_eq = sparse.vstack([
+            sparse.hstack([sparse.csr_matrix(group_matrix.T / 100), sparse.identity(k) * -1, sparse.identity(k)]),
+            sparse.hstack([sparse.csr_matrix(np.ones((1, n))), sparse.csr_matrix((1, 2 * k))]),
+        ]).tocsr()
+        b_eq = np.append(targets, 100.0)
+        A_ub, b_ub = None, None
+
+        if settings['max_security_weight'] is not None:
+            cap = float(settings['max_security_weight'])
+            fund_weights = self._exposure_matrix.weights[candidates]
+            # a security's exposure sums over every fund holding it, so it can reach but never pass the weight
+            # of its heaviest holder. Securities no fund holds above the cap need no constraint
+            capped = np.flatnonzero(np.asarray(fund_weights.max(axis=0).todense()).ravel() > cap)
+            if len(capped):
+                A_ub = sparse.hstack([fund_weights[:, capped].T / 100, sparse.csr_matrix((len(capped), 2 * k))]).tocsr()
+                b_ub = np.full(len(capped), cap)
+
+        bounds = [(0, max_fund_weight)] * n + [(0, None)] * (2 * k)
+        result = linprog(cost, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq, bounds=bounds, method="highs")
+        if result.status != 0:
+            return None, np.nan, result.message
+
+        allocation = np.zeros(len(self.funds))
+        allocation[candidates] = result.x[:n]
+        return allocation, float(result.fun), result.message
+
+    def solve_batch(self, scenarios: Dict[str, dict]) -> Dict[str, dict]:
+        """ solves scenarios and computes the look-through holdings of all their allocations at once
+
+        Args:
+            scenarios (Dict[str, dict]): scenario name to its settings:
+                targets (dict): group to its target percent of the amount invested, e.g. {'domestic': 60, 'international': 40}
+                by (str): roll-up dimension of the targets, one of dimensions. Defaults to "region"
+                max_security_weight (float, optional): most any single security may weigh, in percent
+                max_fund_weight (float, optional): most any single fund may be allocated, in percent
+                funds (list, optional): funds that can be allocated to. Defaults to every fund
+                amount (float): amount invested. Defaults to 100, so amounts equal percents
+                method (str): "lp" (default) or "least_squares"
+
+        Returns:
+            dict: scenario name to a dict of
+                allocation (pd.DataFrame): ticker, investment_amt and holding_type of the funds allocated to, a portfolio PortfolioConstructor accepts
+                holdings (pd.DataFrame): ticker and portfolio_holdings of the resulting look-through holdings, in the units of full_portfolio_holdings
+                rollup (pd.Series): percent of the amount invested in each group of the scenario's dimension
+                deviation (float): sum of absolute deviations from the targets, in percent
+                success (bool) and message (str): whether the solver found an allocation and why not, e.g. an invalid scenario
+        """
+        results = {}
+        portfolios = {}
+
+        for name, scenario in scenarios.items():
+            settings = {**SCENARIO_DEFAULTS, **scenario}
+            try:
+                allocation, deviation, message = self.solve_allocation(scenario)
+                groups, group_weights = self.rollup(settings['by'])
+            except ValueError as e:
+                # an invalid scenario fails on its own instead of losing the rest of the batch
+                allocation, deviation, message = None, np.nan, str(e)
+                groups, group_weights = pd.Index([]), np.zeros((len(self.funds), 0))
+            results[name] = {'success': allocation is not None, 'message': message, 'deviation': deviation}
+            if allocation is None:
+                logging.warning(f"No allocation found for scenario {name}: {message}")
+                allocation = np.zeros(len(self.funds))
+
+            held = np.flatnonzero(allocation > 1e-9)
+            amounts = allocation[held] * settings['amount'] / 100
+            portfolios[name] = pd.DataFrame({'ticker': np.asarray(self.funds, dtype=object)[held], 'investment_amt': amounts,
+                                             'holding_type': 'fund'})
+            results[name]['rollup'] = pd.Series(allocation @ group_weights / 100, index=groups)
+            results[name]['allocation'] = portfolios[name]
+
+        holdings = BatchAggregator(self._exposure_matrix).aggregate(portfolios, chunk_size=max(len(portfolios), 1))
+        for name in results:
+            results[name]['holdings'] = holdings[name]
+
+        return results
+
+
+# allocation solver of a worker process, set once per process by init_worker
+_worker_solver = None
+
+
+def init_worker(solver: AllocationSolver) -> None:
+    global _worker_solver
+    _worker_solver = solver
+
+
+def solve_in_worker(scenarios: Dict[str, dict]) -> dict:
+    return _worker_solver.solve_batch(scenarios)
+
+
+def solve_many(solver: AllocationSolver, scenarios: Dict[str, dict], n_processes: int = 1, chunk_size: int = 100) -> Dict[str, dict]:
+    """ solves many allocation scenarios against one fund universe, optionally across processes
+
+    Args:
+        solver (AllocationSolver): solver over the loaded fund universe, sent to each worker once
+        scenarios (Dict[str, dict]): scenario name to its settings, see AllocationSolver.solve_batch
+        n_processes (int): number of worker processes. 1 solves in the current process
+        chunk_size (int): number of scenarios solved and aggregated together
+
+    Returns:
+        dict: scenario name to its allocation, holdings, rollup, deviation, success and message
+    """
+    names = list(scenarios)
+    chunks = [{name: scenarios[name] for name in names[i:i + chunk_size]} for i in range(0, len(names), chunk_size)]
+    results = {}
+
+    if n_processes <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            results.update(solver.solve_batch(chunk))
+        return results
+
+    # the roll-ups are computed before the solver is pickled, so no worker computes them again
+    for by in set(scenario.get('by', SCENARIO_DEFAULTS['by']) for scenario in scenarios.values()):
+        if by in solver.dimensions:
+            solver.rollup(by)
+
+    with ProcessPoolExecutor(max_workers=n_processes, initializer=init_worker, initargs=(solver,)) as executor:
+        futures = [executor.submit(solve_in_worker, chunk) for chunk in chunks]
+        for future in futures:
+            results.update(future.result())
+
+    return results
+
+
+def solve_allocations(scenarios: Dict[str, dict], fund_holdings_pathway: str, security_attributes: pd.DataFrame = None,
+                      n_processes: int = 1, chunk_size: int = 100) -> Dict[str, dict]:
+    """ solves many what-if allocation scenarios over the funds in a holdings folder, loading them only once
+
+    Args:
+        scenarios (Dict[str, dict]): scenario name to its targets and constraints, see AllocationSolver.solve_batch
+        fund_holdings_pathway (str): folder with the holdings file of each fund
+        security_attributes (pd.DataFrame, optional): more roll-up dimensions per security with a ticker column, e.g. sector
+        n_processes (int): number of worker processes to spread the scenarios over
+        chunk_size (int): number of scenarios solved and aggregated together
+
+    Returns:
+        dict: scenario name to its allocation, look-through holdings, roll-up and deviation from the targets
+    """
+    solver = AllocationSolver(FundExposureMatrix.from_folder(fund_holdings_pathway), security_attributes)
+    return solve_many(solver, scenarios, n_processes=n_processes, chunk_size=chunk_size)
@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+
+from exposure_matrix import FundExposureMatrix
+
+
+class BatchAggregator:
+    """ computes the look-through holdings of many client portfolios against one loaded fund universe
+
+    The fund investments of a batch of clients form a clients x funds matrix, so every client's
+    exposure comes out of a single sparse product with the funds x securities weight matrix.
+    """
+
+    def __init__(self, exposure_matrix: FundExposureMatrix):
+        self._exposure_matrix = exposure_matrix
+        self._security_order = None
+        self._security_rank = None
+
+    @property
+    def exposure_matrix(self):
+        return self._exposure_matrix
+
+    def client_exposures(self, portfolios: Dict[str, pd.DataFrame]):
+        """ builds the clients x securities matrix of amounts held directly and through funds
+
+        Args:
+            portfolios (Dict[str, pd.DataFrame]): client name as key, holdings (ticker, investment_amt, holding_type) as value
+
+        Returns:
+            tuple: (client names, security tickers, csr matrix of amounts with a row per client)
+        """
+        clients = list(portfolios)
+        fund_positions = self.exposure_matrix.fund_positions
+        security_positions = self.exposure_matrix.security_positions
+        weights = self.exposure_matrix.weights
+        n_securities = weights.shape[1]
+        # stocks not held by any fund get columns after the fund securities, the universe itself is not copied
+        extra_positions = {}
+
+        fund_rows, fund_cols, fund_amts = [], [], []
+        stock_rows, stock_cols, stock_amts = [], [], []
+
+        for row, client in enumerate(clients):
+            holdings = portfolios[client]
+            is_fund = (holdings['holding_type'] == 'fund').to_numpy()
+            tickers = holdings['ticker'].to_numpy(dtype=object)
+            amounts = np.nan_to_num(holdings['investment_amt'].to_numpy(dtype=float), nan=0.0)
+
+            for ticker, amount in zip(tickers[is_fund], amounts[is_fund]):
+                position = fund_positions.get(ticker)
+                if position is None:
+                    logging.warning(f"No holdings found for fund {ticker} held by {client}")
+                    continue
+                fund_rows.append(row)
+                fund_cols.append(position)
+                fund_amts.append(amount)
+
+            for ticker, amount in zip(tickers[~is_fund], amounts[~is_fund]):
+                if not isinstance(ticker, str):
+                    continue
+                position = security_positions.get(ticker)
+                if position is None or position >= n_securities:
+                    position = extra_positions.setdefault(ticker, n_securities + len(extra_positions))
+                stock_rows.append(row)
+                stock_cols.append(position)
+                stock_amts.append(amount)
+
+        securities = np.concatenate([self.exposure_matrix.securities[:n_securities], np.asarray(list(extra_positions), dtype=object)])
+        fund_amounts = sparse.csr_matrix((fund_amts, (fund_rows, fund_cols)), shape=(len(clients), len(fund_positions)))
+        fund_exposure = fund_amounts @ weights
+        fund_exposure.resize((len(clients), len(securities)))
+        stock_amounts = sparse.csr_matrix((stock_amts, (stock_rows, stock_cols)), shape=(len(clients), len(securities)))
+
+        return clients, securities, (fund_exposure + stock_amounts).tocsr()
+
+    def ticker_ranks(self, securities: np.ndarray) -> np.ndarray:
+        """ returns a sort key per security, as returned by client_exposures, that orders them by ticker
+
+        The fund universe's tickers are sorted once and kept. Stocks held directly that no fund holds
+        (after the universe's columns) are placed between the universe tickers by binary search, so
+        a chunk costs a sort of those few stocks rather than of every security.
+        """
+        n_universe = self.exposure_matrix.weights.shape[1]
+        if self._security_rank is None or len(self._security_rank) != n_universe:
+            order = np.argsort(self.exposure_matrix.securities[:n_universe], kind="stable")
+            self._security_order = self.exposure_matrix.securities[:n_universe][order]
+            self._security_rank = np.empty(n_universe, dtype=np.int64)
+            self._security_rank[order] = np.arange(n_universe)
+
+        extra = securities[n_universe:]
+        if not len(extra):
+            return self._security_rank
+
+        # extras inserted before the same universe ticker are ordered among themselves
+        insertion = np.searchsorted(self._security_order, extra)
+        extra_rank = np.empty(len(extra), dtype=np.int64)
+        extra_rank[np.argsort(extra, kind="stable")] = np.arange(len(extra))
+        slots = len(extra) + 1
+        return np.concatenate([self._security_rank * slots + len(extra), insertion * slots + extra_rank])
+
+    def aggregate(self, portfolios: Dict[str, pd.DataFrame], output_folder: str = None, chunk_size: int = 500) -> dict:
+        """ aggregates client portfolios a chunk at a time
+
+        Args:
+            portfolios (Dict[str, pd.DataFrame]): client name as key, holdings (ticker, investment_amt, holding_type) as value
+            output_folder (str, optional): if given each client's holdings are written to <output_folder>/<client>.csv as soon as they are computed
+            chunk_size (int): number of clients multiplied against the fund universe at once
+
+        Returns:
+            dict: client name to a DataFrame of ticker and portfolio_holdings (sorted by ticker), or to the CSV it was saved in
+        """
+        results = {}
+        clients = list(portfolios)
+
+        for start in range(0, len(clients), chunk_size):
+            chunk = {client: portfolios[client] for client in clients[start:start + chunk_size]}
+            chunk_clients, securities, exposures = self.client_exposures(chunk)
+            ticker_rank = self.ticker_ranks(securities)
+
+            for row, client in enumerate(chunk_clients):
+                row_start, row_end = exposures.indptr[row], exposures.indptr[row + 1]
+                columns = exposures.indices[row_start:row_end]
+                order = np.argsort(ticker_rank[columns], kind="stable")
+                df = pd.DataFrame({'ticker': securities[columns[order]], 'portfolio_holdings': exposures.data[row_start:row_end][order]})
+
+                if output_folder is not None:
+                    file_pathway = os.path.join(output_folder, f"{client}.csv")
+                    df.to_csv(file_pathway, index=False)
+                    results[client] = file_pathway
+                else:
+                    results[client] = df
+
+        return results
+
+
+# fund universe of a worker process, set once per process by init_worker
+_worker_aggregator = None
+
+
+def init_worker(exposure_matrix: FundExposureMatrix) -> None:
+    global _worker_aggregator
+    _worker_aggregator = BatchAggregator(exposure_matrix)
+
+
+def aggregate_in_worker(portfolios: Dict[str, pd.DataFrame], output_folder: str, chunk_size: int) -> dict:
+    return _worker_aggregator.aggregate(portfolios, output_folder=output_folder, chunk_size=chunk_size)
+
+
+def aggregate_many(exposure_matrix: FundExposureMatrix, portfolios: Dict[str, pd.DataFrame], n_processes: int = 1,
+                   output_folder: str = None, chunk_size: int = 500) -> dict:
+    """ aggregates many client portfolios against one fund universe, optionally across processes
+
+    Args:
+        exposure_matrix (FundExposureMatrix): weight matrix of the loaded fund universe
+        portfolios (Dict[str, pd.DataFrame]): client name as key, holdings (ticker, investment_amt, holding_type) as value
+        n_processes (int): number of worker processes. 1 aggregates in the current process
+        output_folder (str, optional): stream each client's holdings to <output_folder>/<client>.csv instead of returning DataFrames
+        chunk_size (int): number of clients multiplied against the fund universe at once
+
+    Returns:
+        dict: client name to a DataFrame of ticker and portfolio_holdings, or to the CSV it was saved in
+    """
+    if output_folder is not None:
+        os.makedirs(output_folder, exist_ok=True)
+
+    if n_processes <= 1 or len(portfolios) <= chunk_size:
+        return BatchAggregator(exposure_matrix).aggregate(portfolios, output_folder=output_folder, chunk_size=chunk_size)
+
+    clients = list(portfolios)
+    chunks = [{client: portfolios[client] for client in clients[i:i + chunk_size]} for i in range(0, len(clients), chunk_size)]
+    results = {}
+
+    # the fund universe is sent to each worker once rather than with every chunk
+    with ProcessPoolExecutor(max_workers=n_processes, initializer=init_worker, initargs=(exposure_matrix,)) as executor:
+        futures = [executor.submit(aggregate_in_worker, chunk, output_folder, chunk_size) for chunk in chunks]
+        for future in futures:
+            results.update(future.result())
+
+    return results
+
+
+def aggregate_portfolios(portfolios: Dict[str, pd.DataFrame], fund_holdings_pathway: str, n_processes: int = 1,
+                         output_folder: str = None, chunk_size: int = 500) -> dict:
+    """ aggregates many client portfolios, loading the fund universe in fund_holdings_pathway only once
+
+    Args:
+        portfolios (Dict[str, pd.DataFrame]): client name as key, portfolio holdings (ticker, investment_amt, holding_type) as value
+        fund_holdings_pathway (str): folder with the holdings file of each fund
+        n_processes (int): number of worker processes to spread the clients over
+        output_folder (str, optional): write each client's holdings to <output_folder>/<client>.csv as they are computed
+        chunk_size (int): number of clients aggregated in one matrix product
+
+    Returns:
+        dict: client name to a DataFrame like full_portfolio_holdings (securities with non-zero holdings only), or to the CSV it was saved in
+    """
+    exposure_matrix = FundExposureMatrix.from_folder(fund_holdings_pathway)
+    return aggregate_many(exposure_matrix, portfolios, n_processes=n_processes, output_folder=output_folder, chunk_size=chunk_size)
@@ -0,0 +1,89 @@
+import pandas as pd
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+# the pipeline modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nport_parsing import parse_nport_holdings
+
+from synthetic import generate_fund_filings, generate_security_universe
+
+
+def loop_parse(invstOrSecs: list) -> pd.DataFrame:
+    """ the row-at-a-time loop import_holdings_df used before parse_nport_holdings, kept as the baseline """
+    data = {'company_name': [], 'CUSIP': [], 'num_holdings': [], 'invested_amt_usd': [], 'percent_of_portfolio': [], 'country': []}
+    for holding in invstOrSecs:
+        if holding['cusip'] != "000000000":
+            data['company_name'].append(holding['name'])
+            data['CUSIP'].append(holding['cusip'])
+            data['num_holdings'].append(holding['balance'])
+            data['invested_amt_usd'].append(holding['valUSD'])
+            data['percent_of_portfolio'].append(holding['pctVal'])
+            data['country'].append(holding['invCountry'])
+    return pd.DataFrame.from_dict(data)
+
+
+PARSERS = {'loop': loop_parse, 'parse_nport_holdings': parse_nport_holdings}
+
+
+def time_parser(parser, invstOrSecs: list, repeat: int) -> list:
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser(invstOrSecs)
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def run(args) -> dict:
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'results': [],
+    }
+
+    securities = generate_security_universe(args.holdings, seed=args.seed)
+    filings = generate_fund_filings(1, securities, seed=args.seed, median_holdings=args.holdings, max_holdings=args.holdings)
+    invstOrSecs = next(iter(filings.values()))[2]['invstOrSecs']
+
+    for name, parser in PARSERS.items():
+        runs = time_parser(parser, invstOrSecs, args.repeat)
+        rows = len(parser(invstOrSecs))
+        report['results'].append({'stage': name, 'holdings': len(invstOrSecs), 'rows': rows,
+                                  'median_seconds': statistics.median(runs), 'min_seconds': min(runs),
+                                  'holdings_per_second': len(invstOrSecs) / statistics.median(runs)})
+
+    for result in report['results']:
+        print(f"{result['stage']:<24} {result['median_seconds'] * 1e3:8.1f} ms  {result['rows']:>7} rows", file=sys.stderr)
+
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Times parsing one large N-PORT filing against the old row-at-a-time loop")
+    parser.add_argument("--holdings", type=int, default=50_000, help="number of holdings in the synthetic filing")
+    parser.add_argument("--repeat", type=int, default=7, help="runs per parser, the median is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output = json.dumps(run(args), indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
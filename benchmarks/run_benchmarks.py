@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+# the pipeline modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_collection import DataImport
+from instrumentation import current_rss
+from portfolio_aggregation import PortfolioConstructor
+import yahoo_enrichment
+from yahoo_enrichment import YahooEnricher
+
+from synthetic import FakeFormNportApi, FakeMappingApi, fake_yf_ticker_class, generate_fund_filings, generate_security_universe
+
+
+def measure(func, trace_allocations: bool = False):
+    """ runs func and returns (result, seconds, peak memory in bytes)
+
+    Peak memory is the highest resident set size sampled while func runs. tracemalloc gives exact
+    Python allocation peaks but slows the stage down several times, so it is only used when asked.
+    """
+    peak = [current_rss() or 0]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(0.01):
+            peak[0] = max(peak[0], current_rss() or 0)
+
+    if trace_allocations:
+        tracemalloc.start()
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        result = func()
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+        if trace_allocations:
+            peak[0] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        elif current_rss() is None:
+            # no /proc (e.g. macOS): fall back to the process-wide peak
+            import resource
+            peak[0] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+    return result, elapsed, peak[0]
+
+
+def benchmark_import(filings: dict, securities: pd.DataFrame, folder: str, args) -> dict:
+    """ times DataImport.generate_and_save_holdings against fake sec-api backends """
+    nport_api = FakeFormNportApi(filings, latency=args.api_latency)
+    mapping_api = FakeMappingApi(securities, latency=args.api_latency)
+    list_of_funds = [(ticker, CIK, series) for ticker, (CIK, series, filing) in filings.items()]
+
+    DI = DataImport(list_of_funds, folder, max_workers=args.workers, requests_per_second=args.requests_per_second,
+                    storage_format=args.storage_format)
+    DI._nportAPI = nport_api
+    DI._mappingAPI = mapping_api
+
+    failed, elapsed, peak = measure(DI.generate_and_save_holdings, args.trace_allocations)
+    rows = sum(len(filing['invstOrSecs']) for CIK, series, filing in filings.values())
+
+    return {'stage': 'generate_and_save_holdings', 'seconds': elapsed, 'peak_memory_bytes': peak,
+            'funds': len(filings), 'rows': rows, 'funds_per_second': len(filings) / elapsed, 'rows_per_second': rows / elapsed,
+            'nport_calls': nport_api.calls, 'mapping_calls': mapping_api.calls, 'failed_funds': len(failed)}
+
+
+def benchmark_aggregation(filings: dict, folder: str, engine: str, args) -> dict:
+    """ times building a PortfolioConstructor over every saved fund """
+    funds = pd.DataFrame({'ticker': list(filings), 'investment_amt': 10_000.0})
+    stocks = pd.DataFrame({'ticker': ['S0', 'S1'], 'investment_amt': 2_000.0})
+
+    PC, elapsed, peak = measure(lambda: PortfolioConstructor(stocks, funds, folder, engine=engine), args.trace_allocations)
+    rows = PC.fund_holdings_dict.n_rows
+
+    return {'stage': f'PortfolioConstructor[{engine}]', 'seconds': elapsed, 'peak_memory_bytes': peak,
+            'funds': len(PC.fund_holdings_dict), 'rows': rows, 'funds_per_second': len(PC.fund_holdings_dict) / elapsed,
+            'rows_per_second': rows / elapsed, 'securities': len(PC.full_portfolio_holdings)}
+
+
+def benchmark_incremental(filings: dict, folder: str, args) -> dict:
+    """ times changing one fund position and reading full_portfolio_holdings back, as a rebalancing tool does """
+    funds = pd.DataFrame({'ticker': list(filings), 'investment_amt': 10_000.0})
+    stocks = pd.DataFrame({'ticker': ['S0', 'S1'], 'investment_amt': 2_000.0})
+    PC = PortfolioConstructor(stocks, funds, folder)
+    PC.update_position(funds['ticker'].iloc[0], 10_000.0)
+    PC.full_portfolio_holdings
+
+    def update_then_read():
+        latencies = []
+        for i in range(args.incremental_updates):
+            start = time.perf_counter()
+            PC.update_position(funds['ticker'].iloc[i % len(funds)], 5_000.0 + i)
+            PC.full_portfolio_holdings
+            latencies.append(time.perf_counter() - start)
+        return np.array(latencies)
+
+    latencies, elapsed, peak = measure(update_then_read, args.trace_allocations)
+
+    return {'stage': 'update_position+read', 'seconds': elapsed, 'peak_memory_bytes': peak, 'updates': len(latencies),
+            'securities': len(PC.full_portfolio_holdings), 'mean_ms': latencies.mean() * 1e3,
+            'p99_ms': np.percentile(latencies, 99) * 1e3, 'updates_per_second': len(latencies) / elapsed}
+
+
+def benchmark_enrichment(securities: pd.DataFrame, tickers: list, args) -> dict:
+    """ times YahooEnricher against a fake yfinance backend, without a metadata cache """
+    fake_ticker = fake_yf_ticker_class(securities, latency=args.yahoo_latency)
+    yahoo_enrichment.import_yfinance = lambda: SimpleNamespace(Ticker=fake_ticker)
+    enricher = YahooEnricher(cache=None, max_workers=args.enrichment_workers)
+
+    result, elapsed, peak = measure(lambda: enricher.enrich(tickers), args.trace_allocations)
+
+    return {'stage': 'enrichment', 'seconds': elapsed, 'peak_memory_bytes': peak,
+            'tickers': len(result), 'tickers_per_second': len(result) / elapsed}
+
+
+def run(args) -> dict:
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'results': [],
+    }
+
+    securities = generate_security_universe(args.securities, seed=args.seed)
+
+    for n_funds in args.funds:
+        filings = generate_fund_filings(n_funds, securities, seed=args.seed)
+
+        with tempfile.TemporaryDirectory() as root:
+            folder = os.path.join(root, "day")
+            os.mkdir(folder)
+
+            results = [benchmark_import(filings, securities, folder, args)]
+            for engine in args.engines:
+                results.append(benchmark_aggregation(filings, folder, engine, args))
+            if args.incremental_updates:
+                results.append(benchmark_incremental(filings, folder, args))
+
+        tickers = securities['ticker'].iloc[:args.enrichment_tickers].tolist()
+        results.append(benchmark_enrichment(securities, tickers, args))
+
+        for result in results:
+            result['n_funds'] = n_funds
+            report['results'].append(result)
+            print(f"{n_funds:>5} funds  {result['stage']:<32} {result['seconds']:8.3f}s  peak {result['peak_memory_bytes'] / 1e6:8.1f} MB", file=sys.stderr)
+
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the import, aggregation and enrichment stages on synthetic data")
+    parser.add_argument("--funds", type=int, nargs="+", default=[10, 100, 1000], help="fund universe sizes to benchmark (up to 5000)")
+    parser.add_argument("--securities", type=int, default=20_000, help="number of distinct securities in the synthetic market")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds added to every fake sec-api call")
+    parser.add_argument("--yahoo-latency", type=float, default=0.0, help="seconds added to every fake Yahoo Finance call")
+    parser.add_argument("--workers", type=int, default=8, help="DataImport max_workers")
+    parser.add_argument("--requests-per-second", type=float, default=1_000_000, help="DataImport rate limit")
+    parser.add_argument("--storage-format", default="csv", choices=["csv", "parquet", "arrow"])
+    parser.add_argument("--engines", nargs="+", default=["sparse", "pandas"], choices=["sparse", "pandas"])
+    parser.add_argument("--incremental-updates", type=int, default=200, help="position changes timed with a read after each, 0 skips the stage")
+    parser.add_argument("--enrichment-tickers", type=int, default=1000, help="number of tickers enriched per run")
+    parser.add_argument("--enrichment-workers", type=int, default=16)
+    parser.add_argument("--trace-allocations", action="store_true", help="report tracemalloc peaks instead of resident memory (slower)")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+    output = json.dumps(report, indent=2, default=lambda x: x.item() if isinstance(x, np.generic) else str(x))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
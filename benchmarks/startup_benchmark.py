@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# libraries that should only be loaded by the stages that need them
+HEAVY_MODULES = ["sec_api", "yfinance", "seaborn", "matplotlib", "plotly"]
+
+# what each CLI stage imports before it starts working
+STAGE_IMPORTS = {
+    "cli": "import cli",
+    "import": "import cli, portfolio_analysis",
+    "aggregate": "import cli, portfolio_analysis",
+    "enrich": "import cli, portfolio_analysis",
+    "report": "import cli, report_rendering, matplotlib.figure",
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{imports}
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, [x for x in {heavy!r} if x in sys.modules]]))
+"""
+
+
+def probe(imports: str) -> tuple:
+    """ imports modules in a fresh interpreter and returns (seconds, heavy modules loaded) """
+    output = subprocess.run([sys.executable, "-c", PROBE.format(imports=imports, heavy=HEAVY_MODULES)],
+                            cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    seconds, heavy = json.loads(output.strip().splitlines()[-1])
+    return seconds, heavy
+
+
+def process_seconds(argv: list) -> float:
+    """ wall time of a whole CLI process, interpreter start-up included """
+    import time
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *argv], cwd=ROOT, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def run(args) -> dict:
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'results': [],
+    }
+
+    help_runs = [process_seconds(["cli.py", "--help"]) for _ in range(args.repeat)]
+    report['results'].append({'stage': 'cli --help (process)', 'median_seconds': statistics.median(help_runs), 'heavy_modules': []})
+
+    for stage, imports in STAGE_IMPORTS.items():
+        runs = [probe(imports) for _ in range(args.repeat)]
+        report['results'].append({'stage': stage, 'median_seconds': statistics.median(x[0] for x in runs),
+                                  'heavy_modules': runs[-1][1]})
+
+    for module in HEAVY_MODULES:
+        runs = [probe(f"import {module}") for _ in range(args.repeat)]
+        report['results'].append({'stage': f'import {module}', 'median_seconds': statistics.median(x[0] for x in runs),
+                                  'heavy_modules': runs[-1][1]})
+
+    for result in report['results']:
+        print(f"{result['stage']:<24} {result['median_seconds']:8.3f}s  loads {', '.join(result['heavy_modules']) or '-'}", file=sys.stderr)
+
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Times how long each CLI stage takes to start and which heavy libraries it loads")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per measurement, the median is reported")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output = json.dumps(run(args), indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+import re
+import time
+
+
+COUNTRIES = ["US", "GB", "JP", "DE", "FR", "CA", "CH", "CN", "AU", "KR"]
+COUNTRY_NAMES = {"US": "United States", "GB": "United Kingdom", "JP": "Japan", "DE": "Germany", "FR": "France",
+                 "CA": "Canada", "CH": "Switzerland", "CN": "China", "AU": "Australia", "KR": "South Korea"}
+SECTORS = ["Technology", "Healthcare", "Financial Services", "Industrials", "Consumer Cyclical",
+           "Consumer Defensive", "Energy", "Utilities", "Real Estate", "Basic Materials", "Communication Services"]
+
+
+def generate_security_universe(n_securities: int, seed: int = 0) -> pd.DataFrame:
+    """ returns a table of securities with CUSIP, ISIN, ticker, name, country, sector, industry and market cap
+
+    Market caps are log-normal and a security's popularity (how likely funds are to hold it) grows
+    with its market cap, which gives the heavy overlap between broad index funds seen in practice.
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(n_securities)
+
+    market_cap = np.exp(rng.normal(22, 1.8, n_securities))
+    # ~70% domestic, the rest spread over other countries
+    country = np.where(rng.random(n_securities) < 0.7, "US", rng.choice(COUNTRIES[1:], n_securities))
+    sector = rng.choice(SECTORS, n_securities)
+
+    return pd.DataFrame({
+        'CUSIP': [f"{x:08d}" + str(x % 10) for x in ids],
+        'ISIN': [f"{c}{x:09d}{x % 10}" for c, x in zip(country, ids)],
+        'ticker': [f"S{x}" for x in ids],
+        'company_name': [f"Company {x}" for x in ids],
+        'country': country,
+        'sector': sector,
+        'industry': [f"{s} {x % 7}" for s, x in zip(sector, ids)],
+        'market_cap': market_cap,
+        'popularity': market_cap / market_cap.sum(),
+    })
+
+
+def generate_fund_filings(n_funds: int, securities: pd.DataFrame, seed: int = 0, median_holdings: int = 150,
+                          max_holdings: int = 5000) -> dict:
+    """ returns N-PORT filings shaped like the sec-api FormNportApi response, one per fund
+
+    Holdings counts are log-normal around median_holdings (a few total-market funds hold thousands
+    of securities), and holdings are drawn in proportion to each security's popularity. Like many
+    international funds, half of the non-US holdings are reported with an ISIN and no CUSIP.
+
+    Returns:
+        dict: fund ticker to (CIK, series, filing dict)
+    """
+    rng = np.random.default_rng(seed + 1)
+    n_securities = len(securities)
+    counts = np.clip(np.exp(rng.normal(np.log(median_holdings), 1.0, n_funds)).astype(int), 10, min(max_holdings, n_securities))
+    popularity = securities['popularity'].to_numpy()
+    market_cap = securities['market_cap'].to_numpy()
+    no_CUSIP = (securities['country'].to_numpy() != "US") & (np.arange(n_securities) % 2 == 1)
+    filings = {}
+
+    for i, count in enumerate(counts):
+        held = rng.choice(n_securities, size=count, replace=False, p=popularity)
+        weights = market_cap[held] * rng.uniform(0.5, 1.5, count)
+        pct = 100 * weights / weights.sum()
+        net_assets = float(np.exp(rng.normal(21, 1.5)))
+        CIK = f"{1000000 + i // 5:010d}"  # a handful of series per filer, like real fund families
+        series = f"S{i:09d}"
+
+        invstOrSecs = [
+            {'name': securities['company_name'].iat[h], 'lei': "N/A", 'title': securities['company_name'].iat[h], 'cusip': "000000000" if no_CUSIP[h] else securities['CUSIP'].iat[h],
+             'balance': float(p * net_assets / 100 / 50), 'valUSD': float(p * net_assets / 100), 'pctVal': float(p),
+             'invCountry': securities['country'].iat[h], 'identifiers': {'isin': {'value': securities['ISIN'].iat[h]}},
+             'assetCat': "EC", 'issuerCat': "CORP"}
+            for h, p in zip(held, pct)
+        ]
+        filing = {'accessionNo': f"0000000000-24-{i:06d}", 'filedAt': "2024-03-01T16:00:00-05:00",
+                  'genInfo': {'regCik': CIK, 'seriesId': series}, 'invstOrSecs': invstOrSecs}
+        filings[f"FUND{i}"] = (CIK, series, filing)
+
+    return filings
+
+
+class FakeFormNportApi:
+    """ stands in for sec_api.FormNportApi, answering the queries DataImport makes after a fixed latency """
+
+    def __init__(self, filings: dict, latency: float = 0.0):
+        self._latency = latency
+        self._by_series = {series: filing for CIK, series, filing in filings.values()}
+        self._by_accession = {filing['accessionNo']: filing for CIK, series, filing in filings.values()}
+        self._by_CIK = {}
+        for CIK, series, filing in filings.values():
+            self._by_CIK.setdefault(CIK, []).append(filing)
+        self.calls = 0
+
+    def get_data(self, query: dict) -> dict:
+        self.calls += 1
+        time.sleep(self._latency)
+        query_string = query['query']['query_string']['query']
+        start, size = int(query.get('from', 0)), int(query.get('size', 10))
+
+        series = re.search(r"genInfo\.seriesId:(\S+)", query_string)
+        accession = re.search(r'accessionNo:"([^"]+)"', query_string)
+        CIK = re.search(r"genInfo\.regCik:(\S+)", query_string)
+
+        if series:
+            matches = [self._by_series[series.group(1)]] if series.group(1) in self._by_series else []
+        elif accession:
+            matches = [self._by_accession[accession.group(1)]] if accession.group(1) in self._by_accession else []
+        elif CIK:
+            matches = self._by_CIK.get(CIK.group(1), [])
+        else:
+            matches = []
+
+        return {'filings': matches[start:start + size]}
+
+
+class FakeMappingApi:
+    """ stands in for sec_api.MappingApi """
+
+    def __init__(self, securities: pd.DataFrame, latency: float = 0.0):
+        self._latency = latency
+        self._tickers = dict(zip(securities['CUSIP'], securities['ticker']))
+        self.calls = 0
+
+    def resolve(self, parameter: str, value: str) -> list:
+        self.calls += 1
+        time.sleep(self._latency)
+        ticker = self._tickers.get(value)
+        return [{'ticker': ticker}] if ticker is not None else []
+
+
+def fake_yf_ticker_class(securities: pd.DataFrame, latency: float = 0.0):
+    """ returns a stand-in for yfinance.Ticker whose info comes from the synthetic security universe """
+    info_by_ticker = {
+        row.ticker: {'regularMarketPrice': 100.0, 'country': COUNTRY_NAMES[row.country], 'sector': row.sector,
+                     'industry': row.industry, 'marketCap': row.market_cap}
+        for row in securities.itertuples()
+    }
+
+    class FakeTicker:
+        def __init__(self, ticker: str):
+            self._ticker = ticker
+
+        @property
+        def info(self) -> dict:
+            time.sleep(latency)
+            return info_by_ticker.get(self._ticker, {'regularMarketPrice': None})
+
+    return FakeTicker
@@ -0,0 +1,153 @@
+""" command-line entry point running the README steps as separate stages
+
+    python cli.py import --holdings example_holdings.csv
+    python cli.py aggregate --holdings example_holdings.csv
+    python cli.py enrich --holdings example_holdings.csv
+    python cli.py report --holdings example_holdings.csv
+    python cli.py serve --holdings-root fund_holdings
+
+Stages hand over through files (fund_holdings/<date>, full_portfolio_holdings.csv), so each can
+run on its own, e.g. from cron. The pipeline modules are imported inside each command: sec-api,
+yfinance and the plotting libraries are only loaded by the stages that use them.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+
+# charts drawn by the report stage by default, data_visualizations.CHARTS without map_graph, whose PNG and SVG
+# need kaleido. Kept here so that --help does not import pandas
+REPORT_CHARTS = ["compareTotalCount", "compareSumbyNation", "CompareFiveUS", "compareSectorUS", "distribution",
+                 "compareHolding", "compareCapsize"]
+
+
+def portfolio_analysis(args):
+    from portfolio_analysis import PortfolioAnalysis
+    return PortfolioAnalysis(args.holdings, storage_format=args.storage_format)
+
+
+def save_run_report(PA, args) -> None:
+    if args.run_report:
+        PA.save_run_report(args.run_report)
+
+
+def run_import(args) -> int:
+    """ downloads the holdings of every fund in the portfolio into fund_holdings/<date> """
+    PA = portfolio_analysis(args)
+    failed_funds = PA.import_fund_data(max_workers=args.workers, verify_mode=args.verify)
+    save_run_report(PA, args)
+    if failed_funds:
+        print(json.dumps(failed_funds, indent=2), file=sys.stderr)
+    return 1 if failed_funds else 0
+
+
+def run_aggregate(args) -> int:
+    """ aggregates the portfolio against the fund holdings already downloaded today """
+    PA = portfolio_analysis(args)
+    PA.aggregate_portfolio(look_through_depth=args.look_through_depth, materiality=args.materiality)
+    PA.save_portfolio_holdings(args.output)
+    save_run_report(PA, args)
+    return 0
+
+
+def run_enrich(args) -> int:
+    """ adds Yahoo Finance country, sector, industry and market cap to aggregated holdings """
+    PA = portfolio_analysis(args)
+    PA.load_aggregated_holdings(args.input)
+    PA.add_additional_information_to_stock_holdings(max_workers=args.workers, resume=args.resume)
+    PA.save_portfolio_holdings(args.output or args.input)
+    save_run_report(PA, args)
+    return 0
+
+
+def run_report(args) -> int:
+    """ renders the DataVisualizations charts of enriched holdings to files, with the exposure cube they are drawn from
+
+    --input may be a folder of enriched holdings CSVs, one per client, in which case --holdings is
+    either one portfolio CSV for all of them or a folder of <client>.csv files, and each client's
+    report goes to <output-folder>/<client>.
+    """
+    from report_rendering import render_report, render_reports
+
+    if not os.path.isdir(args.input):
+        render_report(args.holdings, args.input, args.output_folder, charts=args.charts, formats=args.formats)
+        return 0
+
+    reports = {}
+    for filename in sorted(os.listdir(args.input)):
+        if filename.endswith(".csv"):
+            holdings = os.path.join(args.holdings, filename) if os.path.isdir(args.holdings) else args.holdings
+            reports[filename.removesuffix(".csv")] = (holdings, os.path.join(args.input, filename))
+    results = render_reports(reports, args.output_folder, n_processes=args.processes, charts=args.charts, formats=args.formats)
+
+    return 1 if any(not x for x in results.values()) else 0
+
+
+def run_serve(args) -> int:
+    """ keeps the latest fund universe in memory and answers aggregation requests over HTTP until interrupted """
+    from aggregation_server import AggregationServer
+
+    server = AggregationServer(holdings_root=args.holdings_root, folder_pathway=args.folder, host=args.host, port=args.port,
+                               metadata_cache_pathway=args.metadata_cache, reload_interval=args.reload_interval)
+    server.run()
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate the holdings of a portfolio of funds and stocks")
+    parser.add_argument("--log-level", default="WARNING", help="logging level, e.g. INFO or DEBUG")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_stage(name, func, help):
+        stage = subparsers.add_parser(name, help=help)
+        stage.add_argument("--holdings", default="example_holdings.csv", help="portfolio holdings CSV in the layout of example_holdings.csv")
+        stage.add_argument("--storage-format", default="csv", choices=["csv", "parquet", "arrow"], help="format of the saved fund holdings")
+        stage.add_argument("--run-report", help="save a JSON report of time, API calls and cache hits to this file")
+        stage.set_defaults(func=func)
+        return stage
+
+    stage = add_stage("import", run_import, "download fund holdings from sec-api")
+    stage.add_argument("--workers", type=int, default=1, help="number of funds downloaded concurrently")
+    stage.add_argument("--verify", default="fast", choices=["none", "fast", "full"],
+                       help="check of already downloaded files before skipping them: sizes (fast) or content hashes (full)")
+
+    stage = add_stage("aggregate", run_aggregate, "aggregate the portfolio into its underlying holdings")
+    stage.add_argument("--look-through-depth", type=int, default=0, help="levels of funds held by funds to expand")
+    stage.add_argument("--materiality", type=float, default=0.0, help="percent below which nested funds are not expanded")
+    stage.add_argument("--output", default="full_portfolio_holdings.csv")
+
+    stage = add_stage("enrich", run_enrich, "add Yahoo Finance information to aggregated holdings")
+    stage.add_argument("--input", default="full_portfolio_holdings.csv", help="aggregated holdings to enrich")
+    stage.add_argument("--output", help="defaults to overwriting --input")
+    stage.add_argument("--workers", type=int, default=8, help="maximum Yahoo Finance requests in flight")
+    stage.add_argument("--resume", action="store_true", help="continue an interrupted enrichment from its journal")
+
+    stage = add_stage("report", run_report, "save charts of enriched holdings")
+    stage.add_argument("--input", default="full_portfolio_holdings.csv", help="enriched aggregated holdings, or a folder of them")
+    stage.add_argument("--output-folder", default="report")
+    stage.add_argument("--charts", nargs="+", default=REPORT_CHARTS, choices=REPORT_CHARTS + ["map_graph"])
+    stage.add_argument("--formats", nargs="+", default=["png"], choices=["png", "svg", "html"], help="map_graph needs kaleido for png and svg")
+    stage.add_argument("--processes", type=int, default=1, help="worker processes when --input is a folder")
+
+    stage = subparsers.add_parser("serve", help="answer aggregation requests against a fund universe kept in memory")
+    stage.add_argument("--holdings-root", default="fund_holdings", help="folder of the dated holdings folders, the latest is served")
+    stage.add_argument("--folder", help="serve this holdings folder rather than the latest dated one")
+    stage.add_argument("--host", default="127.0.0.1")
+    stage.add_argument("--port", type=int, default=8765)
+    stage.add_argument("--metadata-cache", help="Yahoo Finance metadata cache (SQLite) for requests asking for metadata")
+    stage.add_argument("--reload-interval", type=float, default=5.0, help="seconds between checks for new holdings, 0 to never reload")
+    stage.set_defaults(func=run_serve)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import numpy as np
+
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from typing import Dict, Iterable
+
+
+class CUSIPCache:
+    """ on-disk SQLite store of CUSIP to ticker resolutions
+
+    Successful lookups are kept for ``ttl_days``. CUSIPs the mapping API could not resolve are
+    stored as negative entries (NULL ticker) and kept for ``negative_ttl_days`` so they are not
+    re-queried on every run.
+    """
+
+    def __init__(self, db_pathway: str, ttl_days: float = 30, negative_ttl_days: float = 7):
+        self._db_pathway = db_pathway
+        self._ttl_seconds = ttl_days * 24 * 60 * 60
+        self._negative_ttl_seconds = negative_ttl_days * 24 * 60 * 60
+        self._lock = threading.Lock()
+        self.create_table()
+
+    @property
+    def db_pathway(self):
+        return self._db_pathway
+
+    @property
+    def ttl_seconds(self):
+        return self._ttl_seconds
+
+    @property
+    def negative_ttl_seconds(self):
+        return self._negative_ttl_seconds
+
+    @contextmanager
+    def connect(self):
+        """ yields a connection that commits (or rolls back) and is closed when the block exits """
+        with closing(sqlite3.connect(self.db_pathway, timeout=30)) as conn, conn:
+            yield conn
+
+    def create_table(self) -> None:
+        """ creates the mapping table if it does not exist yet """
+        with self._lock, self.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cusip_ticker ("
+                "cusip TEXT PRIMARY KEY, "
+                "ticker TEXT, "
+                "resolved_at REAL NOT NULL)"
+            )
+
+    def get_many(self, CUSIPs: Iterable[str]) -> Dict[str, str]:
+        """ returns the unexpired cached tickers for the CUSIPs passed in
+
+        Args:
+            CUSIPs (Iterable[str]): CUSIPs to look up
+
+        Returns:
+            Dict[str, str]: CUSIP to ticker. Negative entries map to np.nan, expired or unknown CUSIPs are left out
+        """
+        CUSIPs = list(dict.fromkeys(CUSIPs))
+        now = time.time()
+        result = {}
+
+        with self._lock, self.connect() as conn:
+            # stay under SQLite's bound parameter limit
+            for i in range(0, len(CUSIPs), 500):
+                chunk = CUSIPs[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT cusip, ticker, resolved_at FROM cusip_ticker WHERE cusip IN ({placeholders})", chunk
+                ).fetchall()
+                for CUSIP, ticker, resolved_at in rows:
+                    ttl = self.ttl_seconds if ticker is not None else self.negative_ttl_seconds
+                    if now - resolved_at <= ttl:
+                        result[CUSIP] = ticker if ticker is not None else np.nan
+
+        return result
+
+    def set_many(self, mapping: Dict[str, str]) -> None:
+        """ stores resolutions in the cache. NaN/None tickers are stored as negative entries
+
+        Args:
+            mapping (Dict[str, str]): CUSIP to ticker (or np.nan when it could not be resolved)
+        """
+        now = time.time()
+        rows = [(CUSIP, ticker if isinstance(ticker, str) else None, now) for CUSIP, ticker in mapping.items()]
+
+        with self._lock, self.connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO cusip_ticker (cusip, ticker, resolved_at) VALUES (?, ?, ?)", rows
+            )
@@ -4,16 +4,66 @@ import pandas as pd
 from datetime import date
 import logging
 import os
-import glob
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from sec_api import FormNportApi
-from sec_api import MappingApi
+from cusip_cache import CUSIPCache
+from download_manifest import DownloadManifest
+from filing_index import FilingIndex
+from holdings_storage import holdings_file_pathway, replace_fund_holdings
+from instrumentation import RunMetrics
+from nport_parsing import parse_nport_holdings
+from rate_limiting import TokenBucket, call_with_retries
+from snapshot_store import SnapshotStore
 
 
 class DataImport:
-    def __init__(self, list_of_funds: list, save_folder_pathway: str):
+    def __init__(self, list_of_funds: list, save_folder_pathway: str, cusip_cache_pathway: str = None, filing_index_pathway: str = None,
+                 max_workers: int = 1, requests_per_second: float = 5, max_retries: int = 3, backoff_base: float = 1.0,
+                 storage_format: str = "csv", metrics: RunMetrics = None, snapshot_store_pathway: str = None, verify_mode: str = "fast",
+                 chunk_size: int = 50):
+        """
+        Args:
+            list_of_funds (list): (ticker, CIK, series) tuples of the funds to download
+            save_folder_pathway (str): folder the fund holdings are saved in
+            cusip_cache_pathway (str, optional): SQLite file for the CUSIP to ticker cache. Defaults to the parent of save_folder_pathway
+            filing_index_pathway (str, optional): SQLite file for the latest filing index. Defaults to the parent of save_folder_pathway
+            max_workers (int): number of funds downloaded concurrently. 1 downloads them one after another
+            requests_per_second (float): sec-api request quota shared by all workers
+            max_retries (int): retries for a failed API request before the fund is marked as failed
+            backoff_base (float): seconds to wait before the first retry, doubled on each further retry
+            storage_format (str): format the holdings are saved in, "csv", "parquet" or "arrow"
+            metrics (RunMetrics, optional): collects API call, cache and per-fund timings. A new one is created if not given
+            snapshot_store_pathway (str, optional): folder of the holdings snapshots save_folder_pathway links to. Defaults to snapshots in the parent of save_folder_pathway
+            verify_mode (str): check of the files in the download manifest before skipping their funds, "fast" (file sizes), "full" (content hashes) or "none"
+            chunk_size (int): number of funds downloaded before their tickers are resolved and they are saved, so an interrupted run keeps the chunks already saved
+        """
         self._list_of_funds = list_of_funds
         self._save_folder_pathway = save_folder_pathway
+        self._nportAPI = None
+        self._mappingAPI = None
+        self._max_workers = max(1, max_workers)
+        self._rate_limiter = TokenBucket(requests_per_second)
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._failed_funds = {}
+        self._storage_format = storage_format
+        self._metrics = metrics if metrics is not None else RunMetrics()
+        self._manifest = DownloadManifest(save_folder_pathway)
+        self._verify_mode = verify_mode
+        self._chunk_size = max(1, chunk_size)
+
+        # the CUSIP cache and filing index are shared across days so they live next to the dated holdings folders
+        holdings_root = os.path.dirname(os.path.normpath(save_folder_pathway))
+        if cusip_cache_pathway is None:
+            cusip_cache_pathway = os.path.join(holdings_root, "cusip_ticker_cache.sqlite")
+        if filing_index_pathway is None:
+            filing_index_pathway = os.path.join(holdings_root, "filing_index.sqlite")
+        if snapshot_store_pathway is None:
+            snapshot_store_pathway = os.path.join(holdings_root, "snapshots")
+        self._cusip_cache = CUSIPCache(cusip_cache_pathway)
+        self._filing_index = FilingIndex(filing_index_pathway)
+        self._snapshot_store = SnapshotStore(snapshot_store_pathway)
 
     @property
     def API_TOKEN(self):
@@ -35,16 +85,67 @@ class DataImport:
     
     @property
     def nportAPI(self):
-        return FormNportApi(self.API_TOKEN)
+        if self._nportAPI is None:
+            # sec_api is only imported once a request is made, so cached runs do not pay for it
+            from sec_api import FormNportApi
+            self._nportAPI = FormNportApi(self.API_TOKEN)
+        return self._nportAPI
 
     @property
     def mappingAPI(self):
-        return MappingApi(self.API_TOKEN)
+        if self._mappingAPI is None:
+            from sec_api import MappingApi
+            self._mappingAPI = MappingApi(self.API_TOKEN)
+        return self._mappingAPI
+
+    @property
+    def cusip_cache(self):
+        return self._cusip_cache
+
+    @property
+    def filing_index(self):
+        return self._filing_index
+
+    @property
+    def snapshot_store(self):
+        return self._snapshot_store
+
+    @property
+    def manifest(self):
+        return self._manifest
+
+    @property
+    def verify_mode(self):
+        return self._verify_mode
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def rate_limiter(self):
+        return self._rate_limiter
+
+    @property
+    def failed_funds(self):
+        return self._failed_funds
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def storage_format(self):
+        return self._storage_format
 
     @property
     def previously_downloaded_funds(self):
-        all_files = glob.glob(os.path.join(self.save_folder_pathway + '/', "*.csv"))
-        return [x.removeprefix(self.save_folder_pathway + '/').removesuffix('.csv') for x in all_files]
+        """ funds whose complete holdings file is recorded in the folder's download manifest """
+        return list(self.manifest)
 
     def import_API_token(self) -> str:
         """ tests if API token exists and returns value if it does """
@@ -59,52 +160,144 @@ class DataImport:
         return token_value
 
 
-    def query_10_filings(self, CIK: str, start: int) -> None:
-        """ queries API to pull latest fund holdings and saves as a CSV """
-        
-        nportAPI = self.nportAPI
-        
-        response = nportAPI.get_data(
-            {
-                "query": {"query_string": {
-                    "query": f"genInfo.regCik:{CIK}"
-                    }
-                },
-                "from": str(start),
-                "size": "10",
-            }
-        )
-
-        return response
+    def call_API(self, func, *args, description: str = "sec-api request", endpoint: str = "nport"):
+        """ calls an sec-api endpoint under the shared rate limit, retrying with exponential backoff
+
+        Args:
+            func (Callable): API client method to call with args
+            description (str): used in log messages
+            endpoint (str): name the call is recorded under in metrics
+        """
+        def timed_call(*args):
+            start = time.perf_counter()
+            try:
+                result = func(*args)
+            except Exception:
+                self.metrics.record_api_call(endpoint, time.perf_counter() - start, success=False)
+                raise
+            self.metrics.record_api_call(endpoint, time.perf_counter() - start)
+            return result
+
+        return call_with_retries(timed_call, *args, max_retries=self._max_retries, backoff_base=self._backoff_base,
+                                 rate_limiter=self.rate_limiter, description=description,
+                                 on_retry=lambda e: self.metrics.record_retry(endpoint, str(e)))
+
+    def query_latest_filing(self, CIK: str, series: str, filed_since: str = None) -> dict:
+        """ queries API for the most recent filing of a single series in one request
+
+        Args:
+            CIK (str): CIK of filing institution
+            series (str): Series corresponding to the specific being held
+            filed_since (str, optional): only consider filings filed on or after this date (YYYY-MM-DD)
+
+        Returns:
+            dict: latest filing, None if there is no filing matching the query
+        """
+        query_string = f"genInfo.regCik:{CIK} AND genInfo.seriesId:{series}"
+        if filed_since is not None:
+            query_string += f" AND filedAt:[{filed_since} TO *]"
+
+        query = {
+            "query": {"query_string": {"query": query_string}},
+            "from": "0",
+            "size": "1",
+            "sort": [{"filedAt": {"order": "desc"}}],
+        }
+        response = self.call_API(self.nportAPI.get_data, query, description=f"N-PORT query for CIK {CIK} and Series {series}")
+
+        if not response or not response.get('filings'):
+            return None
+
+        return response['filings'][0]
+
+    def query_filing_by_accession(self, accession_no: str) -> dict:
+        """ queries API for a single filing by its accession number """
+        query = {
+            "query": {"query_string": {"query": f'accessionNo:"{accession_no}"'}},
+            "from": "0",
+            "size": "1",
+        }
+        response = self.call_API(self.nportAPI.get_data, query, description=f"N-PORT query for accession {accession_no}")
+
+        if not response or not response.get('filings'):
+            return None
+
+        return response['filings'][0]
     
-    def query_holdings(self, ticker: str, CIK: str, series: str, max_tries: int=10) -> dict:
-        """ goes through 10 filings at a time until it finds the correct holdings
+    def query_holdings(self, ticker: str, CIK: str, series: str) -> dict:
+        """ finds the latest filing for a fund, filtering on the series in the query itself
 
+        If the fund is already in the filing index only filings on or after the indexed filing date
+        are queried, otherwise the latest filing for the series is requested directly.
 
         Args:
             ticker (str): ticker of fund (used for error logging)
             CIK (str): CIK of filing institution
             series (str): Series corresponding to the specific being held
-            max_tries (int): maximum number of times to query the API. Will pull 10 * max_tries total holdings
         """
-        
-        correct_filing = None
-        
-        # look through first 100 filings
-        for i in range(max_tries):
-            response = self.query_10_filings(CIK, start=i)
-            
-            for filing in response['filings']:
-                if filing['genInfo']['seriesId'] == series:
-                    correct_filing = filing
-                    break
-        
-        if response is None:
-            logging.error(f"Unable to locate any filings for ticker: {ticker} with CIK: {CIK}")
-        elif correct_filing is None:
+        indexed_filing = self.filing_index.get(CIK, series)
+        self.metrics.record_cache("filing_index", hits=int(indexed_filing is not None), misses=int(indexed_filing is None))
+        filed_since = indexed_filing['filed_at'][:10] if indexed_filing is not None else None
+
+        correct_filing = self.query_latest_filing(CIK, series, filed_since=filed_since)
+        if correct_filing is None and indexed_filing is not None:
+            correct_filing = self.query_filing_by_accession(indexed_filing['accession_no'])
+
+        if correct_filing is None:
             logging.error(f"Unable to locate filing for ticker: {ticker} with CIK: {CIK} and Series: {series}")
         else:
-            return correct_filing 
+            self.filing_index.update(CIK, series, correct_filing['accessionNo'], correct_filing['filedAt'])
+            return correct_filing
+
+    def refresh_filing_index(self, page_size: int = 50, funds: list = None) -> dict:
+        """ updates the filing index with filings made since the last indexed filing of each CIK
+
+        Args:
+            page_size (int): number of filings requested per API call
+            funds (list, optional): (ticker, CIK, series) tuples to refresh. Defaults to list_of_funds
+
+        Returns:
+            dict: fund ticker to True if a newer filing than the indexed one was found
+        """
+        funds_by_CIK = {}
+        for ticker, CIK, series in (funds if funds is not None else self.list_of_funds):
+            funds_by_CIK.setdefault(CIK, {})[series] = ticker
+
+        changed = {}
+        for CIK, tickers_by_series in funds_by_CIK.items():
+            indexed_filings = [self.filing_index.get(CIK, series) for series in tickers_by_series]
+            changed.update({ticker: False for ticker in tickers_by_series.values()})
+
+            query_string = f"genInfo.regCik:{CIK}"
+            if all(x is not None for x in indexed_filings):
+                # only the filings newer than the least recently updated series are needed
+                query_string += f" AND filedAt:[{min(x['filed_at'] for x in indexed_filings)[:10]} TO *]"
+
+            seen_series = set()
+            start = 0
+            while True:
+                query = {
+                    "query": {"query_string": {"query": query_string}},
+                    "from": str(start),
+                    "size": str(page_size),
+                    "sort": [{"filedAt": {"order": "desc"}}],
+                }
+                response = self.call_API(self.nportAPI.get_data, query, description=f"N-PORT index refresh for CIK {CIK}")
+                filings = response.get('filings', []) if response else []
+
+                for filing in filings:
+                    series = filing['genInfo']['seriesId']
+                    if series in tickers_by_series and series not in seen_series:
+                        # filings come newest first so the first one seen for a series is its latest
+                        seen_series.add(series)
+                        if self.filing_index.update(CIK, series, filing['accessionNo'], filing['filedAt']):
+                            changed[tickers_by_series[series]] = True
+
+                if len(filings) < page_size or len(seen_series) == len(tickers_by_series):
+                    break
+                start += page_size
+
+        return changed
     
     def import_holdings_df(self, ticker: str, CIK: str, series: str) -> pd.DataFrame:
         """ locates latest filing and returns holdings as a DataFrame
@@ -115,23 +308,12 @@ class DataImport:
             series (str): Series corresponding to the specific being held
 
         Returns:
-            pd.DataFrame: DataFrame of holdings information
+            pd.DataFrame: DataFrame of holdings information, including holdings without a CUSIP
         """
-        data = {'company_name': [], 'CUSIP': [], 'num_holdings': [], 'invested_amt_usd': [], 'percent_of_portfolio': [], 'country': []}
-
-        holdings = self.query_holdings(ticker, CIK, series, 50)
+        holdings = self.query_holdings(ticker, CIK, series)
         
         if holdings is not None:
-            for holding in holdings['invstOrSecs']:
-                if holding['cusip'] != "000000000": # Temporarily excluding holdings without CUSIPs
-                    data['company_name'].append(holding['name'])
-                    data['CUSIP'].append(holding['cusip'])
-                    data['num_holdings'].append(holding['balance'])
-                    data['invested_amt_usd'].append(holding['valUSD'])
-                    data['percent_of_portfolio'].append(holding['pctVal'])
-                    data['country'].append(holding['invCountry'])
-            result = pd.DataFrame.from_dict(data)
-        
+            result = parse_nport_holdings(holdings['invstOrSecs'])
         else:
             result = None
 
@@ -146,37 +328,246 @@ class DataImport:
         Returns:
             str: ticker of the company that issued that security
         """
-        mappingAPI = self.mappingAPI
-        
+        return self.resolve_CUSIPs([CUSIP])[CUSIP]
+
+    def query_CUSIP_ticker(self, CUSIP: str) -> str:
+        """ queries the mapping API for a single CUSIP
+
+        Returns:
+            str: ticker of the issuer, np.nan if the API has no match. Raises if the request itself fails
+        """
         try:
-            result = mappingAPI.resolve("cusip", CUSIP)[0]['ticker']
-        except:
+            result = self.call_API(self.mappingAPI.resolve, "cusip", CUSIP, description=f"CUSIP lookup for {CUSIP}", endpoint="mapping")[0]['ticker']
+        except (IndexError, KeyError, TypeError):
             result = np.nan
             logging.error(f"Unable to find ticker symbol for CUSIP: {CUSIP}")
-        
+
         return result
 
-    def generate_and_save_holdings(self) -> None:
-        """ goes through list of funds, pulls their holdings, and saves holdings as CSV """
-        
-        for ticker, CIK, series in self.list_of_funds:
-            if ticker not in self.previously_downloaded_funds: # check that not downloaded already today to speed up process
-                fund_holdings = self.import_holdings_df(ticker, CIK, series)
-                if fund_holdings is not None:
-                    fund_holdings['ticker'] = fund_holdings['CUSIP'].apply(lambda x: self.CUSIP_to_ticker(x))
-                    self.save_fund_holdings(fund_holdings=fund_holdings, ticker=ticker)
+    def resolve_CUSIPs(self, CUSIPs) -> dict:
+        """ resolves a collection of CUSIPs to tickers, only querying the API for ones not in the cache
+
+        Args:
+            CUSIPs (iterable): CUSIPs to resolve, duplicates are only looked up once
+
+        Returns:
+            dict: CUSIP to ticker (np.nan when unresolvable)
+        """
+        CUSIPs = list(dict.fromkeys(CUSIPs))
+        resolved = self.cusip_cache.get_many(CUSIPs)
+        to_query = [x for x in CUSIPs if x not in resolved]
+        self.metrics.record_cache("cusip_cache", hits=len(CUSIPs) - len(to_query), misses=len(to_query))
+        logging.info(f"Resolving {len(to_query)} of {len(CUSIPs)} unique CUSIPs through the mapping API")
+
+        newly_resolved = {}
+        for CUSIP, (ticker, error) in zip(to_query, self.map_concurrently(self.query_CUSIP_ticker, to_query)):
+            if error is None:
+                newly_resolved[CUSIP] = ticker
             else:
-                logging.info(f"Already downloaded holdings for {ticker} today")
-                
-    def save_fund_holdings(self, fund_holdings: pd.DataFrame, ticker: str) -> None:
-        """ saves fund holdings in the current folder
+                # request failures are not cached so the CUSIP is retried on the next run
+                resolved[CUSIP] = np.nan
+                logging.error(f"Mapping API request failed for CUSIP: {CUSIP}: {error}")
+
+        self.cusip_cache.set_many(newly_resolved)
+        resolved.update(newly_resolved)
+
+        return resolved
+
+    def map_concurrently(self, func, items: list) -> list:
+        """ calls func on every item using up to max_workers threads
+
+        Returns:
+            list: (result, exception) tuple for each item, in the same order as items
+        """
+        def run(item):
+            try:
+                return func(*item) if isinstance(item, tuple) else func(item), None
+            except Exception as e:
+                return None, e
+
+        if self.max_workers == 1:
+            return [run(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(run, items))
+
+    def generate_and_save_holdings(self) -> dict:
+        """ goes through list of funds, pulls their holdings, and saves them in storage_format
+
+        Funds are downloaded chunk_size at a time (concurrently when max_workers > 1), and each chunk's
+        CUSIPs are resolved to tickers in a single deduplicated pass before its funds are saved and
+        the manifest is written, so an interrupted run only downloads the unfinished chunk again. A
+        fund that fails to download does not stop the others; failures are collected and reported at
+        the end, and recorded in the download manifest along with the import finishing.
+
+        Returns:
+            dict: fund ticker to the reason its holdings could not be downloaded
+        """
+        with self.metrics.stage("import_fund_holdings") as stage:
+            self.manifest.start_import()
+            invalid_funds = self.manifest.verify(self.verify_mode)
+            funds_to_download = []
+
+            for ticker, CIK, series in self.list_of_funds:
+                if ticker not in self.manifest: # check that not downloaded already today to speed up process
+                    funds_to_download.append((ticker, CIK, series))
+                else:
+                    logging.info(f"Already downloaded holdings for {ticker} today")
+
+            funds_skipped = len(self.list_of_funds) - len(funds_to_download)
+            unchanged_funds = self.link_unchanged_funds(funds_to_download)
+            funds_to_download = [x for x in funds_to_download if x[0] not in unchanged_funds]
+            self.manifest.save()
+
+            def timed_import(ticker, CIK, series):
+                start = time.perf_counter()
+                fund_holdings = self.import_holdings_df(ticker, CIK, series)
+                self.metrics.record_item("fund_download", ticker, time.perf_counter() - start,
+                                         rows=len(fund_holdings) if fund_holdings is not None else 0)
+                return fund_holdings
+
+            self._failed_funds = {}
+            funds_downloaded = 0
+            rows = 0
+
+            for start in range(0, len(funds_to_download), self.chunk_size):
+                chunk = funds_to_download[start:start + self.chunk_size]
+                downloaded_holdings = {}
+
+                for (ticker, CIK, series), (fund_holdings, error) in zip(chunk, self.map_concurrently(timed_import, chunk)):
+                    if error is not None:
+                        self._failed_funds[ticker] = f"{type(error).__name__}: {error}"
+                    elif fund_holdings is None:
+                        self._failed_funds[ticker] = f"no N-PORT filing found for CIK: {CIK} and Series: {series}"
+                    else:
+                        downloaded_holdings[ticker] = fund_holdings
+
+                self.add_tickers(downloaded_holdings)
+
+                for ticker, CIK, series in chunk:
+                    if ticker in downloaded_holdings:
+                        self.save_fund_holdings(fund_holdings=downloaded_holdings[ticker], ticker=ticker, CIK=CIK, series=series)
+                self.manifest.save()
+
+                funds_downloaded += len(downloaded_holdings)
+                rows += sum(len(df) for df in downloaded_holdings.values())
+
+            stage['funds_downloaded'] = funds_downloaded
+            stage['funds_invalid'] = len(invalid_funds)
+            stage['funds_unchanged'] = len(unchanged_funds)
+            stage['funds_skipped'] = funds_skipped
+            stage['funds_failed'] = len(self.failed_funds)
+            stage['rows'] = rows
+            self.metrics.increment("holdings_rows_downloaded", stage['rows'])
+            self.manifest.finish_import(self.failed_funds)
+
+        self.report_failed_funds()
+
+        return self.failed_funds
+
+    def fetch_fund_holdings(self, ticker: str, CIK: str, series: str) -> pd.DataFrame:
+        """ downloads, resolves tickers for and saves the holdings of a single fund
+
+        Returns:
+            pd.DataFrame: holdings of the fund, None if no filing was found
+        """
+        fund_holdings = self.import_holdings_df(ticker, CIK, series)
+        if fund_holdings is not None:
+            self.add_tickers({ticker: fund_holdings})
+            self.save_fund_holdings(fund_holdings=fund_holdings, ticker=ticker, CIK=CIK, series=series)
+            self.manifest.save()
+
+        return fund_holdings
+
+    def report_failed_funds(self) -> None:
+        """ logs a summary of every fund that could not be downloaded in the last run """
+        if self.failed_funds:
+            summary = "\n".join(f"  {ticker}: {reason}" for ticker, reason in self.failed_funds.items())
+            logging.error(f"Unable to download holdings for {len(self.failed_funds)} of {len(self.list_of_funds)} funds:\n{summary}")
+
+    def add_tickers(self, downloaded_holdings: dict) -> None:
+        """ adds a ticker column to every fund's holdings, resolving each unique CUSIP once
+
+        Holdings without a CUSIP, or whose CUSIP has no ticker, are given their security_key instead
+        so they are still matched across funds when aggregating.
+
+        Args:
+            downloaded_holdings (dict): fund ticker as key, DataFrame of its holdings as value
+        """
+        if not downloaded_holdings:
+            return
+
+        unique_CUSIPs = pd.unique(pd.concat([df['CUSIP'] for df in downloaded_holdings.values()]).dropna())
+        CUSIP_ticker_map = self.resolve_CUSIPs(unique_CUSIPs)
+
+        for fund_holdings in downloaded_holdings.values():
+            tickers = fund_holdings['CUSIP'].map(CUSIP_ticker_map)
+            if 'security_key' in fund_holdings.columns:
+                tickers = tickers.fillna(fund_holdings['security_key'])
+            fund_holdings['ticker'] = tickers
+
+    def save_fund_holdings(self, fund_holdings: pd.DataFrame, ticker: str, CIK: str = None, series: str = None) -> None:
+        """ stores fund holdings as a snapshot of the fund's indexed filing and links it into the current folder
+
+        The fund is recorded in the download manifest once its file is in place. Call manifest.save to write it.
 
         Args:
             fund_holdings (pd.DataFrame): DataFrame of fund holdings pulled from SEC API
-            CIK (str): CIK corresponding to the fund's parent co.
-            series (str): series corresponding to the fund
-            save_folder_pathway (str): folder for the day in which to save information
+            ticker (str): ticker of the fund
+            CIK (str, optional): CIK corresponding to the fund's parent co.
+            series (str, optional): series corresponding to the fund
         """
-        file_pathway = f"{self.save_folder_pathway}/{ticker}.csv"
-        fund_holdings.to_csv(file_pathway, index=False)
+        indexed_filing = self.filing_index.get(CIK, series) if CIK is not None else None
+
+        if indexed_filing is None:
+            # without a filing accession there is nothing to key a snapshot on, so the file only goes in the current folder
+            file_pathway = holdings_file_pathway(self.save_folder_pathway, ticker, self.storage_format)
+            replace_fund_holdings(fund_holdings, file_pathway, self.storage_format)
+            self.manifest.record(ticker, file_pathway, len(fund_holdings))
+            return
+
+        snapshot = self.snapshot_store.put(ticker, indexed_filing['accession_no'], indexed_filing['filed_at'], fund_holdings, self.storage_format)
+        self.link_snapshot(snapshot)
+
+    def link_snapshot(self, snapshot: dict) -> None:
+        """ links a stored snapshot into the current folder and records it in the download manifest """
+        file_pathway = self.snapshot_store.link_into_view(snapshot, self.save_folder_pathway)
+        self.manifest.record(snapshot['fund'], file_pathway, snapshot['rows'], snapshot['accession_no'], snapshot['content_hash'])
+
+    def link_unchanged_funds(self, funds: list) -> set:
+        """ links the stored snapshot of every fund whose latest filing has not changed into the current folder
+
+        Only funds with a snapshot of their indexed filing are checked, with one filing index refresh
+        per CIK for filings made since. Their holdings are not downloaded again.
+
+        Args:
+            funds (list): (ticker, CIK, series) tuples of funds not in the current folder yet
+
+        Returns:
+            set: tickers of the funds linked from the snapshot store
+        """
+        snapshots = {}
+        for ticker, CIK, series in funds:
+            indexed_filing = self.filing_index.get(CIK, series)
+            if indexed_filing is not None:
+                snapshot = self.snapshot_store.get(ticker, indexed_filing['accession_no'], self.storage_format)
+                if snapshot is not None:
+                    snapshots[(ticker, CIK, series)] = snapshot
+
+        unchanged_funds = set()
+        if snapshots:
+            try:
+                changed = self.refresh_filing_index(funds=list(snapshots))
+            except Exception as e:
+                logging.warning(f"Unable to check for new filings, downloading all funds again: {e}")
+                changed = {ticker: True for ticker, CIK, series in snapshots}
+
+            for (ticker, CIK, series), snapshot in snapshots.items():
+                if not changed.get(ticker, True):
+                    self.link_snapshot(snapshot)
+                    unchanged_funds.add(ticker)
+                    logging.info(f"Filing {snapshot['accession_no']} of {ticker} is unchanged, linked its stored holdings")
+
+        self.metrics.record_cache("snapshot_store", hits=len(unchanged_funds), misses=len(funds) - len(unchanged_funds))
+        return unchanged_funds
 
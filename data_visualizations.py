@@ -1,14 +1,41 @@
 import pandas as pd
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
-import plotly.express as px
+
+# seaborn, matplotlib and plotly take seconds to import, so each plot imports only the library it draws with.
+# Charts draw on the matplotlib figure they are given and return it, report_rendering passes figures not tied to pyplot
+
+# aggregated holdings in this country are Domestic, all others International
+DOMESTIC_COUNTRY = "United States"
+
+# market caps of at least these amounts are mid and large cap, anything below (or unknown) is small cap
+MID_CAP_THRESHOLD = 2_000_000_000
+LARGE_CAP_THRESHOLD = 10_000_000_000
+CAP_SIZES = ["small", "mid", "large"]
+
+# charts drawn by report_rendering, in README order. PLOTLY_CHARTS return plotly figures, the others matplotlib figures
+CHARTS = ["compareTotalCount", "compareSumbyNation", "CompareFiveUS", "compareSectorUS", "distribution",
+          "compareHolding", "compareCapsize", "map_graph"]
+PLOTLY_CHARTS = ["map_graph"]
+
+# the distribution chart estimates its density from a sample of at most this many holdings
+DISTRIBUTION_MAX_POINTS = 100_000
+
+# dimensions of the exposure cube, those missing from the holdings (e.g. before enrichment) are left out
+CUBE_DIMENSIONS = ["nation", "country", "sector", "industry", "cap_size"]
+
 
 class DataVisualizations:
-    def __init__(self, portfolio_holdings_df: pd.DataFrame, aggregate_holdings_df: pd.DataFrame):
+    def __init__(self, portfolio_holdings_df: pd.DataFrame, aggregate_holdings_df: pd.DataFrame, max_points: int = DISTRIBUTION_MAX_POINTS):
+        """
+        Args:
+            portfolio_holdings_df (pd.DataFrame): portfolio holdings in the layout of example_holdings.csv
+            aggregate_holdings_df (pd.DataFrame): aggregated holdings, enriched with country, sector, industry and market_cap
+            max_points (int): the distribution chart is drawn from a random sample of at most this many holdings
+        """
         self._portfolio_holdings_df = portfolio_holdings_df
         self._aggregate_holdings_df = aggregate_holdings_df
-        self._aggregate_holdings_df['nation'] = self._aggregate_holdings_df['country'].apply(lambda x: 'Domestic' if x == 'United States' else 'International')
+        self._exposure_cube = self.build_exposure_cube(aggregate_holdings_df)
+        self._max_points = max_points
     
     @property
     def aggregate_holdings_df(self):
@@ -17,72 +44,157 @@ class DataVisualizations:
     @property
     def portfolio_holdings_df(self):
         return self._portfolio_holdings_df
+
+    @property
+    def exposure_cube(self):
+        """ summed portfolio_holdings and number of holdings for every nation, country, sector, industry and cap size combination """
+        return self._exposure_cube
+
+    @property
+    def distribution_sample(self) -> pd.Series:
+        """ portfolio_holdings, downsampled to max_points with a fixed seed so reports are reproducible """
+        holdings = self.aggregate_holdings_df['portfolio_holdings']
+        if self._max_points is not None and len(holdings) > self._max_points:
+            holdings = holdings.sample(self._max_points, random_state=0)
+        return holdings
+
+    @staticmethod
+    def cap_sizes(market_cap) -> pd.Categorical:
+        """ vectorized market_cap_categorization of a column of market caps """
+        market_cap = np.asarray(market_cap, dtype=float)
+        codes = (market_cap >= MID_CAP_THRESHOLD).astype(np.int8) + (market_cap >= LARGE_CAP_THRESHOLD)
+        return pd.Categorical.from_codes(codes, categories=CAP_SIZES, ordered=True)
+
+    @classmethod
+    def build_exposure_cube(cls, aggregate_holdings_df: pd.DataFrame) -> pd.DataFrame:
+        """ groups the aggregated holdings once by every chart dimension
+
+        Returns:
+            pd.DataFrame: one row per combination of CUBE_DIMENSIONS present, with portfolio_holdings and count
+        """
+        df = aggregate_holdings_df
+        dimensions = {}
+        if 'country' in df.columns:
+            dimensions['nation'] = np.where(df['country'] == DOMESTIC_COUNTRY, 'Domestic', 'International')
+        for column in ['country', 'sector', 'industry']:
+            if column in df.columns:
+                dimensions[column] = df[column].to_numpy()
+        if 'market_cap' in df.columns:
+            dimensions['cap_size'] = cls.cap_sizes(df['market_cap'])
+
+        keys = pd.DataFrame(dimensions, index=df.index)
+        keys['portfolio_holdings'] = df['portfolio_holdings'].to_numpy(dtype=float)
+        # missing sectors, industries etc. are kept as their own group so totals include every holding
+        cube = keys.groupby(list(dimensions), observed=True, dropna=False, sort=True)['portfolio_holdings'].agg(['sum', 'size'])
+
+        return cube.rename(columns={'sum': 'portfolio_holdings', 'size': 'count'}).reset_index()
+
+    def rollup(self, *dimensions: str, dropna: bool = True) -> pd.DataFrame:
+        """ sums the exposure cube over every dimension not given
+
+        Args:
+            dimensions (str): dimensions to keep, e.g. "nation" or "country", "sector"
+            dropna (bool): leave out groups whose dimension value is missing
+
+        Returns:
+            pd.DataFrame: portfolio_holdings and count indexed by the dimensions
+        """
+        return self.exposure_cube.groupby(list(dimensions), observed=True, dropna=dropna, sort=True)[['portfolio_holdings', 'count']].sum()
+
+    def save_exposure_cube(self, save_pathway: str = "exposure_cube.csv") -> None:
+        """ save exposure_cube for dashboards, as Parquet if the pathway ends in .parquet and CSV otherwise """
+        if save_pathway.endswith(".parquet"):
+            self.exposure_cube.to_parquet(save_pathway, index=False)
+        else:
+            self.exposure_cube.to_csv(save_pathway, index=False)
     
-    def compareTotalCount(self) -> None:
+    def new_figure(self, figure=None, ncols: int = 1):
+        """ returns (figure, axes) to draw a chart on. Without a figure a new pyplot figure is opened, as in a notebook """
+        if figure is None:
+            import matplotlib.pyplot as plt
+            figure = plt.figure()
+        return figure, figure.subplots(1, ncols)
+
+    def compareTotalCount(self, figure=None):
         """ Compare total count by U.S. and other nations """
-        sns.countplot(data = self.aggregate_holdings_df, x = 'nation').set(title = 'International')
+        import seaborn as sns
+        figure, ax = self.new_figure(figure)
+        counts = self.rollup('nation')['count']
+        sns.barplot(x = counts.index, y = counts.values, ax = ax).set(title = 'International', ylabel = 'count')
+        return figure
     
-    def compareSumbyNation(self) -> None:
+    def compareSumbyNation(self, figure=None):
         """ Compare the sum of total investment by nations """
-        a = self.aggregate_holdings_df.groupby('nation')['portfolio_holdings'].sum().reset_index()
-        a.set_index('nation', inplace = True)
-        a.plot(kind = 'bar')
+        figure, ax = self.new_figure(figure)
+        a = self.rollup('nation')[['portfolio_holdings']]
+        a.plot(kind = 'bar', ax = ax)
+        return figure
         
-    def CompareFiveUS(self) -> None:
+    def CompareFiveUS(self, figure=None):
         """ Compare the 5 most investment in U.S. """
+        figure, ax = self.new_figure(figure)
+        us5 = self.aggregate_holdings_df.loc[self.aggregate_holdings_df['country'] == DOMESTIC_COUNTRY, 'portfolio_holdings'].nlargest(5)
         
-        us5 = self.aggregate_holdings_df[self.aggregate_holdings_df['country'] == 'United States'].sort_values('portfolio_holdings', ascending = False).head()
-        
-        us5['portfolio_holdings'].plot(kind = 'bar')
-        plt.title('5 the most investment in US')
+        us5.plot(kind = 'bar', ax = ax)
+        ax.set_title('5 the most investment in US')
+        return figure
 
-    def compareSectorUS(self) -> None:
+    def compareSectorUS(self, figure=None):
         """ comparing by sector in the US """
+        import seaborn as sns
         
-        sns.countplot(data = self.aggregate_holdings_df, x = 'sector').set(title = 'Sectors')
+        figure, ax = self.new_figure(figure)
+        counts = self.rollup('sector')['count']
+        sns.barplot(x = counts.index, y = counts.values, ax = ax).set(title = 'Sectors', ylabel = 'count')
+        return figure
     
-    def distribution(self) -> None:
+    def distribution(self, figure=None):
         """ Distribution of Investment Amount """
+        import seaborn as sns
         
-        ax = sns.distplot(self.aggregate_holdings_df['portfolio_holdings'])
-        sns.set(font_scale = 1.7)
+        figure, ax = self.new_figure(figure)
+        sns.histplot(self.distribution_sample, kde = True, stat = 'density', ax = ax)
+        return figure
         
-        
-    def compareHolding(self) -> None:
+    def compareHolding(self, figure=None):
         """ Comparing holding types """
-        
-        sns.catplot(x = 'holding_type', kind = 'count', data = self.portfolio_holdings_df).set(Title = '0 = fund, 1 = stock')
-        plt.show()
-        
-        # pie chart
-        categories = self.portfolio_holdings_df['holding_type'].value_counts().keys()
-        values = self.portfolio_holdings_df['holding_type'].value_counts().values
+        import seaborn as sns
 
-        plt.pie(values, labels=categories)
+        figure, (count_ax, pie_ax) = self.new_figure(figure, ncols = 2)
+        counts = self.portfolio_holdings_df['holding_type'].value_counts()
 
-        plt.axis('equal')
-        plt.show()
+        sns.barplot(x = counts.index, y = counts.values, ax = count_ax).set(title = '0 = fund, 1 = stock', ylabel = 'count')
+        
+        # pie chart
+        pie_ax.pie(counts.values, labels=counts.index)
+        pie_ax.axis('equal')
+        return figure
     
-    def compareCapsize(self) -> None:
-        self.aggregate_holdings_df['cap_size']=""
+    def compareCapsize(self, figure=None):
+        import seaborn as sns
 
-        self.aggregate_holdings_df["cap_size"] = self.aggregate_holdings_df['market_cap'].apply(self.market_cap_categorization)
-        
-        sns.countplot(data = self.aggregate_holdings_df, x = 'cap_size').set(title = 'Breakdown by Cap size')
+        figure, ax = self.new_figure(figure)
+        counts = self.rollup('cap_size')['count']
+        sns.barplot(x = counts.index.astype(str), y = counts.values, ax = ax).set(title = 'Breakdown by Cap size', ylabel = 'count')
+        return figure
     
-    def map_graph(self) -> None:
-        invst_sum = self.aggregate_holdings_df.groupby("country")["portfolio_holdings"].sum()
+    def map_graph(self, show: bool = True):
+        """ choropleth of the amount invested per country, drawn with plotly. Returns the plotly figure """
+        import plotly.express as px
+        invst_sum = self.rollup("country")["portfolio_holdings"]
 
-        fig = px.choropleth(self.aggregate_holdings_df, locationmode='country names', locations = invst_sum.keys(), color = invst_sum.values)
+        fig = px.choropleth(locationmode='country names', locations = invst_sum.index, color = invst_sum.values)
         fig.update_layout(coloraxis_colorbar=dict(title="portfolio_holdings"))
-        fig.show()
+        if show:
+            fig.show()
+        return fig
         
     def market_cap_categorization(self, market_cap: float) -> str:
         category = ""
         
-        if market_cap >= 10_000_000_000:
+        if market_cap >= LARGE_CAP_THRESHOLD:
             category = 'large'
-        elif market_cap >= 2_000_000_000:
+        elif market_cap >= MID_CAP_THRESHOLD:
             category = 'mid'
         else:
             category = 'small'
@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List
+
+from holdings_storage import move_into_place, temporary_file
+from snapshot_store import file_hash
+
+
+# integrity checks of the manifested files: "fast" compares each file's size, "full" also its content hash
+VERIFY_MODES = ["none", "fast", "full"]
+
+
+def atomic_write_text(text: str, file_pathway: str) -> None:
+    """ writes text to a temporary file next to file_pathway and renames it into place, so readers never see it half written """
+    with temporary_file(os.path.dirname(file_pathway)) as temp_pathway:
+        with open(temp_pathway, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        move_into_place(temp_pathway, file_pathway)
+
+
+class DownloadManifest:
+    """ record of the fund holdings files in one holdings folder, kept in <folder>/manifest.json
+
+    Each fund's entry holds the file, its filing accession, download time, row count, size and
+    content hash. It is read once, so checking whether a fund was already downloaded is a dict
+    lookup rather than a scan of the folder, and a file is only trusted once its entry is written,
+    after the file itself is complete. The manifest also records when the last import into the folder
+    started and finished and which funds failed, so readers can tell a folder still being written
+    from a finished one. The manifest is saved atomically with a temp file and rename.
+    """
+
+    def __init__(self, folder_pathway: str, file_name: str = "manifest.json"):
+        """
+        Args:
+            folder_pathway (str): holdings folder the manifest describes
+            file_name (str): name of the manifest file in the folder
+        """
+        self._folder_pathway = folder_pathway
+        self._pathway = os.path.join(folder_pathway, file_name)
+        self._lock = threading.Lock()
+        contents = self.load()
+        self._entries = contents.get('funds', {})
+        self._import_status = contents.get('import')
+        self._dirty = False
+
+    @property
+    def folder_pathway(self):
+        return self._folder_pathway
+
+    @property
+    def pathway(self):
+        return self._pathway
+
+    @property
+    def entries(self) -> Dict[str, dict]:
+        return self._entries
+
+    @property
+    def import_status(self) -> dict:
+        """ started_at, finished_at (None while the import runs) and failed_funds of the last import, None if none was recorded """
+        return self._import_status
+
+    @property
+    def import_finished(self) -> bool:
+        """ whether the last import into the folder finished, None for folders written before imports were recorded """
+        if self._import_status is None:
+            return None
+        return self._import_status['finished_at'] is not None
+
+    def __contains__(self, fund: str) -> bool:
+        return fund in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def get(self, fund: str) -> dict:
+        """ returns a fund's entry, None if it has not been downloaded into the folder """
+        return self._entries.get(fund)
+
+    def load(self) -> dict:
+        """ reads the manifest, an unreadable one is treated as empty so every fund is downloaded again
+
+        Returns:
+            dict: 'funds' entries and, if recorded, the 'import' status
+        """
+        if not os.path.exists(self.pathway):
+            return {}
+
+        try:
+            with open(self.pathway) as f:
+                contents = json.load(f)
+            return {'funds': contents['funds'], 'import': contents.get('import')}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Unable to read download manifest {self.pathway}, ignoring it: {e}")
+            return {}
+
+    def save(self) -> None:
+        """ writes the manifest if it changed since it was last saved """
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.folder_pathway, exist_ok=True)
+            contents = {'funds': self._entries}
+            if self._import_status is not None:
+                contents['import'] = self._import_status
+            atomic_write_text(json.dumps(contents, indent=1, sort_keys=True), self.pathway)
+            self._dirty = False
+
+    def start_import(self) -> None:
+        """ records that an import into the folder is running and saves the manifest """
+        with self._lock:
+            self._import_status = {'started_at': time.time(), 'finished_at': None, 'failed_funds': {}}
+            self._dirty = True
+        self.save()
+
+    def finish_import(self, failed_funds: dict = None) -> None:
+        """ records that the running import finished and saves the manifest
+
+        Args:
+            failed_funds (dict, optional): fund to the reason its holdings could not be downloaded
+        """
+        with self._lock:
+            self._import_status = {**(self._import_status or {'started_at': None}), 'finished_at': time.time(),
+                                   'failed_funds': dict(failed_funds or {})}
+            self._dirty = True
+        self.save()
+
+    def record(self, fund: str, file_pathway: str, rows: int, accession_no: str = None, content_hash: str = None) -> dict:
+        """ adds or replaces a fund's entry once its file is complete. Call save to write the manifest
+
+        Args:
+            fund (str): fund ticker
+            file_pathway (str): the fund's holdings file in the folder
+            rows (int): number of holdings in the file
+            accession_no (str, optional): N-PORT filing the holdings come from
+            content_hash (str, optional): SHA-256 of the file, computed if not given
+
+        Returns:
+            dict: the fund's entry
+        """
+        entry = {
+            'file': os.path.basename(file_pathway),
+            'accession_no': accession_no,
+            'downloaded_at': time.time(),
+            'rows': int(rows),
+            'size': os.path.getsize(file_pathway),
+            'content_hash': content_hash if content_hash is not None else file_hash(file_pathway),
+        }
+        with self._lock:
+            self._entries[fund] = entry
+            self._dirty = True
+        return entry
+
+    def remove(self, fund: str) -> None:
+        with self._lock:
+            if self._entries.pop(fund, None) is not None:
+                self._dirty = True
+
+    def verify(self, mode: str = "fast") -> List[str]:
+        """ drops the entries whose file is missing or does not match, so those funds are downloaded again
+
+        Args:
+            mode (str): "fast" checks that each file exists with the recorded size, "full" also rehashes its contents, "none" checks nothing
+
+        Returns:
+            List[str]: funds whose entries were dropped
+        """
+        if mode not in VERIFY_MODES:
+            raise ValueError(f"Unknown verify mode: {mode}. Options are {VERIFY_MODES}")
+        if mode == "none":
+            return []
+
+        invalid = []
+        for fund, entry in list(self._entries.items()):
+            pathway = os.path.join(self.folder_pathway, entry['file'])
+            try:
+                valid = os.path.getsize(pathway) == entry['size']
+            except OSError:
+                valid = False
+            if valid and mode == "full":
+                valid = file_hash(pathway) == entry['content_hash']
+            if not valid:
+                logging.warning(f"Holdings file of {fund} does not match the download manifest, it will be downloaded again")
+                invalid.append(fund)
+                self.remove(fund)
+
+        self.save()
+        return invalid
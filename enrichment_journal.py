@@ -0,0 +1,123 @@
+import numpy as np
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict
+
+
+class EnrichmentJournal:
+    """ append-only JSON lines journal of enriched tickers, used to resume an interrupted enrichment
+
+    Rows are buffered and appended to the file in batches, so the cost of checkpointing grows with
+    the number of new rows rather than with the size of the whole holdings table.
+    """
+
+    def __init__(self, journal_pathway: str, fields: list, batch_size: int = 100):
+        """
+        Args:
+            journal_pathway (str): file the journal is appended to
+            fields (list): names of the values stored for each ticker, in order
+            batch_size (int): number of rows buffered before they are appended to the file
+        """
+        self._journal_pathway = journal_pathway
+        self._fields = fields
+        self._batch_size = batch_size
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    @property
+    def journal_pathway(self):
+        return self._journal_pathway
+
+    def read(self) -> Dict[str, tuple]:
+        """ returns the rows already in the journal
+
+        Returns:
+            Dict[str, tuple]: ticker to its values, np.nan where a value is missing
+        """
+        rows = {}
+
+        if not os.path.exists(self.journal_pathway):
+            return rows
+
+        with open(self.journal_pathway) as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line can be cut off if the previous run crashed mid-write
+                    logging.warning(f"Skipping unreadable line in {self.journal_pathway}")
+                    continue
+                rows[row['ticker']] = tuple(np.nan if row.get(field) is None else row[field] for field in self._fields)
+
+        return rows
+
+    def append(self, ticker: str, values: tuple) -> None:
+        """ adds a row to the buffer, writing the buffer out once it holds batch_size rows """
+        row = {'ticker': ticker}
+        for field, value in zip(self._fields, values):
+            row[field] = None if isinstance(value, float) and np.isnan(value) else value
+
+        with self._lock:
+            self._buffer.append(json.dumps(row))
+            if len(self._buffer) >= self._batch_size:
+                self.write_buffer()
+
+    def flush(self) -> None:
+        """ writes out any buffered rows """
+        with self._lock:
+            self.write_buffer()
+
+    def write_buffer(self) -> None:
+        if not self._buffer:
+            return
+
+        with open(self.journal_pathway, "a") as f:
+            f.write("\n".join(self._buffer) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._buffer = []
+
+    def clear(self) -> None:
+        """ deletes the journal and anything buffered """
+        with self._lock:
+            self._buffer = []
+            if os.path.exists(self.journal_pathway):
+                os.remove(self.journal_pathway)
+
+
+class ProgressReporter:
+    """ prints progress, rate and estimated time remaining at most once every interval seconds """
+
+    def __init__(self, total: int, description: str, interval: float = 5):
+        self._total = total
+        self._description = description
+        self._interval = interval
+        self._completed = 0
+        self._start_time = time.time()
+        self._last_report = self._start_time
+
+    @property
+    def completed(self):
+        return self._completed
+
+    def update(self, n: int = 1) -> None:
+        self._completed += n
+        now = time.time()
+        if now - self._last_report >= self._interval:
+            self._last_report = now
+            self.report()
+
+    def report(self) -> None:
+        elapsed = time.time() - self._start_time
+        rate = self._completed / elapsed if elapsed > 0 else 0
+        percent = 100 * self._completed / self._total if self._total else 100
+        remaining = (self._total - self._completed) / rate if rate > 0 else float("nan")
+        print(f"{self._description}: {self._completed}/{self._total} ({percent:.1f}%), {rate:.1f}/s, about {remaining:.0f}s remaining")
+
+    def finish(self) -> None:
+        elapsed = time.time() - self._start_time
+        print(f"{self._description}: finished {self._completed}/{self._total} in {elapsed:.1f}s")
@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import logging
+import os
+import re
+from typing import Dict
+
+from holdings_storage import list_holdings_files, read_fund_holdings
+from security_master import CompactFundHoldings
+from snapshot_store import SnapshotStore, file_hash
+
+
+# holdings columns read from each snapshot
+HISTORY_COLUMNS = ["company_name", "percent_of_portfolio", "country", "ticker"]
+
+# dated holdings folders (views) are named like 2024-01-31
+VIEW_FOLDER_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class ExposureHistory:
+    """ look-through exposure of one portfolio over a series of periods, each with its own fund snapshots
+
+    Every distinct snapshot file (by content hash) is read once and interned into one shared
+    security master, becoming one row of a snapshots x securities weight matrix. A fund whose
+    holdings did not change between periods points at the same row, so exposure over time is a
+    single sparse product of a periods x snapshots matrix of fund amounts with that weight matrix.
+    """
+
+    def __init__(self, period_snapshots: Dict[str, Dict[str, tuple]], fund_amounts: dict, stock_amounts: dict = None):
+        """
+        Args:
+            period_snapshots (Dict[str, Dict[str, tuple]]): period label to {fund: (content hash, file pathway)}, in period order
+            fund_amounts (dict): fund ticker to the amount invested in it
+            stock_amounts (dict, optional): stock ticker to the amount held directly, the same in every period
+        """
+        self._periods = list(period_snapshots)
+        self._snapshots = CompactFundHoldings()
+        self._fund_amounts = dict(fund_amounts)
+        self._stock_amounts = dict(stock_amounts or {})
+
+        rows, columns, amounts = [], [], []
+        for row, period in enumerate(self._periods):
+            snapshots = period_snapshots[period]
+            for fund, amount in self._fund_amounts.items():
+                if fund not in snapshots:
+                    logging.warning(f"No holdings of {fund} in period {period}")
+                    continue
+                content_hash, pathway = snapshots[fund]
+                if content_hash not in self._snapshots:
+                    self._snapshots[content_hash] = read_fund_holdings(pathway, columns=HISTORY_COLUMNS)
+                rows.append(row)
+                columns.append(content_hash)
+                amounts.append(amount)
+
+        snapshot_positions = {x: i for i, x in enumerate(self._snapshots)}
+        self._fund_amount_matrix = sparse.csr_matrix(
+            (amounts, (rows, [snapshot_positions[x] for x in columns])), shape=(len(self._periods), len(snapshot_positions))
+        )
+        self._stock_ids = self.master.intern(list(self._stock_amounts))
+        self._exposure = self.compute_exposure()
+
+    @property
+    def periods(self):
+        return self._periods
+
+    @property
+    def master(self):
+        return self._snapshots.master
+
+    @property
+    def securities(self):
+        """ security key of each exposure column """
+        return self.master.keys
+
+    @property
+    def n_snapshots(self):
+        """ number of distinct fund snapshots read, at most one per fund and period """
+        return len(self._snapshots)
+
+    @property
+    def exposure(self) -> np.ndarray:
+        """ periods x securities amounts held directly and through funds """
+        return self._exposure
+
+    def compute_exposure(self) -> np.ndarray:
+        """ multiplies the fund amounts of every period with the weights of the snapshots held in it """
+        snapshots = list(self._snapshots)
+        lengths = np.array([len(self._snapshots.arrays(x)[0]) for x in snapshots], dtype=np.int64)
+        ids = np.concatenate([self._snapshots.arrays(x)[0] for x in snapshots]) if snapshots else np.array([], dtype=np.int32)
+        weights = np.concatenate([self._snapshots.arrays(x)[1] for x in snapshots]) if snapshots else np.array([])
+        weight_matrix = sparse.csr_matrix(
+            (np.nan_to_num(weights, nan=0.0), (np.repeat(np.arange(len(snapshots)), lengths), ids)), shape=(len(snapshots), len(self.master))
+        )
+
+        exposure = (self._fund_amount_matrix @ weight_matrix).toarray()
+        held = self._stock_ids >= 0
+        np.add.at(exposure, (slice(None), self._stock_ids[held]), np.asarray(list(self._stock_amounts.values()), dtype=float)[held])
+
+        return exposure
+
+    def drift(self, relative: bool = False) -> np.ndarray:
+        """ (periods - 1) x securities change in exposure from each period to the next
+
+        Args:
+            relative (bool): changes in each security's share of the portfolio rather than in amounts
+        """
+        exposure = self.shares() if relative else self.exposure
+        return np.diff(exposure, axis=0)
+
+    def shares(self) -> np.ndarray:
+        """ periods x securities exposure as a fraction of each period's total """
+        totals = self.exposure.sum(axis=1, keepdims=True)
+        return np.divide(self.exposure, totals, out=np.zeros_like(self.exposure), where=totals != 0)
+
+    def rollup(self, by: str = "country", security_attributes: pd.Series = None) -> pd.DataFrame:
+        """ sums the exposure of each period by a security attribute
+
+        Args:
+            by (str): "country" (from the fund holdings), or the name given to security_attributes
+            security_attributes (pd.Series, optional): attribute of each security indexed by ticker, e.g. the sector
+                column of enriched aggregated holdings. Securities not in it are grouped as missing
+
+        Returns:
+            pd.DataFrame: periods x attribute values
+        """
+        if security_attributes is not None:
+            values = security_attributes.reindex(self.securities).to_numpy(dtype=object)
+        elif by in self.master.info_columns:
+            values = np.asarray(self.master.info_column(by), dtype=object)
+        else:
+            raise ValueError(f"No {by} for the securities, pass security_attributes")
+
+        codes, groups = pd.factorize(values, use_na_sentinel=False)
+        indicator = sparse.csr_matrix((np.ones(len(codes)), (np.arange(len(codes)), codes)), shape=(len(codes), len(groups)))
+
+        return pd.DataFrame((indicator.T @ self.exposure.T).T, index=self.periods, columns=groups)
+
+    def to_frame(self, drift: bool = False) -> pd.DataFrame:
+        """ exposure (or its drift) as a DataFrame of periods x securities, leaving out securities never held """
+        held = np.flatnonzero(np.abs(self.exposure).sum(axis=0) > 0)
+        values = self.drift()[:, held] if drift else self.exposure[:, held]
+        index = self.periods[1:] if drift else self.periods
+
+        return pd.DataFrame(values, index=index, columns=self.securities[held])
+
+    @classmethod
+    def from_views(cls, holdings_root: str, fund_amounts: dict, stock_amounts: dict = None, last: int = None) -> "ExposureHistory":
+        """ one period per dated holdings folder (e.g. fund_holdings/2024-01-31)
+
+        Files linked to the same snapshot are recognised by their inode and only hashed once.
+
+        Args:
+            holdings_root (str): folder containing the dated holdings folders
+            last (int, optional): only the most recent periods
+        """
+        folders = sorted(x for x in os.listdir(holdings_root) if VIEW_FOLDER_PATTERN.match(x) and os.path.isdir(os.path.join(holdings_root, x)))
+        folders = folders[-last:] if last else folders
+        hashes = {}
+        period_snapshots = {}
+
+        for folder in folders:
+            snapshots = {}
+            for fund, pathway in list_holdings_files(os.path.join(holdings_root, folder)).items():
+                if fund in fund_amounts:
+                    stat = os.stat(pathway)
+                    key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                    if key not in hashes:
+                        hashes[key] = file_hash(pathway)
+                    snapshots[fund] = (hashes[key], pathway)
+            period_snapshots[folder] = snapshots
+
+        return cls(period_snapshots, fund_amounts, stock_amounts)
+
+    @classmethod
+    def from_snapshot_store(cls, snapshot_store: SnapshotStore, fund_amounts: dict, stock_amounts: dict = None,
+                            freq: str = "M", last: int = None) -> "ExposureHistory":
+        """ one period per filing period (e.g. month), holding the latest snapshot of each fund filed by its end
+
+        Args:
+            snapshot_store (SnapshotStore): store the fund snapshots are read from
+            freq (str): pandas period frequency of the filing periods, e.g. "M" or "Q"
+            last (int, optional): only the most recent periods
+        """
+        history = [x for x in snapshot_store.history() if x['fund'] in fund_amounts and os.path.exists(x['pathway'])]
+        filed = pd.PeriodIndex([x['filed_at'][:10] for x in history], freq=freq)
+        periods = sorted(set(filed))
+        periods = periods[-last:] if last else periods
+
+        period_snapshots = {}
+        latest = {}
+        position = 0
+        # history is ordered by filing date, so each period carries forward the latest snapshot of every fund
+        for period in periods:
+            while position < len(history) and filed[position] <= period:
+                latest[history[position]['fund']] = (history[position]['content_hash'], history[position]['pathway'])
+                position += 1
+            period_snapshots[str(period)] = dict(latest)
+
+        return cls(period_snapshots, fund_amounts, stock_amounts)
@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import logging
+from typing import Dict
+
+from holdings_storage import list_holdings_files, read_fund_holdings
+from security_master import CompactFundHoldings
+
+
+# holdings columns used when aggregating, the others are not loaded from the holdings files
+AGGREGATION_COLUMNS = ["company_name", "percent_of_portfolio", "country", "ticker"]
+
+
+def read_fund_holdings_folder(fund_holdings_pathway: str) -> CompactFundHoldings:
+    """ reads every fund holdings file in a folder
+
+    Each file is interned into a shared SecurityMaster as it is read, so only one fund's DataFrame
+    is in memory at a time and the result holds (security ID, weight) arrays plus codes of each
+    fund's own company_name and country.
+
+    Returns:
+        CompactFundHoldings: key: fund name, value: DataFrame of holdings, built on access
+    """
+    fund_holdings = CompactFundHoldings()
+
+    for fund_name, filename in list_holdings_files(fund_holdings_pathway).items():
+        try:
+            # only the columns needed for aggregation are loaded, with the types in HOLDINGS_DTYPE_MAP
+            fund_holdings[fund_name] = read_fund_holdings(filename, columns=AGGREGATION_COLUMNS)
+        except Exception:
+            logging.warning(f"Unable to import holdings for {fund_name} located in {filename}")
+
+    return fund_holdings
+
+
+class FundExposureMatrix:
+    """ sparse funds x securities matrix of portfolio weights over an interned security index
+
+    Columns are the security IDs of the holdings' SecurityMaster, so the look-through exposure of
+    a set of fund investments is a single sparse matrix-vector product instead of a concat and
+    string-keyed groupby over copies of every fund's holdings.
+    """
+
+    def __init__(self, fund_holdings: Dict[str, pd.DataFrame], key_column: str = "ticker", weight_column: str = "percent_of_portfolio"):
+        """
+        Args:
+            fund_holdings (Dict[str, pd.DataFrame]): fund name as key, DataFrame of its holdings as value. A CompactFundHoldings is used as is
+            key_column (str): column identifying a security across funds
+            weight_column (str): column with the security's weight in the fund
+        """
+        if not isinstance(fund_holdings, CompactFundHoldings):
+            fund_holdings = CompactFundHoldings.from_frames(fund_holdings, key_column, weight_column)
+
+        self._fund_holdings = fund_holdings
+        self._funds = list(fund_holdings)
+        self._fund_positions = {fund: i for i, fund in enumerate(self._funds)}
+        self._key_column = fund_holdings.key_column
+        self.build()
+
+    @classmethod
+    def from_folder(cls, fund_holdings_pathway: str) -> "FundExposureMatrix":
+        """ weight matrix of every fund in a holdings folder """
+        return cls(read_fund_holdings_folder(fund_holdings_pathway))
+
+    @property
+    def funds(self):
+        return self._funds
+
+    @property
+    def fund_positions(self):
+        return self._fund_positions
+
+    @property
+    def fund_holdings(self):
+        return self._fund_holdings
+
+    @property
+    def master(self):
+        return self._fund_holdings.master
+
+    @property
+    def securities(self):
+        """ security key of each column """
+        return self.master.keys
+
+    @property
+    def security_positions(self):
+        return self.master.positions
+
+    @property
+    def weights(self):
+        # securities interned after the matrix was built (e.g. by another fund in the store) get empty columns
+        if self._weights.shape[1] < len(self.master):
+            self._weights.resize((self._weights.shape[0], len(self.master)))
+        return self._weights
+
+    @property
+    def security_info(self):
+        """ company_name and country of each column as Categoricals """
+        return self.master.info
+
+    def build(self) -> None:
+        """ builds the weight matrix from the security IDs and weights of every fund """
+        arrays = [self.fund_holdings.arrays(fund) for fund in self._funds]
+        lengths = np.array([len(ids) for ids, weights in arrays], dtype=np.int64)
+
+        if arrays:
+            ids = np.concatenate([ids for ids, weights in arrays])
+            weights = np.concatenate([weights for ids, weights in arrays])
+        else:
+            ids = np.array([], dtype=np.int32)
+            weights = np.array([], dtype=float)
+
+        fund_rows = np.repeat(np.arange(len(arrays)), lengths)
+        # groupby sums skip NaN weights so they count as zero
+        weights = np.nan_to_num(weights, nan=0.0)
+        self._weights = sparse.csr_matrix((weights, (fund_rows, ids)), shape=(len(arrays), len(self.master)))
+
+    def fund_row(self, fund: str):
+        """ returns the security columns and weights of one fund
+
+        Returns:
+            tuple: (np.ndarray of security positions, np.ndarray of weights)
+        """
+        position = self.fund_positions[fund]
+        weights = self.weights
+        start, end = weights.indptr[position], weights.indptr[position + 1]
+        return weights.indices[start:end], weights.data[start:end]
+
+    def add_fund(self, fund: str, holdings: pd.DataFrame = None) -> None:
+        """ adds a fund as a new row, interning any securities not seen before
+
+        Args:
+            fund (str): fund name
+            holdings (pd.DataFrame, optional): DataFrame of the fund's holdings. Not needed if the fund is already in fund_holdings
+        """
+        if fund in self.fund_positions:
+            raise ValueError(f"Fund {fund} is already in the exposure matrix")
+        if holdings is not None or fund not in self.fund_holdings:
+            self.fund_holdings[fund] = holdings
+
+        ids, weights = self.fund_holdings.arrays(fund)
+        weights = np.nan_to_num(weights, nan=0.0)
+        row = sparse.csr_matrix((weights, (np.zeros(len(ids), dtype=np.int64), ids)), shape=(1, len(self.master)))
+        self._weights = sparse.vstack([self.weights, row], format="csr")
+        self._fund_positions[fund] = len(self._funds)
+        self._funds.append(fund)
+
+    def investment_vector(self, investment_amounts: dict) -> np.ndarray:
+        """ returns the amount invested in each fund as a vector aligned with the matrix rows """
+        amounts = np.zeros(len(self.funds))
+
+        for fund, amount in investment_amounts.items():
+            position = self.fund_positions.get(fund)
+            if position is not None:
+                amounts[position] = amount
+
+        for fund in self.funds:
+            if fund not in investment_amounts:
+                logging.warning(f"Unable to add investment amounts for {fund}")
+
+        return amounts
+
+    def held_securities(self, funds) -> np.ndarray:
+        """ returns a boolean mask of the securities held by at least one of the funds """
+        mask = np.zeros(len(self.securities), dtype=bool)
+
+        for fund in funds:
+            position = self.fund_positions.get(fund)
+            if position is not None:
+                mask[self.fund_row(fund)[0]] = True
+
+        return mask
+
+    def exposure(self, investment_amounts: dict) -> np.ndarray:
+        """ returns the dollar amount held in each security through the funds
+
+        Args:
+            investment_amounts (dict): fund name as key, amount invested in the fund as value
+
+        Returns:
+            np.ndarray: amount per security, aligned with self.securities
+        """
+        return self.weights.T @ self.investment_vector(investment_amounts)
+
+    def combined_fund_portfolio(self, investment_amounts: dict) -> pd.DataFrame:
+        """ returns the securities held through the funds in the same layout as PortfolioConstructor.combined_fund_portfolio
+
+        Args:
+            investment_amounts (dict): fund name as key, amount invested in the fund as value
+
+        Returns:
+            pd.DataFrame: ticker, company_name, country and portfolio_holdings sorted by ticker
+        """
+        exposure = self.exposure(investment_amounts)
+        held = np.flatnonzero(self.held_securities([x for x in investment_amounts if x in self.fund_positions]))
+        held = held[np.argsort(self.securities[held], kind="stable")]
+
+        df = pd.DataFrame({self._key_column: self.securities[held]})
+        for column in self.master.info_columns:
+            df[column] = self.master.info_column(column, held)
+        df['portfolio_holdings'] = exposure[held]
+
+        return df
@@ -0,0 +1,77 @@
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+
+
+class FilingIndex:
+    """ on-disk SQLite index of the latest N-PORT filing accession for each (CIK, series) pair """
+
+    def __init__(self, db_pathway: str):
+        self._db_pathway = db_pathway
+        self._lock = threading.Lock()
+        self.create_table()
+
+    @property
+    def db_pathway(self):
+        return self._db_pathway
+
+    @contextmanager
+    def connect(self):
+        """ yields a connection that commits (or rolls back) and is closed when the block exits """
+        with closing(sqlite3.connect(self.db_pathway, timeout=30)) as conn, conn:
+            yield conn
+
+    def create_table(self) -> None:
+        """ creates the index table if it does not exist yet """
+        with self._lock, self.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS filing_index ("
+                "cik TEXT NOT NULL, "
+                "series_id TEXT NOT NULL, "
+                "accession_no TEXT NOT NULL, "
+                "filed_at TEXT NOT NULL, "
+                "indexed_at REAL NOT NULL, "
+                "PRIMARY KEY (cik, series_id))"
+            )
+
+    def get(self, CIK: str, series: str) -> dict:
+        """ returns the indexed filing for a fund
+
+        Returns:
+            dict: keys accession_no, filed_at and indexed_at. None if the fund has not been indexed
+        """
+        with self._lock, self.connect() as conn:
+            row = conn.execute(
+                "SELECT accession_no, filed_at, indexed_at FROM filing_index WHERE cik = ? AND series_id = ?", (CIK, series)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return {'accession_no': row[0], 'filed_at': row[1], 'indexed_at': row[2]}
+
+    def update(self, CIK: str, series: str, accession_no: str, filed_at: str) -> bool:
+        """ records a filing for a fund unless a newer one is already indexed
+
+        Returns:
+            bool: True if the indexed accession changed
+        """
+        with self._lock, self.connect() as conn:
+            row = conn.execute(
+                "SELECT accession_no, filed_at FROM filing_index WHERE cik = ? AND series_id = ?", (CIK, series)
+            ).fetchone()
+
+            # filedAt values are ISO-8601 strings so they compare chronologically
+            if row is not None and (row[0] == accession_no or row[1] > filed_at):
+                conn.execute(
+                    "UPDATE filing_index SET indexed_at = ? WHERE cik = ? AND series_id = ?", (time.time(), CIK, series)
+                )
+                return False
+
+            conn.execute(
+                "INSERT OR REPLACE INTO filing_index (cik, series_id, accession_no, filed_at, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                (CIK, series, accession_no, filed_at, time.time()),
+            )
+
+        return True
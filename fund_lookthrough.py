@@ -0,0 +1,224 @@
+import numpy as np
+import pandas as pd
+
+import json
+import logging
+import os
+import time
+import urllib.request
+from typing import Callable, Dict
+
+from holdings_storage import move_into_place, temporary_file
+
+
+# SEC list of mutual fund and ETF tickers with the CIK and series each belongs to
+SEC_FUND_TICKERS_URL = "https://www.sec.gov/files/company_tickers_mf.json"
+
+# N-PORT reports percent_of_portfolio in percent, so nested weights are divided by this when multiplied
+PERCENT_SCALE = 100
+
+
+class FundRegistry:
+    """ lookup of which tickers are registered funds, and the CIK and series of each """
+
+    def __init__(self, funds: Dict[str, tuple] = None):
+        """
+        Args:
+            funds (Dict[str, tuple], optional): fund ticker to (CIK, series)
+        """
+        self._funds = dict(funds or {})
+
+    @property
+    def funds(self):
+        return self._funds
+
+    def __contains__(self, ticker) -> bool:
+        return ticker in self._funds
+
+    def get(self, ticker: str) -> tuple:
+        """ returns (CIK, series) of a fund, None if the ticker is not a registered fund """
+        return self._funds.get(ticker)
+
+    def add_funds(self, list_of_funds: list) -> None:
+        """ adds (ticker, CIK, series) tuples, e.g. the funds held in the portfolio """
+        for ticker, CIK, series in list_of_funds:
+            self._funds[ticker] = (CIK, series)
+
+    @classmethod
+    def from_sec(cls, cache_pathway: str, user_agent: str = None, max_age_days: float = 7, refresh: bool = False) -> "FundRegistry":
+        """ builds the registry from the SEC mutual fund ticker file, downloading it if it is not cached or is out of date
+
+        Args:
+            cache_pathway (str): where the SEC file is cached
+            user_agent (str, optional): User-Agent with a real contact, e.g. "Jane Doe jane@example.org", which the SEC
+                requires for automated requests. Defaults to the SEC_USER_AGENT environment variable
+            max_age_days (float): days before the cached file is downloaded again. None keeps it indefinitely
+            refresh (bool): download the file even if the cached one is recent
+        """
+        stale = (refresh or not os.path.exists(cache_pathway)
+                 or (max_age_days is not None and time.time() - os.path.getmtime(cache_pathway) > max_age_days * 86400))
+
+        if stale:
+            try:
+                download_sec_fund_tickers(cache_pathway, user_agent or os.environ.get("SEC_USER_AGENT"))
+            except (ValueError, OSError) as e:
+                if not os.path.exists(cache_pathway):
+                    raise
+                logging.warning(f"Unable to refresh {cache_pathway}, using the cached SEC fund tickers: {e}")
+
+        with open(cache_pathway) as f:
+            data = json.load(f)
+
+        fields = data['fields']
+        cik_col, series_col, symbol_col = fields.index('cik'), fields.index('seriesId'), fields.index('symbol')
+        funds = {row[symbol_col]: (str(row[cik_col]).zfill(10), row[series_col]) for row in data['data'] if row[symbol_col]}
+
+        return cls(funds)
+
+
+def download_sec_fund_tickers(cache_pathway: str, user_agent: str) -> None:
+    """ downloads the SEC mutual fund ticker file to cache_pathway
+
+    Args:
+        cache_pathway (str): file the download replaces
+        user_agent (str): User-Agent identifying who is making the request, as the SEC's access policy asks
+    """
+    if not user_agent:
+        raise ValueError("The SEC requires a User-Agent with a contact for automated requests. Pass user_agent or set "
+                         "the SEC_USER_AGENT environment variable, e.g. SEC_USER_AGENT='Jane Doe jane@example.org'")
+
+    request = urllib.request.Request(SEC_FUND_TICKERS_URL, headers={"User-Agent": user_agent})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        content = response.read()
+
+    with temporary_file(os.path.dirname(cache_pathway)) as temp_pathway:
+        with open(temp_pathway, "wb") as f:
+            f.write(content)
+        move_into_place(temp_pathway, cache_pathway)
+
+
+class LookThroughExpander:
+    """ recursively replaces holdings of other registered funds with those funds' own holdings
+
+    Each fund's fully flattened holdings are memoized, so an underlying fund shared by several
+    funds (e.g. the building blocks of target-date funds) is only expanded once. Funds already on
+    the current expansion path are left as opaque holdings to break cycles.
+    """
+
+    def __init__(self, fund_holdings: Dict[str, pd.DataFrame], fund_registry: FundRegistry = None, fetch_holdings: Callable = None,
+                 max_depth: int = 3, materiality: float = 0.0):
+        """
+        Args:
+            fund_holdings (Dict[str, pd.DataFrame]): holdings of the funds already loaded, by fund ticker
+            fund_registry (FundRegistry, optional): used to recognise held securities that are funds and to look up their CIK and series
+            fetch_holdings (Callable, optional): called with (ticker, CIK, series) to get holdings of a nested fund that is not loaded. Returns a DataFrame or None
+            max_depth (int): maximum number of fund levels expanded below a portfolio fund
+            materiality (float): nested funds weighing less than this percent of their parent fund are not expanded
+        """
+        # not copied, fetched nested funds are kept separately
+        self._fund_holdings = fund_holdings
+        self._fetched = {}
+        self._fund_registry = fund_registry if fund_registry is not None else FundRegistry()
+        self._fetch_holdings = fetch_holdings
+        self._max_depth = max_depth
+        self._materiality = materiality
+        self._memo = {}
+        self._unavailable = set()
+        # funds whose expansion hit a cycle back to one of their ancestors
+        self._path_dependent = set()
+
+    @property
+    def fund_holdings(self):
+        return self._fund_holdings
+
+    def is_fund(self, ticker) -> bool:
+        return isinstance(ticker, str) and (ticker in self._fund_holdings or ticker in self._fetched or ticker in self._fund_registry)
+
+    def holdings_of(self, fund: str) -> pd.DataFrame:
+        """ returns a fund's direct holdings, fetching them if they are not loaded. None if unavailable """
+        if fund in self._fund_holdings:
+            return self._fund_holdings[fund]
+        if fund in self._fetched:
+            return self._fetched[fund]
+        if fund in self._unavailable or self._fetch_holdings is None or fund not in self._fund_registry:
+            return None
+
+        CIK, series = self._fund_registry.get(fund)
+        try:
+            holdings = self._fetch_holdings(fund, CIK, series)
+        except Exception as e:
+            logging.warning(f"Unable to fetch holdings of nested fund {fund}: {e}")
+            holdings = None
+
+        if holdings is None:
+            self._unavailable.add(fund)
+        else:
+            self._fetched[fund] = holdings
+
+        return holdings
+
+    def flatten(self, fund: str, remaining_depth: int = None, path: tuple = ()) -> pd.DataFrame:
+        """ returns a fund's holdings with nested funds expanded into their own holdings
+
+        Args:
+            fund (str): fund ticker
+            remaining_depth (int, optional): fund levels that may still be expanded. Defaults to max_depth
+            path (tuple): funds currently being expanded above this one, used for cycle detection
+
+        Returns:
+            pd.DataFrame: ticker, company_name, country and percent_of_portfolio, one row per security
+        """
+        remaining_depth = self._max_depth if remaining_depth is None else remaining_depth
+        key = (fund, remaining_depth)
+        if key in self._memo:
+            return self._memo[key]
+
+        holdings = self.holdings_of(fund)
+        if holdings is None:
+            return None
+
+        path = path + (fund,)
+        parts = []
+        nested = np.array([self.is_fund(x) for x in holdings['ticker']], dtype=bool)
+        weights = holdings['percent_of_portfolio'].to_numpy(dtype=float)
+
+        for position in np.flatnonzero(nested):
+            nested_fund = holdings['ticker'].iat[position]
+            if remaining_depth <= 0 or weights[position] < self._materiality:
+                nested[position] = False
+            elif nested_fund in path:
+                logging.warning(f"Cycle in fund holdings: {' -> '.join(path + (nested_fund,))}. Not expanding {nested_fund}")
+                nested[position] = False
+                self._path_dependent.update(path[path.index(nested_fund) + 1:])
+            else:
+                nested_holdings = self.flatten(nested_fund, remaining_depth - 1, path)
+                if nested_holdings is None:
+                    nested[position] = False
+                else:
+                    scaled = nested_holdings.copy()
+                    scaled['percent_of_portfolio'] = scaled['percent_of_portfolio'] * weights[position] / PERCENT_SCALE
+                    parts.append(scaled)
+
+        columns = ['ticker', 'company_name', 'country', 'percent_of_portfolio']
+        parts.insert(0, holdings.loc[~nested, [x for x in columns if x in holdings.columns]])
+        combined = pd.concat(parts, axis=0, ignore_index=True)
+        flattened = combined.groupby('ticker', as_index=False, sort=False).agg(
+            {x: ('sum' if x == 'percent_of_portfolio' else 'first') for x in combined.columns if x != 'ticker'}
+        )
+
+        # a result with a cycle cut depends on the path it was reached through, so it is not reused
+        if fund not in self._path_dependent:
+            self._memo[key] = flattened
+
+        return flattened
+
+    def flatten_all(self, funds) -> Dict[str, pd.DataFrame]:
+        """ returns the flattened holdings of each fund, skipping funds with no holdings """
+        flattened = {}
+
+        for fund in funds:
+            holdings = self.flatten(fund)
+            if holdings is not None:
+                flattened[fund] = holdings
+
+        return flattened
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+from exposure_matrix import FundExposureMatrix
+
+
+# overlap measures computed for every pair of funds
+OVERLAP_METRICS = ["weighted", "count", "correlation"]
+
+
+class FundOverlap:
+    """ pairwise overlap of every fund in a FundExposureMatrix
+
+    weighted: sum over shared securities of the smaller of the two funds' weights (percent_of_portfolio)
+    count: number of securities both funds hold
+    correlation: Pearson correlation of the two funds' weight vectors over all securities
+
+    Count and correlation are sparse products of the weight matrix with its transpose. The
+    weighted overlap is not a product, so it is computed exactly from each security's holders
+    sorted by weight: a holder's weight is the minimum for its pair with every heavier holder.
+    The pairs are added into a dense funds x funds array with bincount, a bounded number at a time.
+    """
+
+    def __init__(self, exposure_matrix: FundExposureMatrix, chunk_pairs: int = 20_000_000):
+        """
+        Args:
+            exposure_matrix (FundExposureMatrix): weight matrix of the funds to compare
+            chunk_pairs (int): maximum number of fund pairs expanded at once when computing the weighted overlap
+        """
+        self._funds = list(exposure_matrix.funds)
+        self._fund_positions = {fund: i for i, fund in enumerate(self._funds)}
+        weights = exposure_matrix.weights.tocsr(copy=True)
+        weights.sum_duplicates()
+        weights.eliminate_zeros()
+        self._weights = weights
+        self._chunk_pairs = chunk_pairs
+        self._matrices = {}
+
+    @property
+    def funds(self):
+        return self._funds
+
+    @property
+    def weights(self):
+        return self._weights
+
+    @property
+    def weighted(self) -> np.ndarray:
+        return self.metric("weighted")
+
+    @property
+    def count(self) -> np.ndarray:
+        return self.metric("count")
+
+    @property
+    def correlation(self) -> np.ndarray:
+        return self.metric("correlation")
+
+    def metric(self, metric: str) -> np.ndarray:
+        """ returns the funds x funds matrix of an overlap metric, computed on first use """
+        if metric not in OVERLAP_METRICS:
+            raise ValueError(f"Unknown overlap metric: {metric}. Options are {OVERLAP_METRICS}")
+        if metric not in self._matrices:
+            self._matrices[metric] = getattr(self, f"compute_{metric}")()
+        return self._matrices[metric]
+
+    def compute_count(self) -> np.ndarray:
+        held = self.weights.copy()
+        held.data = np.ones_like(held.data)
+        return (held @ held.T).toarray().astype(np.int64)
+
+    def compute_correlation(self) -> np.ndarray:
+        n_securities = self.weights.shape[1]
+        if n_securities == 0:
+            return np.full((len(self.funds), len(self.funds)), np.nan)
+
+        means = np.asarray(self.weights.sum(axis=1)).ravel() / n_securities
+        covariance = (self.weights @ self.weights.T).toarray() / n_securities - np.outer(means, means)
+        std = np.sqrt(np.clip(np.diag(covariance), 0, None))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # funds with no holdings have no defined correlation
+            return covariance / np.outer(std, std)
+
+    def compute_weighted(self) -> np.ndarray:
+        n_funds = len(self.funds)
+        by_security = self.weights.tocsc()
+        by_security.sort_indices()
+        overlap = np.zeros(n_funds * n_funds)
+
+        # sort every security's holders by weight, keeping securities contiguous
+        columns = np.repeat(np.arange(by_security.shape[1]), np.diff(by_security.indptr))
+        order = np.lexsort((by_security.data, columns))
+        funds = by_security.indices[order]
+        weights = by_security.data[order]
+        column_ends = by_security.indptr[1:][columns[order]]
+        # number of heavier holders of the same security after each entry
+        tails = column_ends - np.arange(len(order)) - 1
+
+        pair_ends = np.cumsum(tails)
+        start = 0
+        while start < len(order):
+            end = max(start + 1, np.searchsorted(pair_ends, pair_ends[start] - tails[start] + self._chunk_pairs, side="right"))
+            chunk_tails = tails[start:end]
+            n_pairs = int(chunk_tails.sum())
+            if n_pairs:
+                entries = np.repeat(np.arange(start, end), chunk_tails)
+                offsets = np.arange(n_pairs) - np.repeat(np.cumsum(chunk_tails) - chunk_tails, chunk_tails)
+                heavier = funds[entries + 1 + offsets]
+                overlap += np.bincount(funds[entries] * n_funds + heavier, weights=weights[entries], minlength=n_funds * n_funds)
+            start = end
+
+        overlap = overlap.reshape(n_funds, n_funds)
+        overlap = overlap + overlap.T
+        # a fund overlaps itself by its total weight
+        overlap[np.diag_indices(n_funds)] = np.asarray(self.weights.sum(axis=1)).ravel()
+        return overlap
+
+    def matrix(self, metric: str = "weighted") -> pd.DataFrame:
+        """ returns an overlap metric as a DataFrame with a row and a column per fund """
+        return pd.DataFrame(self.metric(metric), index=self.funds, columns=self.funds)
+
+    def pairs(self, metrics=None) -> pd.DataFrame:
+        """ returns one row per pair of different funds with the requested metrics (all by default) """
+        first, second = np.triu_indices(len(self.funds), k=1)
+        funds = np.asarray(self.funds, dtype=object)
+        df = pd.DataFrame({'fund': funds[first], 'other_fund': funds[second]})
+        for metric in metrics or OVERLAP_METRICS:
+            df[metric] = self.metric(metric)[first, second]
+        return df
+
+    def most_similar(self, fund: str, k: int = 10, metric: str = "weighted") -> pd.DataFrame:
+        """ returns the k funds overlapping most with a fund, most similar first
+
+        Returns:
+            pd.DataFrame: other_fund and every overlap metric already computed, sorted by metric
+        """
+        position = self._fund_positions[fund]
+        scores = np.nan_to_num(self.metric(metric)[position], nan=-np.inf)
+        scores[position] = -np.inf
+        k = min(k, len(self.funds) - 1)
+        if k <= 0:
+            return pd.DataFrame(columns=['other_fund', metric])
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        df = pd.DataFrame({'other_fund': np.asarray(self.funds, dtype=object)[top]})
+        for computed in [metric] + [x for x in self._matrices if x != metric]:
+            df[computed] = self.metric(computed)[position, top]
+        return df
+
+
+def universe_overlap(fund_holdings_pathway: str) -> FundOverlap:
+    """ pairwise overlap of every fund in a holdings folder, e.g. to find the funds most similar to one held """
+    return FundOverlap(FundExposureMatrix.from_folder(fund_holdings_pathway))
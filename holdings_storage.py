@@ -0,0 +1,189 @@
+import pandas as pd
+
+import glob
+import os
+import secrets
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+# column types of a saved fund holdings file
+HOLDINGS_DTYPE_MAP = {"company_name": str,
+                      "CUSIP": str,
+                      "num_holdings": float,
+                      "invested_amt_usd": float,
+                      "percent_of_portfolio": float,
+                      "country": str,
+                      "ticker": str,
+                      "security_key": str,
+                      }
+
+# file extension used by each storage format
+STORAGE_FORMATS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+# when a fund is saved in several formats the first one found in this order is read
+READ_PREFERENCE = ["arrow", "parquet", "csv"]
+
+
+def import_pyarrow():
+    """ imports pyarrow, which is only needed for the columnar storage formats """
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise ImportError("pyarrow is required for the parquet and arrow storage formats: pip install pyarrow") from e
+
+    return pa
+
+
+def holdings_schema(columns: List[str] = None):
+    """ returns the explicit pyarrow schema of a holdings file. String columns are dictionary-encoded
+
+    Args:
+        columns (List[str], optional): only include these columns. Defaults to all holdings columns
+    """
+    pa = import_pyarrow()
+    columns = columns if columns is not None else list(HOLDINGS_DTYPE_MAP)
+
+    fields = []
+    for column in columns:
+        if HOLDINGS_DTYPE_MAP[column] is str:
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(column, pa.float64()))
+
+    return pa.schema(fields)
+
+
+def holdings_to_table(fund_holdings: pd.DataFrame):
+    """ converts a holdings DataFrame to a pyarrow Table following holdings_schema """
+    pa = import_pyarrow()
+    columns = [x for x in HOLDINGS_DTYPE_MAP if x in fund_holdings.columns]
+    schema = holdings_schema(columns)
+
+    arrays = []
+    for field in schema:
+        values = fund_holdings[field.name]
+        if pa.types.is_dictionary(field.type):
+            # cast to object first so numeric-looking columns (e.g. all NaN tickers) still become strings
+            values = values.astype(object).where(values.notna(), None)
+            arrays.append(pa.array(values, type=pa.string(), from_pandas=True).dictionary_encode())
+        else:
+            arrays.append(pa.array(values.astype(float), type=field.type, from_pandas=True))
+
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def holdings_file_pathway(folder_pathway: str, fund_name: str, storage_format: str = "csv") -> str:
+    """ returns where a fund's holdings are saved for a storage format """
+    if storage_format not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown storage format: {storage_format}. Options are {list(STORAGE_FORMATS)}")
+
+    return f"{folder_pathway}/{fund_name}{STORAGE_FORMATS[storage_format]}"
+
+
+def write_fund_holdings(fund_holdings: pd.DataFrame, file_pathway: str, storage_format: str = "csv") -> None:
+    """ saves a fund's holdings in the requested storage format
+
+    Args:
+        fund_holdings (pd.DataFrame): DataFrame of fund holdings
+        file_pathway (str): file to write to
+        storage_format (str): "csv", "parquet" or "arrow" (Arrow IPC file)
+    """
+    if storage_format == "csv":
+        fund_holdings.to_csv(file_pathway, index=False)
+    elif storage_format == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(holdings_to_table(fund_holdings), file_pathway)
+    elif storage_format == "arrow":
+        pa = import_pyarrow()
+        table = holdings_to_table(fund_holdings)
+        # left uncompressed so readers can memory map the file without copying it
+        with pa.OSFile(file_pathway, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f"Unknown storage format: {storage_format}. Options are {list(STORAGE_FORMATS)}")
+
+
+@contextmanager
+def temporary_file(folder_pathway: str):
+    """ yields the pathway of a new empty file in folder_pathway, to be written and then renamed with move_into_place
+
+    Writing under a temporary name and renaming means a crash leaves at most a stray .tmp file, never
+    a truncated one. The file is created like open() creates one, so the umask gives it the usual
+    permissions. It is removed if it is still there when the block exits, e.g. after an error.
+    """
+    while True:
+        temp_pathway = os.path.join(folder_pathway or ".", f"tmp{secrets.token_hex(8)}.tmp")
+        try:
+            os.close(os.open(temp_pathway, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            break
+        except FileExistsError:
+            continue
+    try:
+        yield temp_pathway
+    finally:
+        if os.path.lexists(temp_pathway):
+            os.remove(temp_pathway)
+
+
+def move_into_place(temp_pathway: str, file_pathway: str) -> None:
+    """ renames a file written under temporary_file over file_pathway """
+    os.replace(temp_pathway, file_pathway)
+
+
+def replace_fund_holdings(fund_holdings: pd.DataFrame, file_pathway: str, storage_format: str = "csv") -> None:
+    """ saves a fund's holdings to a temporary file next to file_pathway and renames it into place """
+    with temporary_file(os.path.dirname(file_pathway)) as temp_pathway:
+        write_fund_holdings(fund_holdings, temp_pathway, storage_format)
+        move_into_place(temp_pathway, file_pathway)
+
+
+def read_fund_holdings(file_pathway: str, columns: List[str] = None) -> pd.DataFrame:
+    """ reads a fund's holdings file, inferring the storage format from the file extension
+
+    Args:
+        file_pathway (str): holdings file to read
+        columns (List[str], optional): only load these columns. Defaults to every column in the file
+
+    Returns:
+        pd.DataFrame: holdings with the column types in HOLDINGS_DTYPE_MAP
+    """
+    extension = os.path.splitext(file_pathway)[1]
+
+    if extension == STORAGE_FORMATS["csv"]:
+        usecols = (lambda x: x in columns) if columns is not None else None
+        df = pd.read_csv(file_pathway, index_col=None, header=0, usecols=usecols)
+    elif extension == STORAGE_FORMATS["parquet"]:
+        import pyarrow.parquet as pq
+        schema_names = pq.read_schema(file_pathway).names
+        read_columns = [x for x in columns if x in schema_names] if columns is not None else None
+        df = pq.read_table(file_pathway, columns=read_columns).to_pandas()
+    elif extension == STORAGE_FORMATS["arrow"]:
+        pa = import_pyarrow()
+        with pa.memory_map(file_pathway, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+            if columns is not None:
+                table = table.select([x for x in columns if x in table.schema.names])
+            df = table.to_pandas()
+    else:
+        raise ValueError(f"Unknown holdings file type: {file_pathway}")
+
+    column_dtype_map = {k: v for k, v in HOLDINGS_DTYPE_MAP.items() if k in df.columns}
+    return df.astype(column_dtype_map)
+
+
+def list_holdings_files(folder_pathway: str) -> Dict[str, str]:
+    """ finds the holdings files saved in a folder
+
+    Returns:
+        Dict[str, str]: fund name to the file its holdings are read from
+    """
+    holdings_files = {}
+
+    for storage_format in READ_PREFERENCE:
+        extension = STORAGE_FORMATS[storage_format]
+        for filename in glob.glob(os.path.join(folder_pathway + '/', "*" + extension)):
+            fund_name = os.path.basename(filename).removesuffix(extension)
+            holdings_files.setdefault(fund_name, filename)
+
+    return holdings_files
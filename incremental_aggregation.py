@@ -0,0 +1,248 @@
+import numpy as np
+import pandas as pd
+
+import logging
+
+from exposure_matrix import FundExposureMatrix
+
+
+class IncrementalPortfolio:
+    """ keeps the aggregated holdings of one portfolio in memory and applies position changes as deltas
+
+    Changing a fund position only touches the securities that fund holds, so rebalancing one or
+    two positions does not re-import or re-aggregate the rest of the portfolio. The rows of
+    full_portfolio_holdings are kept between reads as well: a change that only moves amounts
+    rewrites the rows it touched, and the sorted order of the universe's securities is computed
+    once, so a change that adds or drops rows is merged without sorting or factorizing again.
+    """
+
+    def __init__(self, exposure_matrix: FundExposureMatrix, fund_amounts: dict, stock_amounts: dict):
+        """
+        Args:
+            exposure_matrix (FundExposureMatrix): weight matrix of the funds that can be held
+            fund_amounts (dict): fund ticker to the amount invested in it
+            stock_amounts (dict): stock ticker to the amount invested in it
+        """
+        self._exposure_matrix = exposure_matrix
+        self._fund_amounts = {}
+        self._stock_amounts = {}
+        self._fund_exposure = np.zeros(len(exposure_matrix.securities))
+        # number of held funds each security appears in, so securities no fund holds any more drop out
+        self._fund_holder_counts = np.zeros(len(exposure_matrix.securities), dtype=np.int64)
+        # universe securities in ticker order, recomputed only when securities are added
+        self._security_order = None
+        # rows of the last full_portfolio_holdings, None once positions were added or dropped
+        self._holdings_tickers = None
+        self._holdings_totals = None
+        self._holdings_stock_amounts = None
+        self._security_rows = None
+        self._row_securities = None
+        self._stock_rows = None
+        self._touched_securities = []
+        self._n_touched = 0
+        self._touched_stocks = set()
+
+        for fund, amount in fund_amounts.items():
+            if fund in exposure_matrix.fund_positions:
+                self.add_fund(fund, amount)
+            else:
+                logging.warning(f"Unable to add investment amounts for {fund}")
+
+        for ticker, amount in stock_amounts.items():
+            self.update_position(ticker, amount)
+
+    @property
+    def exposure_matrix(self):
+        return self._exposure_matrix
+
+    @property
+    def fund_amounts(self):
+        return self._fund_amounts
+
+    @property
+    def stock_amounts(self):
+        return self._stock_amounts
+
+    @property
+    def fund_exposure(self):
+        return self._fund_exposure
+
+    def resize(self) -> None:
+        """ grows the exposure vectors after new securities were added to the exposure matrix """
+        n_new = len(self.exposure_matrix.securities) - len(self._fund_exposure)
+        if n_new > 0:
+            self._fund_exposure = np.concatenate([self._fund_exposure, np.zeros(n_new)])
+            self._fund_holder_counts = np.concatenate([self._fund_holder_counts, np.zeros(n_new, dtype=np.int64)])
+            self._security_order = None
+            self.clear_holdings_rows()
+
+    def apply_fund_delta(self, fund: str, delta: float) -> None:
+        """ adds delta times the fund's weights to the securities the fund holds """
+        columns, weights = self.exposure_matrix.fund_row(fund)
+        self._fund_exposure[columns] += delta * weights
+        if self._holdings_tickers is not None:
+            self._touched_securities.append(columns)
+            self._n_touched += len(columns)
+            # past a full pass over the universe, rebuilding the rows is cheaper than replaying the changes
+            if self._n_touched > len(self._fund_exposure):
+                self.clear_holdings_rows()
+
+    def update_position(self, ticker: str, new_amount: float) -> None:
+        """ sets the amount invested in a fund or stock, adding the position if it is not held yet
+
+        Tickers of funds in the exposure matrix are treated as funds, anything else as a stock.
+        """
+        if ticker in self.fund_amounts:
+            self.apply_fund_delta(ticker, new_amount - self.fund_amounts[ticker])
+            self._fund_amounts[ticker] = new_amount
+        elif ticker in self.exposure_matrix.fund_positions:
+            self.add_fund(ticker, new_amount)
+        else:
+            if self._stock_rows is not None and ticker in self._stock_rows:
+                self._touched_stocks.add(ticker)
+            else:
+                self.clear_holdings_rows()
+            self._stock_amounts[ticker] = new_amount
+
+    def add_fund(self, ticker: str, amount: float, fund_holdings: pd.DataFrame = None) -> None:
+        """ adds a fund position
+
+        Args:
+            ticker (str): fund ticker
+            amount (float): amount invested in the fund
+            fund_holdings (pd.DataFrame, optional): the fund's holdings, needed if the fund is not in the exposure matrix yet
+        """
+        if ticker in self.fund_amounts:
+            self.update_position(ticker, amount)
+            return
+
+        if ticker not in self.exposure_matrix.fund_positions:
+            if fund_holdings is None:
+                raise KeyError(f"No holdings loaded for fund {ticker}, pass fund_holdings to add it")
+            self.exposure_matrix.add_fund(ticker, fund_holdings)
+            self.resize()
+
+        self._fund_amounts[ticker] = amount
+        self.apply_fund_delta(ticker, amount)
+        codes = np.unique(self.exposure_matrix.fund_row(ticker)[0])
+        if (self._fund_holder_counts[codes] == 0).any():
+            self.clear_holdings_rows()
+        self._fund_holder_counts[codes] += 1
+
+    def remove_fund(self, ticker: str) -> None:
+        """ removes a fund position and its contribution to every security it holds """
+        if ticker not in self.fund_amounts:
+            raise KeyError(f"Fund {ticker} is not held in the portfolio")
+
+        self.apply_fund_delta(ticker, -self.fund_amounts.pop(ticker))
+        codes = np.unique(self.exposure_matrix.fund_row(ticker)[0])
+        self._fund_holder_counts[codes] -= 1
+        # clear rounding residue once nothing holds the security any more
+        dropped = codes[self._fund_holder_counts[codes] == 0]
+        if len(dropped):
+            self._fund_exposure[dropped] = 0.0
+            self.clear_holdings_rows()
+
+    def remove_stock(self, ticker: str) -> None:
+        """ removes an individual stock position """
+        if ticker not in self.stock_amounts:
+            raise KeyError(f"Stock {ticker} is not held in the portfolio")
+
+        del self._stock_amounts[ticker]
+        self.clear_holdings_rows()
+
+    def clear_holdings_rows(self) -> None:
+        """ drops the cached rows of full_portfolio_holdings after positions were added or dropped """
+        self._holdings_tickers = None
+        self._touched_securities = []
+        self._n_touched = 0
+        self._touched_stocks = set()
+
+    def held_securities(self) -> np.ndarray:
+        """ returns the IDs of the securities held through funds, in ticker order """
+        if self._security_order is None:
+            self._security_order = np.argsort(self.exposure_matrix.securities, kind="stable")
+        order = self._security_order
+        return order[self._fund_holder_counts[order] > 0]
+
+    def combined_fund_portfolio(self) -> pd.DataFrame:
+        """ returns the holdings through funds in the layout of PortfolioConstructor.combined_fund_portfolio """
+        held = self.held_securities()
+        securities = self.exposure_matrix.securities
+
+        df = pd.DataFrame({'ticker': securities[held]})
+        for column in self.exposure_matrix.master.info_columns:
+            df[column] = self.exposure_matrix.master.info_column(column, held)
+        df['portfolio_holdings'] = self._fund_exposure[held]
+
+        return df
+
+    def build_holdings_rows(self) -> None:
+        """ lays out one row per security held through funds or directly, in ticker order
+
+        Stocks are merged into the sorted fund securities with searchsorted, a stock that is also
+        held through a fund shares its row.
+        """
+        held = self.held_securities()
+        keys = self.exposure_matrix.securities[held]
+        stocks = sorted(x for x in self.stock_amounts if not pd.isna(x))
+        stock_keys = np.asarray(stocks, dtype=object)
+        stock_values = np.nan_to_num(np.asarray([self.stock_amounts[x] for x in stocks], dtype=float), nan=0.0)
+
+        positions = np.searchsorted(keys, stock_keys) if len(keys) else np.zeros(len(stocks), dtype=np.int64)
+        matched = positions < len(keys)
+        matched[matched] = keys[positions[matched]] == stock_keys[matched]
+        # stocks no fund holds get a row of their own ahead of the fund security they sort before
+        extra_positions = positions[~matched]
+        held_rows = np.arange(len(keys)) + np.searchsorted(extra_positions, np.arange(len(keys)), side="right")
+        extra_rows = extra_positions + np.arange(len(extra_positions))
+        stock_rows = np.empty(len(stocks), dtype=np.int64)
+        stock_rows[matched] = held_rows[positions[matched]]
+        stock_rows[~matched] = extra_rows
+
+        n_rows = len(keys) + len(extra_rows)
+        tickers = np.empty(n_rows, dtype=object)
+        tickers[held_rows] = keys
+        tickers[extra_rows] = stock_keys[~matched]
+        stock_amounts = np.zeros(n_rows)
+        stock_amounts[stock_rows] = stock_values
+        totals = stock_amounts.copy()
+        totals[held_rows] = self._fund_exposure[held] + stock_amounts[held_rows]
+
+        self._security_rows = np.full(len(self._fund_exposure), -1, dtype=np.int64)
+        self._security_rows[held] = held_rows
+        self._row_securities = np.full(n_rows, -1, dtype=np.int64)
+        self._row_securities[held_rows] = held
+        self._stock_rows = dict(zip(stocks, stock_rows.tolist()))
+        self._holdings_tickers = pd.Series(tickers).array
+        self._holdings_stock_amounts = stock_amounts
+        self._holdings_totals = totals
+        self._touched_securities = []
+        self._n_touched = 0
+        self._touched_stocks = set()
+
+    def refresh_holdings_rows(self) -> None:
+        """ recomputes the total of every row whose fund exposure or stock amount changed since the last read """
+        for ticker in self._touched_stocks:
+            amount = self.stock_amounts[ticker]
+            self._holdings_stock_amounts[self._stock_rows[ticker]] = 0.0 if pd.isna(amount) else amount
+
+        stock_rows = np.fromiter(map(self._stock_rows.get, self._touched_stocks), dtype=np.int64, count=len(self._touched_stocks))
+        security_rows = self._security_rows[np.concatenate(self._touched_securities)] if self._touched_securities else stock_rows[:0]
+        rows = np.unique(np.concatenate([security_rows, stock_rows]))
+        securities = self._row_securities[rows]
+        fund_exposure = np.where(securities >= 0, self._fund_exposure[securities], 0.0)
+        self._holdings_totals[rows] = fund_exposure + self._holdings_stock_amounts[rows]
+
+        self._touched_securities = []
+        self._n_touched = 0
+        self._touched_stocks = set()
+
+    def full_portfolio_holdings(self) -> pd.DataFrame:
+        """ returns the holdings through funds plus individual stocks in the layout of PortfolioConstructor.full_portfolio_holdings """
+        if self._holdings_tickers is None:
+            self.build_holdings_rows()
+        elif self._touched_securities or self._touched_stocks:
+            self.refresh_holdings_rows()
+
+        return pd.DataFrame({'ticker': self._holdings_tickers, 'portfolio_holdings': self._holdings_totals.copy()})
@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable
+
+
+def current_rss() -> int:
+    """ returns the resident set size of this process in bytes, None where /proc is not available """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss() -> int:
+    """ returns the highest resident set size this process has reached in bytes, None if unknown """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class RunMetrics:
+    """ collects what a pipeline run spent its time on: stages, API calls, retries, cache hits and rows
+
+    Everything recorded is also passed to the registered hooks as (event, data) so callers can
+    stream metrics elsewhere while the run is going. report() returns the whole run as a dict
+    that can be saved as JSON.
+    """
+
+    def __init__(self, hooks: list = None):
+        self._hooks = list(hooks or [])
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._stages = []
+        self._api_calls = {}
+        self._caches = {}
+        self._items = {}
+        self._counters = {}
+
+    @property
+    def hooks(self):
+        return self._hooks
+
+    def add_hook(self, hook: Callable) -> None:
+        """ registers a callable that is called with (event, data) for everything recorded """
+        self._hooks.append(hook)
+
+    def emit(self, event: str, data: dict) -> None:
+        for hook in self._hooks:
+            try:
+                hook(event, data)
+            except Exception as e:
+                logging.warning(f"Metrics hook {hook} failed on {event}: {e}")
+
+    @contextmanager
+    def stage(self, name: str):
+        """ times a pipeline stage. The yielded dict can be given extra fields such as rows """
+        record = {'stage': name, 'started_at': time.time(), 'rss_start_bytes': current_rss()}
+        self.emit('stage_start', {'stage': name})
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            record['rss_end_bytes'] = current_rss()
+            record['process_peak_rss_bytes'] = peak_rss()
+            with self._lock:
+                self._stages.append(record)
+            self.emit('stage_end', dict(record))
+
+    def record_api_call(self, endpoint: str, seconds: float, success: bool = True) -> None:
+        """ records one request to an external API (e.g. nport, mapping, yahoo) """
+        with self._lock:
+            stats = self._api_calls.setdefault(endpoint, {'calls': 0, 'failures': 0, 'retries': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            stats['calls'] += 1
+            stats['failures'] += 0 if success else 1
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+        self.emit('api_call', {'endpoint': endpoint, 'seconds': seconds, 'success': success})
+
+    def record_retry(self, endpoint: str, reason: str = None) -> None:
+        with self._lock:
+            stats = self._api_calls.setdefault(endpoint, {'calls': 0, 'failures': 0, 'retries': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            stats['retries'] += 1
+        self.emit('retry', {'endpoint': endpoint, 'reason': reason})
+
+    def record_cache(self, cache: str, hits: int, misses: int) -> None:
+        """ records lookups against a cache (e.g. cusip_cache, filing_index, stock_metadata) """
+        with self._lock:
+            stats = self._caches.setdefault(cache, {'hits': 0, 'misses': 0})
+            stats['hits'] += hits
+            stats['misses'] += misses
+        self.emit('cache', {'cache': cache, 'hits': hits, 'misses': misses})
+
+    def record_item(self, category: str, name: str, seconds: float, **fields) -> None:
+        """ records the time spent on one item of a stage, e.g. downloading a single fund """
+        item = {'name': name, 'seconds': seconds, **fields}
+        with self._lock:
+            self._items.setdefault(category, []).append(item)
+        self.emit('item', {'category': category, **item})
+
+    def increment(self, counter: str, n: int = 1) -> None:
+        """ adds to a named counter such as rows processed """
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + n
+        self.emit('counter', {'counter': counter, 'n': n})
+
+    def report(self, slowest_items: int = 10) -> dict:
+        """ returns the run's metrics as a JSON-serializable dict
+
+        Args:
+            slowest_items (int): number of slowest items kept per category, all items are summarized
+        """
+        with self._lock:
+            api_calls = {}
+            for endpoint, stats in self._api_calls.items():
+                api_calls[endpoint] = {**stats, 'mean_seconds': stats['total_seconds'] / stats['calls'] if stats['calls'] else 0.0}
+
+            caches = {}
+            for cache, stats in self._caches.items():
+                lookups = stats['hits'] + stats['misses']
+                caches[cache] = {**stats, 'hit_rate': stats['hits'] / lookups if lookups else None}
+
+            items = {}
+            for category, records in self._items.items():
+                items[category] = {
+                    'count': len(records),
+                    'total_seconds': sum(x['seconds'] for x in records),
+                    'slowest': sorted(records, key=lambda x: x['seconds'], reverse=True)[:slowest_items],
+                }
+
+            return {
+                'started_at': self._started_at,
+                'wall_seconds': time.time() - self._started_at,
+                'process_peak_rss_bytes': peak_rss(),
+                'stages': [dict(x) for x in self._stages],
+                'api_calls': api_calls,
+                'caches': caches,
+                'items': items,
+                'counters': dict(self._counters),
+            }
+
+    def save_report(self, pathway: str) -> None:
+        """ writes report() to a JSON file """
+        with open(pathway, "w") as f:
+            json.dump(self.report(), f, indent=2, default=str)
+
+
+class LatencyRecorder:
+    """ keeps the latencies of the most recent requests to each endpoint of a long-running service
+
+    Only the last window requests per endpoint are kept, so memory stays bounded however long the
+    service runs, while request and error counts cover its whole lifetime.
+    """
+
+    def __init__(self, window: int = 10_000):
+        """
+        Args:
+            window (int): number of most recent latencies kept per endpoint for the percentiles
+        """
+        self._window = window
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._counts = {}
+
+    def record(self, endpoint: str, seconds: float, success: bool = True) -> None:
+        with self._lock:
+            self._latencies.setdefault(endpoint, deque(maxlen=self._window)).append(seconds)
+            counts = self._counts.setdefault(endpoint, {'requests': 0, 'errors': 0})
+            counts['requests'] += 1
+            counts['errors'] += 0 if success else 1
+
+    def summary(self) -> dict:
+        """ returns request and error counts and latency percentiles in milliseconds for each endpoint """
+        with self._lock:
+            latencies = {endpoint: sorted(x) for endpoint, x in self._latencies.items()}
+            counts = {endpoint: dict(x) for endpoint, x in self._counts.items()}
+
+        def percentile(values, q):
+            return 1000 * values[min(len(values) - 1, int(q * len(values)))]
+
+        return {
+            endpoint: {
+                **counts[endpoint],
+                'mean_ms': 1000 * sum(values) / len(values),
+                'p50_ms': percentile(values, 0.50),
+                'p95_ms': percentile(values, 0.95),
+                'p99_ms': percentile(values, 0.99),
+                'max_ms': 1000 * values[-1],
+            }
+            for endpoint, values in latencies.items()
+        }
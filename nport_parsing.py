@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+
+from itertools import count, repeat
+from operator import itemgetter
+from typing import List
+
+
+# placeholders N-PORT filers use when a holding has no identifier of that type
+MISSING_IDENTIFIERS = {"", "N/A", "n/a", "NA", "None", "NONE", "000000000", "00000000000000000000"}
+
+# security keys are "<identifier type>:<value>". Exchange tickers never contain the separator
+SECURITY_KEY_SEPARATOR = ":"
+
+# placeholder identifiers mapped to None, looked up with PLACEHOLDERS.get(x, x)
+PLACEHOLDERS = dict.fromkeys(MISSING_IDENTIFIERS)
+
+# columns of parsed holdings, in the order they are saved
+NPORT_COLUMNS = ["company_name", "CUSIP", "num_holdings", "invested_amt_usd", "percent_of_portfolio", "country", "security_key"]
+
+
+def is_security_key(ticker) -> bool:
+    """ True for the identifier keys given to holdings that could not be matched to a ticker """
+    return isinstance(ticker, str) and SECURITY_KEY_SEPARATOR in ticker
+
+
+def clean_identifiers(values: list) -> np.ndarray:
+    """ returns the identifiers as an object array with placeholders such as "000000000" replaced by None """
+    try:
+        return np.fromiter(map(PLACEHOLDERS.get, values, values), dtype=object, count=len(values))
+    except TypeError:
+        # an unhashable identifier, compared one at a time
+        return np.array([None if isinstance(x, str) and x in MISSING_IDENTIFIERS else x for x in values], dtype=object)
+
+
+def parse_floats(values: list) -> np.ndarray:
+    """ converts reported numbers to floats. Missing values become NaN """
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        # filers occasionally report numbers as text that is not a number
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=float)
+
+
+def categorical(values) -> pd.Categorical:
+    """ returns low cardinality values as a Categorical in order of first appearance, None and NaN as missing
+
+    Each value is looked up once in a dict that records the first row it appears in, which is
+    cheaper than pd.Categorical's own inference for the object and string values of a filing.
+    """
+    first_rows = {}
+    rows = np.fromiter(map(first_rows.setdefault, values, count()), dtype=np.int64, count=len(values))
+    categories = [x for x in first_rows if not pd.isna(x)]
+    codes = np.full(len(values), -1, dtype=np.int32)
+    codes[[first_rows[x] for x in categories]] = np.arange(len(categories), dtype=np.int32)
+    return pd.Categorical.from_codes(codes[rows], dtype=pd.CategoricalDtype(pd.Index(categories, dtype=object)), validate=False)
+
+
+def identifier_values(identifiers: list, identifier_type: str) -> list:
+    """ returns the value of one type of identifier of each holding, None where it has none
+
+    sec-api gives identifiers either as {"value": ...} or as a plain string.
+    """
+    try:
+        found = map(dict.get, identifiers, repeat(identifier_type), repeat({}))
+        return list(map(dict.get, found, repeat('value')))
+    except TypeError:
+        # a holding without identifiers, or with the identifier as a plain string
+        found = [x.get(identifier_type) if isinstance(x, dict) else None for x in identifiers]
+        return [x.get('value') if isinstance(x, dict) else x for x in found]
+
+
+def other_identifier(others) -> str:
+    """ returns the first identifier under "other" as "<description>=<value>", e.g. "SEDOL=2046251" """
+    if isinstance(others, dict):
+        others = [others]
+
+    for other in others or []:
+        value = other.get('value')
+        if value is not None and str(value) not in MISSING_IDENTIFIERS:
+            description = other.get('otherDesc') or "OTHER"
+            return f"{description}={value}"
+
+    return None
+
+
+def fallback_security_key(ISIN: str, other_id: str, LEI: str, title: str, name: str) -> str:
+    """ returns the key of a holding without a CUSIP, from the most to the least specific identifier
+
+    ISIN, then any other identifier (e.g. SEDOL), then the issuer LEI together with the issue's
+    title (an LEI on its own identifies the issuer, not the security), then the name.
+    """
+    sep = SECURITY_KEY_SEPARATOR
+    if ISIN is not None:
+        return f"ISIN{sep}{ISIN}"
+    if other_id is not None:
+        return f"OTHER{sep}{other_id}"
+    if LEI is not None:
+        return f"LEI{sep}{LEI}/{title or name}"
+    if name:
+        return f"NAME{sep}{str(name).strip().upper()}"
+    return None
+
+
+def prefixed(prefix: str, values: np.ndarray) -> np.ndarray:
+    """ returns prefix + value for an object array of identifiers """
+    try:
+        return prefix + values
+    except TypeError:
+        # identifiers reported as numbers
+        return np.array([prefix + str(x) for x in values], dtype=object)
+
+
+def fallback_security_keys(invstOrSecs: List[dict]) -> np.ndarray:
+    """ returns the security_key of each holding without a CUSIP, see fallback_security_key
+
+    Holdings with an ISIN, the bulk of them, are keyed a whole column at a time, the rest one by one.
+    """
+    identifiers = list(map(dict.get, invstOrSecs, repeat('identifiers'), repeat({})))
+    ISINs = clean_identifiers(identifier_values(identifiers, 'isin'))
+    keys = np.full(len(invstOrSecs), None, dtype=object)
+    with_ISIN = np.flatnonzero(ISINs != None)  # noqa: E711, elementwise comparison
+    keys[with_ISIN] = prefixed(f"ISIN{SECURITY_KEY_SEPARATOR}", ISINs[with_ISIN])
+
+    for i in np.flatnonzero(ISINs == None):  # noqa: E711
+        holding = invstOrSecs[i]
+        other_id = other_identifier((identifiers[i] or {}).get('other'))
+        LEI, title = clean_identifiers([holding.get('lei'), holding.get('title')])
+        keys[i] = fallback_security_key(None, other_id, LEI, title, holding.get('name'))
+
+    return keys
+
+
+def parse_nport_holdings(invstOrSecs: List[dict]) -> pd.DataFrame:
+    """ parses a filing's invstOrSecs into typed columns in one pass over each field
+
+    Each field is pulled out of all holdings with map and itemgetter straight into an array, without
+    building a row or an intermediate DataFrame. Numbers come out as floats, the country as a
+    Categorical, and placeholder CUSIPs are masked with one dict lookup per value.
+
+    Every holding is kept, including those without a CUSIP: each holding gets a security_key used
+    to match it across funds, built from its CUSIP or else its ISIN, other identifier or LEI.
+
+    Args:
+        invstOrSecs (List[dict]): holdings of an N-PORT filing as returned by sec-api
+
+    Returns:
+        pd.DataFrame: one row per holding with the columns in NPORT_COLUMNS
+    """
+    n = len(invstOrSecs)
+
+    def field(name: str) -> list:
+        try:
+            return list(map(itemgetter(name), invstOrSecs))
+        except KeyError:
+            # some filers leave the field out of a holding entirely
+            return [x.get(name) for x in invstOrSecs]
+
+    def floats(name: str) -> np.ndarray:
+        try:
+            return np.fromiter(map(itemgetter(name), invstOrSecs), dtype=float, count=n)
+        except (KeyError, TypeError, ValueError):
+            return parse_floats(field(name))
+
+    def text(values) -> pd.Series:
+        # kept as objects, inferring string columns here would cost more than parsing them
+        return pd.Series(values, dtype=object, copy=False)
+
+    CUSIP = clean_identifiers(field('cusip'))
+
+    keys = np.full(n, None, dtype=object)
+    with_CUSIP = CUSIP != None  # noqa: E711, elementwise comparison
+    keys[with_CUSIP] = prefixed(f"CUSIP{SECURITY_KEY_SEPARATOR}", CUSIP[with_CUSIP])
+    without_CUSIP = np.flatnonzero(~with_CUSIP)
+    if len(without_CUSIP):
+        keys[without_CUSIP] = fallback_security_keys([invstOrSecs[i] for i in without_CUSIP.tolist()])
+
+    return pd.DataFrame({
+        'company_name': text(np.fromiter(field('name'), dtype=object, count=n)),
+        'CUSIP': text(CUSIP),
+        'num_holdings': floats('balance'),
+        'invested_amt_usd': floats('valUSD'),
+        'percent_of_portfolio': floats('pctVal'),
+        'country': categorical(field('invCountry')),
+        'security_key': text(keys),
+    }, copy=False)
@@ -2,21 +2,58 @@ import numpy as np
 import pandas as pd
 
 import logging
-import os
-from typing import Dict
-import glob
 import copy
 
+from exposure_matrix import AGGREGATION_COLUMNS, FundExposureMatrix, read_fund_holdings_folder
+from fund_lookthrough import FundRegistry, LookThroughExpander
+from holdings_storage import list_holdings_files, read_fund_holdings
+from incremental_aggregation import IncrementalPortfolio
+from instrumentation import RunMetrics
+from security_master import CompactFundHoldings
+
 
 class PortfolioConstructor:
-    def __init__(self, portfolio_stock_holdings_df: pd.DataFrame, portfolio_fund_holdings_df: pd.DataFrame, fund_holdings_pathway: str):
+    def __init__(self, portfolio_stock_holdings_df: pd.DataFrame, portfolio_fund_holdings_df: pd.DataFrame, fund_holdings_pathway: str,
+                 engine: str = "sparse", look_through_depth: int = 0, materiality: float = 0.0, fund_registry: FundRegistry = None,
+                 fetch_holdings=None, metrics: RunMetrics = None):
+        """
+        Args:
+            portfolio_stock_holdings_df (pd.DataFrame): individual stocks held in the portfolio
+            portfolio_fund_holdings_df (pd.DataFrame): funds held in the portfolio
+            fund_holdings_pathway (str): folder with the holdings file of each fund
+            engine (str): "sparse" aggregates through a funds x securities weight matrix, "pandas" concatenates and groups the fund DataFrames
+            look_through_depth (int): number of levels of funds held by funds to expand into their own holdings. 0 keeps them as single securities
+            materiality (float): nested funds weighing less than this percent of their parent fund are not expanded
+            fund_registry (FundRegistry, optional): used to recognise held securities that are funds
+            fetch_holdings (Callable, optional): called with (ticker, CIK, series) for nested funds that have no holdings file
+            metrics (RunMetrics, optional): records the time spent loading and aggregating. A new one is created if not given
+        """
+        if engine not in ("sparse", "pandas"):
+            raise ValueError(f"Unknown aggregation engine: {engine}. Options are 'sparse' and 'pandas'")
+
         self._portfolio_stock_holdings_df = portfolio_stock_holdings_df
         self._portfolio_fund_holdings_df = portfolio_fund_holdings_df
         self._fund_holdings_pathway = fund_holdings_pathway
+        self._engine = engine
+        self._exposure_matrix = None
+        self._incremental_portfolio = None
+        self._metrics = metrics if metrics is not None else RunMetrics()
         
-        self.import_fund_holdings()
-        self.define_combined_fund_portfolio(self.fund_holdings_dict, self.portfolio_fund_amts)
-        self.define_combined_full_portfolio()
+        with self.metrics.stage("load_fund_holdings") as stage:
+            self.import_fund_holdings()
+            stage['funds'] = len(self.fund_holdings_dict)
+            stage['rows'] = self.fund_holdings_dict.n_rows
+            stage['securities'] = len(self.fund_holdings_dict.master)
+
+        if look_through_depth > 0:
+            with self.metrics.stage("look_through_nested_funds"):
+                self.expand_nested_funds(LookThroughExpander(self.fund_holdings_dict, fund_registry, fetch_holdings, look_through_depth, materiality))
+
+        with self.metrics.stage("aggregate_holdings") as stage:
+            self.define_combined_fund_portfolio(self.fund_holdings_dict, self.portfolio_fund_amts)
+            self.define_combined_full_portfolio()
+            stage['engine'] = engine
+            stage['rows'] = len(self.full_portfolio_holdings)
 
     @property
     def portfolio_fund_amts(self):
@@ -32,6 +69,7 @@ class PortfolioConstructor:
     
     @property
     def fund_holdings_dict(self):
+        """ fund name to holdings DataFrame with each fund's own rows and values, descriptive columns as Categoricals """
         return self._fund_holdings_dict
 
     @property
@@ -42,51 +80,88 @@ class PortfolioConstructor:
     def portfolio_total_holdings(self):
         return self._portfolio_total_holdings
 
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def engine(self):
+        return self._engine
+
+    @property
+    def exposure_matrix(self):
+        """ funds x securities weight matrix of the imported fund holdings, built on first use """
+        if self._exposure_matrix is None:
+            self._exposure_matrix = FundExposureMatrix(self.fund_holdings_dict)
+        return self._exposure_matrix
+
     @property
     def fund_holdings_pathway(self):
         return self._fund_holdings_pathway
     
+    @property
+    def incremental_portfolio(self):
+        """ in-memory aggregation state used by update_position, add_fund and remove_fund, created on first use """
+        if self._incremental_portfolio is None:
+            self._incremental_portfolio = IncrementalPortfolio(self.exposure_matrix, self.portfolio_fund_amts, self.holdings_amt_dict("stocks"))
+        return self._incremental_portfolio
+
     @property
     def combined_fund_portfolio(self):
+        if self._combined_fund_portfolio is None:
+            self._combined_fund_portfolio = self.incremental_portfolio.combined_fund_portfolio()
         return self._combined_fund_portfolio
     
     @property 
     def full_portfolio_holdings(self):
+        if self._full_portfolio_holdings is None:
+            self._full_portfolio_holdings = self.incremental_portfolio.full_portfolio_holdings()
         return self._full_portfolio_holdings
 
-    def import_fund_holdings(self) -> Dict[str, pd.DataFrame]:
-        """read in all of the fund holdings from the folder into a dictionary
+    def import_fund_holdings(self) -> CompactFundHoldings:
+        """read in all of the fund holdings (CSV, Parquet or Arrow files) from the folder into a dictionary
 
         Returns:
-            dict: key: fund name, value: DataFrame of holdings
+            CompactFundHoldings: key: fund name, value: DataFrame of holdings
         """
-        all_files = glob.glob(os.path.join(self.fund_holdings_pathway + '/', "*.csv"))
-        fund_holdings = {}
+        self._fund_holdings_dict = read_fund_holdings_folder(self.fund_holdings_pathway)
 
-        for filename in all_files:
-            fund_name = filename
-            fund_name = fund_name.removeprefix(self.fund_holdings_pathway + '/')
-            fund_name = fund_name.removesuffix('.csv')
-            try: 
-                df = pd.read_csv(filename, index_col=None, header=0)
-                
-                # remap column types
-                column_dtype_map = {"company_name": str, 
-                                    "CUSIP": str,
-                                    "num_holdings": float,
-                                    "invested_amt_usd": float,
-                                    "percent_of_portfolio": float,
-                                    "country": str,
-                                    "ticker": str,
-                                    }
-                
-                df = df.astype(column_dtype_map)
-                fund_holdings[fund_name] = df
-                
-            except:
-                logging.warning(f"Unable to import holdings for {fund_name} located in {filename}")
-        
-        self._fund_holdings_dict = fund_holdings
+    def expand_nested_funds(self, expander: LookThroughExpander) -> None:
+        """ replaces the holdings of each portfolio fund with its holdings after looking through any funds it holds """
+        portfolio_funds = [x for x in self.portfolio_fund_amts if x in self.fund_holdings_dict]
+        self._fund_holdings_dict.update(expander.flatten_all(portfolio_funds))
+
+    def update_position(self, ticker: str, new_amount: float) -> None:
+        """ changes the amount invested in a fund or stock, only re-aggregating the securities it affects
+
+        After the first change the aggregated holdings are kept in memory by incremental_portfolio, so
+        portfolio_fund_holdings_df and portfolio_stock_holdings_df no longer reflect the current amounts.
+        """
+        self.incremental_portfolio.update_position(ticker, new_amount)
+        self.clear_aggregated_holdings()
+
+    def add_fund(self, ticker: str, amount: float, fund_holdings: pd.DataFrame = None) -> None:
+        """ adds a fund position, reading its holdings from fund_holdings_pathway if they are not passed in or loaded yet """
+        if fund_holdings is None and ticker not in self.exposure_matrix.fund_positions:
+            filename = list_holdings_files(self.fund_holdings_pathway).get(ticker)
+            if filename is None:
+                raise KeyError(f"No holdings found for fund {ticker} in {self.fund_holdings_pathway}")
+            fund_holdings = read_fund_holdings(filename, columns=AGGREGATION_COLUMNS)
+        if fund_holdings is not None:
+            self._fund_holdings_dict[ticker] = fund_holdings
+
+        self.incremental_portfolio.add_fund(ticker, amount, fund_holdings)
+        self.clear_aggregated_holdings()
+
+    def remove_fund(self, ticker: str) -> None:
+        """ removes a fund position and its contribution to the securities it holds """
+        self.incremental_portfolio.remove_fund(ticker)
+        self.clear_aggregated_holdings()
+
+    def clear_aggregated_holdings(self) -> None:
+        """ drops the materialized aggregates so they are rebuilt from incremental_portfolio on next access """
+        self._combined_fund_portfolio = None
+        self._full_portfolio_holdings = None
 
     def holdings_amt_dict(self, holding_type: str = "stocks") -> dict:
         """ creates dictionary of holdings and the investment amounts """
@@ -114,16 +189,18 @@ class PortfolioConstructor:
         Returns:
             dict: dict of holding_name as keys and DataFrames of their holdings as values
         """
-        fund_holdings = copy.deepcopy(fund_holdings)
+        funds_with_amounts = {}
 
         for holding_name, holding_df in fund_holdings.items():
             try: 
                 holding_amt = portfolio_fund_holdings[holding_name]
-                holding_df['portfolio_holdings'] = holding_df['percent_of_portfolio'] * holding_amt
+                # a new frame sharing the holdings' columns, rather than a deep copy of every fund
+                holding_df = holding_df.assign(portfolio_holdings=holding_df['percent_of_portfolio'] * holding_amt)
             except:
                 logging.warning(f"Unable to add investment amounts for {holding_name}")
+            funds_with_amounts[holding_name] = holding_df
 
-        return fund_holdings
+        return funds_with_amounts
 
 
     def define_combined_fund_portfolio(self, fund_holdings: dict, portfolio_fund_holdings: dict) -> None:
@@ -137,9 +214,15 @@ class PortfolioConstructor:
             None: sets self._combined_fund_portfolio as the combined amounts of stocks held in portfolio
         """
 
+        if self.engine == "sparse":
+            if fund_holdings is not self.fund_holdings_dict:
+                self._exposure_matrix = FundExposureMatrix(fund_holdings)
+            self._combined_fund_portfolio = self.exposure_matrix.combined_fund_portfolio(portfolio_fund_holdings)
+            return
+
         funds_with_investment_amounts = self.add_investment_amounts(fund_holdings, portfolio_fund_holdings)
         df = pd.concat(funds_with_investment_amounts.values(), axis=0, join="inner")
-        df = df.drop(['CUSIP', 'num_holdings', 'invested_amt_usd', 'percent_of_portfolio'], axis=1)
+        df = df.drop(['CUSIP', 'num_holdings', 'invested_amt_usd', 'percent_of_portfolio'], axis=1, errors='ignore')
         aggregation_functions = {'company_name': 'first', 'country': 'first', 'portfolio_holdings': 'sum'}
         df_new = df.groupby(df['ticker'], as_index=False).aggregate(aggregation_functions)
 
@@ -149,6 +232,10 @@ class PortfolioConstructor:
 
     def define_combined_full_portfolio(self) -> None:
         """Combines fund holdings and individual stock holdings"""
+
+        if self.engine == "sparse":
+            self._full_portfolio_holdings = self.combine_with_stock_holdings(self.combined_fund_portfolio)
+            return
         
         fund_holdings = copy.deepcopy(self.combined_fund_portfolio)
         stock_holdings = self.portfolio_stock_holdings_df
@@ -158,4 +245,20 @@ class PortfolioConstructor:
         # concat the DataFrames and sum holdings. Adds new ones from stock_holdings but sums ones that already exist
         df = pd.concat([fund_holdings, stock_holdings]).groupby(["ticker"], as_index=False)["portfolio_holdings"].sum()
         
-        self._full_portfolio_holdings = df
\ No newline at end of file
+        self._full_portfolio_holdings = df
+
+    def combine_with_stock_holdings(self, combined_fund_portfolio: pd.DataFrame) -> pd.DataFrame:
+        """ adds the individual stock holdings to the amounts held through funds without copying either frame
+
+        Returns:
+            pd.DataFrame: ticker and portfolio_holdings sorted by ticker
+        """
+        stock_holdings = self.portfolio_stock_holdings_df
+        tickers = np.concatenate([combined_fund_portfolio['ticker'].to_numpy(dtype=object), stock_holdings['ticker'].to_numpy(dtype=object)])
+        amounts = np.concatenate([combined_fund_portfolio['portfolio_holdings'].to_numpy(dtype=float), stock_holdings['investment_amt'].to_numpy(dtype=float)])
+
+        codes, unique_tickers = pd.factorize(tickers, sort=True)
+        held = codes >= 0
+        totals = np.bincount(codes[held], weights=np.nan_to_num(amounts[held], nan=0.0), minlength=len(unique_tickers))
+
+        return pd.DataFrame({'ticker': np.asarray(unique_tickers, dtype=object), 'portfolio_holdings': totals})
@@ -2,18 +2,28 @@ import pandas as pd
 import numpy as np
 
 import os
+import glob
 import logging
 import copy
 from datetime import date
-import time
 
+from batch_aggregation import aggregate_portfolios
 from data_collection import DataImport
+from enrichment_journal import EnrichmentJournal, ProgressReporter
+from exposure_history import ExposureHistory
+from fund_lookthrough import FundRegistry
+from instrumentation import RunMetrics
+from nport_parsing import is_security_key
 from portfolio_aggregation import PortfolioConstructor
-
-import yfinance as yf
+from snapshot_store import SnapshotStore
+from yahoo_enrichment import MetadataCache, YahooEnricher
 
 class PortfolioAnalysis:
-    def __init__(self, portfolio_holdings_pathway: str):
+    def __init__(self, portfolio_holdings_pathway: str, storage_format: str = "csv"):
+        self._storage_format = storage_format
+        self._metrics = RunMetrics()
+        # journal of the last enrichment, removed once its results are saved
+        self._enrichment_journal = None
         self._portfolio_holdings = self.import_portfolio_holdings(portfolio_holdings_pathway)
         self.split_holdings_stock_funds_df()
         self._list_of_funds = self.create_list_of_funds()
@@ -23,6 +33,14 @@ class PortfolioAnalysis:
     def holdings_folder(self):
         return self._holdings_folder
     
+    @property
+    def storage_format(self):
+        return self._storage_format
+
+    @property
+    def metrics(self):
+        return self._metrics
+
     @property
     def list_of_funds(self):
         return self._list_of_funds
@@ -54,7 +72,8 @@ class PortfolioAnalysis:
         
         return df['tuples'].to_list()
     
-    def import_portfolio_holdings(self, pathway: str) -> pd.DataFrame:
+    @staticmethod
+    def import_portfolio_holdings(pathway: str) -> pd.DataFrame:
         """ returns a DataFrame of the portfolio holdings """
 
         holdings = None
@@ -73,6 +92,27 @@ class PortfolioAnalysis:
 
         return holdings
     
+    @staticmethod
+    def aggregate_portfolio_directory(portfolios_folder: str, fund_holdings_folder: str, output_folder: str = None, n_processes: int = 1) -> dict:
+        """ aggregates every client holdings CSV in a folder against one loaded fund universe
+
+        Args:
+            portfolios_folder (str): folder of holdings CSVs in the same layout as example_holdings.csv, one per client
+            fund_holdings_folder (str): folder of fund holdings, e.g. fund_holdings/<date>
+            output_folder (str, optional): write each client's aggregated holdings to <output_folder>/<client>.csv
+            n_processes (int): number of worker processes
+
+        Returns:
+            dict: client name (CSV file name) to its aggregated holdings, or to the file they were saved in
+        """
+        portfolios = {}
+        for pathway in sorted(glob.glob(os.path.join(portfolios_folder, "*.csv"))):
+            holdings = PortfolioAnalysis.import_portfolio_holdings(pathway)
+            if holdings is not None:
+                portfolios[os.path.basename(pathway).removesuffix('.csv')] = holdings
+
+        return aggregate_portfolios(portfolios, fund_holdings_folder, n_processes=n_processes, output_folder=output_folder)
+
     def split_holdings_stock_funds_df(self):
         """ takes portfolio holdings and breaks them into fund and stock holdings """
 
@@ -93,6 +133,10 @@ class PortfolioAnalysis:
     
     def define_todays_holdings_folder(self) -> None:
         """ creates a new folder with today's date if it exists or 
+
+        The folder is a view: its files link to the snapshots in fund_holdings/snapshots, and funds
+        whose latest filing is unchanged since it was stored are linked without being downloaded again.
+
         Returns:
             str: file path to today's folder
         """
@@ -106,63 +150,156 @@ class PortfolioAnalysis:
         self._holdings_folder = "fund_holdings/" + str(todays_date)
     
     
-    def import_fund_data(self) -> None:
-        """ Imports fund holdings using data_collection library """
+    def import_fund_data(self, max_workers: int = 1, verify_mode: str = "fast") -> dict:
+        """ Imports fund holdings using data_collection library
+
+        Args:
+            max_workers (int): number of funds to download concurrently
+            verify_mode (str): check of the files already downloaded today before they are skipped, "fast", "full" or "none"
+
+        Returns:
+            dict: funds that could not be downloaded and the reason why
+        """
         print("Beginning import of fund holdings")
-        DI = DataImport(self.list_of_funds, self.holdings_folder)
-        DI.generate_and_save_holdings()
+        DI = DataImport(self.list_of_funds, self.holdings_folder, max_workers=max_workers, storage_format=self.storage_format,
+                        metrics=self.metrics, verify_mode=verify_mode)
+        failed_funds = DI.generate_and_save_holdings()
         print("Finished importing fund holdings")
+        return failed_funds
     
-    def aggregate_portfolio(self) -> None:
-        """ aggregates all holdings into self.aggregaed_holdings """
+    def aggregate_portfolio(self, look_through_depth: int = 0, materiality: float = 0.0) -> None:
+        """ aggregates all holdings into self.aggregaed_holdings
+
+        Args:
+            look_through_depth (int): number of levels of funds held by the portfolio's funds to expand into their own holdings
+            materiality (float): nested funds weighing less than this percent of their parent fund are not expanded
+        """
         print("Starting to aggregate holdings")
-        PC = PortfolioConstructor(self.portfolio_stock_holdings_df, self.portfolio_fund_holdings_df, self.holdings_folder)
+        lookthrough_args = {}
+        if look_through_depth > 0:
+            fund_registry = FundRegistry.from_sec("fund_holdings/company_tickers_mf.json")
+            fund_registry.add_funds(self.list_of_funds)
+            DI = DataImport(self.list_of_funds, self.holdings_folder, storage_format=self.storage_format, metrics=self.metrics)
+            lookthrough_args = {'look_through_depth': look_through_depth, 'materiality': materiality,
+                                'fund_registry': fund_registry, 'fetch_holdings': DI.fetch_fund_holdings}
+        PC = PortfolioConstructor(self.portfolio_stock_holdings_df, self.portfolio_fund_holdings_df, self.holdings_folder,
+                                  metrics=self.metrics, **lookthrough_args)
         self._aggregated_holdings = PC.full_portfolio_holdings
         print("Finished aggregating holdings")
     
-    def add_additional_information_to_stock_holdings(self) -> None:
-        """ Uses the Yahoo Finance API to pull in additional information about the holdings """
-        counter = 0
-        full_stock_info = {'ticker': [], 'portfolio_holdings': [], 'country': [], 'sector': [], 'industry': [], "market_cap": []}
-        for ticker, portfolio_holdings in zip(self.aggregated_holdings['ticker'], self.aggregated_holdings['portfolio_holdings']):
-            addition_info = self.query_YF_API(ticker)
-            full_stock_info['ticker'].append(ticker)
-            full_stock_info['portfolio_holdings'].append(portfolio_holdings)
-            full_stock_info['country'].append(addition_info[0])
-            full_stock_info['sector'].append(addition_info[1])
-            full_stock_info['industry'].append(addition_info[2])
-            full_stock_info['market_cap'].append(addition_info[3])
-            counter += 1
-            print(f"gathering information on stock {counter}")
-            if counter % 20 == 0:
-                self._aggregated_holdings = pd.DataFrame.from_dict(full_stock_info)
-                self.save_portfolio_holdings()
-        self._aggregated_holdings = pd.DataFrame.from_dict(full_stock_info)
+    def exposure_history(self, source: str = "snapshots", freq: str = "M", last_periods: int = None) -> ExposureHistory:
+        """ look-through exposure of the portfolio's current positions over past holdings snapshots
+
+        Args:
+            source (str): "snapshots" for one period per filing period of the snapshot store, "views" for one per dated holdings folder
+            freq (str): length of a filing period when source is "snapshots", e.g. "M" or "Q"
+            last_periods (int, optional): only the most recent periods
+
+        Returns:
+            ExposureHistory: exposure, drift and roll-ups as periods x securities arrays
+        """
+        fund_amounts = self.holdings_amounts(self.portfolio_fund_holdings_df)
+        stock_amounts = self.holdings_amounts(self.portfolio_stock_holdings_df)
+
+        with self.metrics.stage("exposure_history") as stage:
+            if source == "views":
+                history = ExposureHistory.from_views("fund_holdings", fund_amounts, stock_amounts, last=last_periods)
+            elif source == "snapshots":
+                history = ExposureHistory.from_snapshot_store(SnapshotStore("fund_holdings/snapshots"), fund_amounts, stock_amounts,
+                                                              freq=freq, last=last_periods)
+            else:
+                raise ValueError(f"Unknown exposure history source: {source}. Options are 'snapshots' and 'views'")
+            stage['periods'] = len(history.periods)
+            stage['snapshots'] = history.n_snapshots
+
+        return history
+
+    @staticmethod
+    def holdings_amounts(holdings: pd.DataFrame) -> dict:
+        """ ticker to investment amount """
+        return dict(zip(holdings['ticker'], holdings['investment_amt'].astype(float)))
+
+    def add_additional_information_to_stock_holdings(self, max_workers: int = 8, resume: bool = False,
+                                                     journal_pathway: str = "full_portfolio_holdings.journal.jsonl") -> None:
+        """ Uses the Yahoo Finance API to pull in additional information about the holdings
+
+        Enriched rows are appended to a journal in batches as they come in. If a run is interrupted,
+        calling again with resume=True skips every ticker already in the journal; tickers whose Yahoo
+        Finance queries failed are not journaled, so they are tried again. The journal is
+        kept until save_portfolio_holdings has written the enriched holdings, so a crash before they
+        are saved can still be resumed.
+
+        Args:
+            max_workers (int): maximum number of Yahoo Finance requests in flight
+            resume (bool): continue from the journal of an interrupted run instead of starting over
+            journal_pathway (str): file the enriched rows are journaled to
+        """
+        with self.metrics.stage("enrich_stock_holdings") as stage:
+            self.enrich_stock_holdings(max_workers, resume, journal_pathway)
+            stage['rows'] = len(self.aggregated_holdings)
+
+    def enrich_stock_holdings(self, max_workers: int, resume: bool, journal_pathway: str) -> None:
+        """ enriches the aggregated holdings, see add_additional_information_to_stock_holdings """
+        fields = ['country', 'sector', 'industry', 'market_cap']
+        journal = EnrichmentJournal(journal_pathway, fields)
+        if not resume:
+            journal.clear()
+
+        stock_info = journal.read()
+        # holdings only known by an identifier (e.g. ISIN:...) have no Yahoo Finance listing to look up
+        tickers = [x for x in self.aggregated_holdings['ticker'] if x not in stock_info and not is_security_key(x)]
+        if stock_info:
+            print(f"Resuming enrichment, {len(stock_info)} stocks already in {journal_pathway}")
+
+        progress = ProgressReporter(len(tickers), "gathering information on stocks")
+
+        def record(ticker, addition_info):
+            journal.append(ticker, addition_info)
+            progress.update()
+
+        try:
+            stock_info.update(self.stock_enricher(max_workers).enrich(tickers, on_result=record))
+        finally:
+            # keep whatever was enriched before an error or interrupt
+            journal.flush()
+        progress.finish()
+
+        # materialized once, in the aggregated order
+        enriched = pd.DataFrame(
+            [stock_info.get(x, (np.nan, np.nan, np.nan, np.nan)) for x in self.aggregated_holdings['ticker']],
+            columns=fields,
+        )
+        enriched.insert(0, 'ticker', self.aggregated_holdings['ticker'].to_numpy())
+        enriched.insert(1, 'portfolio_holdings', self.aggregated_holdings['portfolio_holdings'].to_numpy())
+        self._aggregated_holdings = enriched
+        self._enrichment_journal = journal
+
+    def stock_enricher(self, max_workers: int = 8) -> YahooEnricher:
+        """ returns a Yahoo Finance enricher backed by the metadata cache in the fund_holdings folder """
+        self.check_holdings_folder()
+        return YahooEnricher(MetadataCache("fund_holdings/stock_metadata_cache.sqlite"), max_workers=max_workers,
+                             metrics=self.metrics)
         
     def query_YF_API(self, ticker: str) -> tuple:
         """ query Yahoo Finance API to pull additional information on stock"""
-        ans = (np.nan, np.nan, np.nan, np.nan)
-        
-        start_time = time.time()
-        while time.time() - start_time <= 10: # timeout after 10 seconds of trying
-            info = yf.Ticker(ticker).info
-            if info['regularMarketPrice'] is not None:
-                try:
-                    country = info['country']
-                    sector = info['sector']
-                    industry = info['industry']
-                    marketCap = info['marketCap']
-                    ans = (country, sector, industry, marketCap)
-                except:
-                    pass
-        if info['regularMarketPrice'] is None:
-            logging.warning(f"Unable to find information on {ticker} on Yahoo Finance")
-        elif ans[0] is None:
-            logging.warning(f"Yahoo Finance query timed out after 10 seconds. Unable to pull information on {ticker}")
-        
-        return ans
+        return self.stock_enricher(max_workers=1).enrich([ticker]).get(ticker, (np.nan, np.nan, np.nan, np.nan))
     
+    def load_aggregated_holdings(self, pathway: str="full_portfolio_holdings.csv") -> None:
+        """ reads holdings saved by save_portfolio_holdings back into self.aggregated_holdings, e.g. to enrich them in a later run """
+        self._aggregated_holdings = pd.read_csv(pathway, index_col=False, dtype={'ticker': str})
+
     def save_portfolio_holdings(self, save_pathway: str="full_portfolio_holdings.csv") -> None:
-        """ save portfolio_holdings """
+        """ save portfolio_holdings, then remove the journal of the enrichment that produced them """
         
-        self.aggregated_holdings.to_csv(save_pathway, index=False)
\ No newline at end of file
+        self.aggregated_holdings.to_csv(save_pathway, index=False)
+        if self._enrichment_journal is not None:
+            self._enrichment_journal.clear()
+            self._enrichment_journal = None
+
+    def run_report(self) -> dict:
+        """ returns the time, API calls, retries, cache hit rates and memory of every stage run so far """
+        return self.metrics.report()
+
+    def save_run_report(self, save_pathway: str="run_report.json") -> None:
+        """ save run_report as JSON """
+        self.metrics.save_report(save_pathway)
@@ -0,0 +1,77 @@
+import logging
+import random
+import threading
+import time
+from typing import Callable
+
+
+class TokenBucket:
+    """ thread-safe token bucket used to keep API calls under a requests-per-second quota
+
+    Args:
+        rate (float): tokens added per second
+        capacity (float): maximum burst size. Defaults to ``rate``
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("Token bucket rate must be positive")
+        self._rate = rate
+        self._capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self._capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def acquire(self, tokens: float = 1) -> None:
+        """ blocks until ``tokens`` are available and then consumes them """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+
+                wait_time = (tokens - self._tokens) / self.rate
+
+            time.sleep(wait_time)
+
+
+def call_with_retries(func: Callable, *args, max_retries: int = 3, backoff_base: float = 1.0,
+                      rate_limiter: TokenBucket = None, description: str = "API call", on_retry: Callable = None, **kwargs):
+    """ calls ``func`` and retries with exponential backoff (plus jitter) if it raises
+
+    Args:
+        func (Callable): function to call
+        max_retries (int): number of retries after the first attempt
+        backoff_base (float): seconds to wait before the first retry, doubled on every further retry
+        rate_limiter (TokenBucket, optional): bucket to take a token from before every attempt
+        description (str): used in log messages
+        on_retry (Callable, optional): called with the exception before every retry
+
+    Returns:
+        result of ``func``. The last exception is re-raised once all retries are used up
+    """
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            wait_time = backoff_base * (2 ** attempt) * (1 + random.random() * 0.1)
+            if on_retry is not None:
+                on_retry(e)
+            logging.warning(f"{description} failed ({e}), retrying in {wait_time:.1f} seconds")
+            time.sleep(wait_time)
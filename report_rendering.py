@@ -0,0 +1,140 @@
+import pandas as pd
+
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from data_visualizations import CHARTS, DISTRIBUTION_MAX_POINTS, PLOTLY_CHARTS, DataVisualizations
+
+
+# file formats a chart can be saved in. Matplotlib charts in html are an inline SVG page
+FIGURE_FORMATS = ["png", "svg", "html"]
+
+
+def save_matplotlib_figure(figure, pathway_stem: str, formats: List[str]) -> List[str]:
+    """ saves a matplotlib figure as <pathway_stem>.<format> for each format and returns the files written """
+    files = []
+
+    for file_format in formats:
+        pathway = f"{pathway_stem}.{file_format}"
+        if file_format == "html":
+            svg = io.StringIO()
+            figure.savefig(svg, format="svg", bbox_inches="tight")
+            with open(pathway, "w") as f:
+                f.write(f"<!DOCTYPE html>\n<html><body>\n{svg.getvalue()}\n</body></html>\n")
+        else:
+            figure.savefig(pathway, format=file_format, bbox_inches="tight")
+        files.append(pathway)
+
+    return files
+
+
+def save_plotly_figure(figure, pathway_stem: str, formats: List[str]) -> List[str]:
+    """ saves a plotly figure for each format and returns the files written. PNG and SVG need kaleido, they are skipped without it """
+    files = []
+
+    for file_format in formats:
+        pathway = f"{pathway_stem}.{file_format}"
+        try:
+            if file_format == "html":
+                # plotly.js is loaded from its CDN rather than embedded, which would add megabytes per chart
+                figure.write_html(pathway, include_plotlyjs="cdn")
+            else:
+                figure.write_image(pathway, format=file_format)
+        except Exception as e:
+            logging.warning(f"Unable to save {pathway}: {e}")
+            continue
+        files.append(pathway)
+
+    return files
+
+
+def read_holdings(holdings) -> pd.DataFrame:
+    """ holdings may be given as a DataFrame or as the pathway of a CSV """
+    return pd.read_csv(holdings, index_col=None) if isinstance(holdings, str) else holdings
+
+
+def render_report(portfolio_holdings, aggregate_holdings, output_folder: str, charts: List[str] = None,
+                  formats: List[str] = ("png",), max_points: int = DISTRIBUTION_MAX_POINTS, save_cube: bool = True) -> Dict[str, list]:
+    """ renders the charts of one portfolio to files without a display or pyplot
+
+    Every chart is drawn on its own matplotlib Figure (or plotly figure) and closed by going out
+    of scope, so nothing is kept in global plotting state between charts or reports.
+
+    Args:
+        portfolio_holdings (pd.DataFrame or str): portfolio holdings, or the pathway of their CSV
+        aggregate_holdings (pd.DataFrame or str): enriched aggregated holdings, or the pathway of their CSV
+        output_folder (str): folder the chart files are written to
+        charts (List[str], optional): DataVisualizations charts to draw. Defaults to all of CHARTS
+        formats (List[str]): any of FIGURE_FORMATS
+        max_points (int): the distribution chart is drawn from a sample of at most this many holdings
+        save_cube (bool): also save the exposure cube the charts are drawn from as exposure_cube.csv
+
+    Returns:
+        dict: chart name to the files written for it. Charts that could not be drawn are left out
+    """
+    from matplotlib.figure import Figure
+
+    unknown = [x for x in formats if x not in FIGURE_FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown figure formats: {unknown}. Options are {FIGURE_FORMATS}")
+
+    DV = DataVisualizations(read_holdings(portfolio_holdings), read_holdings(aggregate_holdings), max_points=max_points)
+    os.makedirs(output_folder, exist_ok=True)
+    files = {}
+
+    if save_cube:
+        DV.save_exposure_cube(os.path.join(output_folder, "exposure_cube.csv"))
+
+    for chart in charts or CHARTS:
+        pathway_stem = os.path.join(output_folder, chart)
+        try:
+            if chart in PLOTLY_CHARTS:
+                files[chart] = save_plotly_figure(getattr(DV, chart)(show=False), pathway_stem, formats)
+            else:
+                figure = getattr(DV, chart)(figure=Figure(figsize=(8, 6) if chart != "compareHolding" else (12, 6)))
+                files[chart] = save_matplotlib_figure(figure, pathway_stem, formats)
+        except Exception as e:
+            logging.error(f"Unable to draw {chart}: {e}")
+
+    return files
+
+
+def render_in_worker(name: str, portfolio_holdings, aggregate_holdings, output_folder: str, options: dict) -> tuple:
+    try:
+        return name, render_report(portfolio_holdings, aggregate_holdings, os.path.join(output_folder, name), **options)
+    except Exception as e:
+        # e.g. unreadable holdings, one bad portfolio should not stop the others
+        logging.error(f"Unable to render report {name}: {e}")
+        return name, {}
+
+
+def render_reports(reports: Dict[str, tuple], output_folder: str, n_processes: int = 1, charts: List[str] = None,
+                   formats: List[str] = ("png",), max_points: int = DISTRIBUTION_MAX_POINTS, chunk_size: int = 8) -> Dict[str, dict]:
+    """ renders the reports of many portfolios, optionally across processes
+
+    Args:
+        reports (Dict[str, tuple]): report name as key, (portfolio_holdings, aggregate_holdings) as value. Passing
+            CSV pathways rather than DataFrames lets each worker read its own inputs instead of receiving them pickled
+        output_folder (str): each report is written to <output_folder>/<report name>
+        n_processes (int): number of worker processes. 1 renders in the current process
+        charts (List[str], optional): DataVisualizations charts to draw. Defaults to all of CHARTS
+        formats (List[str]): any of FIGURE_FORMATS
+        max_points (int): the distribution chart is drawn from a sample of at most this many holdings
+        chunk_size (int): number of reports sent to a worker at a time
+
+    Returns:
+        dict: report name to a dict of chart name to the files written for it
+    """
+    options = {'charts': charts, 'formats': formats, 'max_points': max_points}
+    names = list(reports)
+    args = (names, [reports[x][0] for x in names], [reports[x][1] for x in names],
+            [output_folder] * len(names), [options] * len(names))
+
+    if n_processes <= 1 or len(names) <= 1:
+        return dict(map(render_in_worker, *args))
+
+    with ProcessPoolExecutor(max_workers=n_processes) as executor:
+        return dict(executor.map(render_in_worker, *args, chunksize=chunk_size))
@@ -0,0 +1,295 @@
+import numpy as np
+import pandas as pd
+
+from collections.abc import MutableMapping
+from itertools import repeat
+from typing import Dict, Iterable
+
+
+def factorize(values) -> tuple:
+    """ pd.factorize without first converting pandas columns (e.g. Arrow strings) to objects """
+    if not isinstance(values, (pd.Series, pd.Index, pd.api.extensions.ExtensionArray, np.ndarray)):
+        values = np.asarray(values, dtype=object)
+    return pd.factorize(values)
+
+
+def lookup_positions(positions: dict, values) -> np.ndarray:
+    """ returns the position of each value, -1 for values not in positions """
+    return np.fromiter(map(positions.get, values, repeat(-1)), dtype=np.int64, count=len(values))
+
+
+def intern_values(values: list, positions: dict, new_values) -> np.ndarray:
+    """ returns the position of each of new_values in values, appending the ones not there yet
+
+    Args:
+        values (list): interned values, position is the index
+        positions (dict): value to its position in values
+        new_values (array-like): distinct values to intern
+
+    Returns:
+        np.ndarray: position of each of new_values
+    """
+    lookup = lookup_positions(positions, new_values)
+    unseen = np.flatnonzero(lookup < 0)
+    if len(unseen):
+        lookup[unseen] = np.arange(len(values), len(values) + len(unseen))
+        unseen_values = [new_values[x] for x in unseen]
+        positions.update(zip(unseen_values, lookup[unseen].tolist()))
+        values.extend(unseen_values)
+    return lookup
+
+
+class SecurityMaster:
+    """ interns every security once under an integer ID, shared by the holdings of all funds
+
+    Descriptive columns such as company_name and country are kept once per security as codes
+    into a list of distinct values, so an issuer held by dozens of funds is stored a single time
+    and exposed as a pandas Categorical.
+    """
+
+    def __init__(self, info_columns: Iterable[str] = ("company_name", "country")):
+        """
+        Args:
+            info_columns (Iterable[str]): descriptive columns kept for each security
+        """
+        self._keys = []
+        self._positions = {}
+        self._keys_array = None
+        self._info_columns = list(info_columns)
+        self._categories = {x: [] for x in self._info_columns}
+        self._category_positions = {x: {} for x in self._info_columns}
+        self._info_codes = {x: np.zeros(0, dtype=np.int32) for x in self._info_columns}
+        self._info_dtypes = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def keys(self) -> np.ndarray:
+        """ security key (e.g. ticker) of each ID """
+        if self._keys_array is None or len(self._keys_array) != len(self._keys):
+            self._keys_array = np.asarray(self._keys, dtype=object)
+        return self._keys_array
+
+    @property
+    def positions(self) -> Dict[str, int]:
+        """ security key to ID """
+        return self._positions
+
+    @property
+    def info_columns(self):
+        return self._info_columns
+
+    @property
+    def info(self) -> pd.DataFrame:
+        """ descriptive columns of every security as Categoricals, indexed by ID """
+        return pd.DataFrame({x: self.info_column(x) for x in self._info_columns})
+
+    def info_column(self, column: str, ids: np.ndarray = None) -> pd.Categorical:
+        """ returns a descriptive column for the given IDs (all securities by default) without copying the strings """
+        codes = self._info_codes[column] if ids is None else self._info_codes[column][ids]
+        return pd.Categorical.from_codes(codes, dtype=self.info_dtype(column), validate=False)
+
+    def info_dtype(self, column: str) -> pd.CategoricalDtype:
+        """ categorical dtype of a descriptive column, rebuilt only when new values were interned """
+        dtype = self._info_dtypes.get(column)
+        if dtype is None or len(dtype.categories) != len(self._categories[column]):
+            dtype = self._info_dtypes[column] = pd.CategoricalDtype(pd.Index(self._categories[column], dtype=object))
+        return dtype
+
+    def ids(self, keys) -> np.ndarray:
+        """ returns the ID of each key, -1 for keys not interned """
+        codes, uniques = factorize(keys)
+        lookup = np.append(lookup_positions(self._positions, uniques), -1)
+        return lookup[codes]
+
+    def intern(self, keys, info: Dict[str, Iterable] = None) -> np.ndarray:
+        """ returns the ID of each key, interning keys not seen before
+
+        Only distinct keys are looked up, so the cost per row is a vectorized factorize. Descriptive
+        values are recorded from the first row with a non-missing value for each security.
+
+        Args:
+            keys (array-like): security keys, missing keys get ID -1
+            info (Dict[str, Iterable], optional): descriptive column name to its values, aligned with keys
+
+        Returns:
+            np.ndarray: ID of each key
+        """
+        return self.intern_rows(keys, info)[0]
+
+    def intern_rows(self, keys, info: Dict[str, Iterable] = None) -> tuple:
+        """ interns keys like intern, and also returns the category code of every row's descriptive values
+
+        Returns:
+            tuple: (ID of each key, descriptive column name to the code of each row's value, -1 where missing)
+        """
+        codes, uniques = factorize(keys)
+        lookup = np.append(intern_values(self._keys, self._positions, uniques), -1)
+        ids = lookup[codes]
+
+        row_codes = {}
+        for column in self._info_columns:
+            codes = self._info_codes[column]
+            if len(codes) < len(self._keys):
+                self._info_codes[column] = np.concatenate([codes, np.full(len(self._keys) - len(codes), -1, dtype=np.int32)])
+            if info is not None and column in info:
+                row_codes[column] = self.category_codes(column, info[column])
+                self.record_info(column, ids, row_codes[column])
+
+        return ids, row_codes
+
+    def category_codes(self, column: str, values) -> np.ndarray:
+        """ returns the code of each value in a descriptive column's categories, interning values not seen before """
+        value_codes, uniques = factorize(values)
+        lookup = np.append(intern_values(self._categories[column], self._category_positions[column], uniques), -1).astype(np.int32)
+        return lookup[value_codes]
+
+    def record_info(self, column: str, ids: np.ndarray, codes: np.ndarray) -> None:
+        """ fills in the column for securities that have no value yet, from the first row that has one
+
+        Args:
+            column (str): descriptive column
+            ids (np.ndarray): security ID of each row
+            codes (np.ndarray): category code of each row's value, see category_codes
+        """
+        security_codes = self._info_codes[column]
+        missing = (ids >= 0) & (codes >= 0)
+        missing[missing] = security_codes[ids[missing]] < 0
+        if not missing.any():
+            return
+
+        rows = np.flatnonzero(missing)
+        first_ids, first_rows = np.unique(ids[rows], return_index=True)
+        security_codes[first_ids] = codes[rows[first_rows]]
+
+    def memory_usage(self) -> int:
+        """ approximate bytes held by the keys, descriptive values and codes """
+        strings = sum(len(x) + 49 for x in self._keys if isinstance(x, str))
+        for column in self._info_columns:
+            strings += sum(len(x) + 49 for x in self._categories[column] if isinstance(x, str))
+            strings += self._info_codes[column].nbytes
+        return strings
+
+
+class CompactFundHoldings(MutableMapping):
+    """ holdings of many funds stored as (security ID, weight) arrays over a shared SecurityMaster
+
+    Behaves like a dict of fund name to holdings DataFrame, but each DataFrame is only built when a
+    fund is looked up and is not kept. A fund's rows keep their own descriptive values (e.g. the
+    company_name that fund reported) as int32 codes into the master's shared strings, and columns
+    other than the key, weight and descriptive columns are kept as they were given. A looked-up
+    DataFrame therefore has the fund's own columns, rows and values, with the descriptive columns
+    as Categoricals, the key column as objects and a fresh RangeIndex.
+
+    Aggregation reads arrays, which skips rows without a security key, and the master's info, which
+    describes each security by the first fund that reported it.
+    """
+
+    def __init__(self, master: SecurityMaster = None, key_column: str = "ticker", weight_column: str = "percent_of_portfolio"):
+        """
+        Args:
+            master (SecurityMaster, optional): security master to intern into. A new one is created if not given
+            key_column (str): column identifying a security across funds
+            weight_column (str): column with the security's weight in the fund
+        """
+        self._master = master if master is not None else SecurityMaster()
+        self._key_column = key_column
+        self._weight_column = weight_column
+        self._holdings = {}
+        self._rows = {}
+
+    @classmethod
+    def from_frames(cls, fund_holdings: Dict[str, pd.DataFrame], key_column: str = "ticker",
+                    weight_column: str = "percent_of_portfolio") -> "CompactFundHoldings":
+        """ interns a dict of fund name to holdings DataFrame """
+        compact = cls(key_column=key_column, weight_column=weight_column)
+        compact.update(fund_holdings)
+        return compact
+
+    @property
+    def master(self):
+        return self._master
+
+    @property
+    def key_column(self):
+        return self._key_column
+
+    @property
+    def weight_column(self):
+        return self._weight_column
+
+    @property
+    def n_rows(self) -> int:
+        return sum(len(x['weights']) for x in self._rows.values())
+
+    def arrays(self, fund: str) -> tuple:
+        """ returns (security IDs, weights) of a fund's rows with a security key, without building a DataFrame """
+        return self._holdings[fund]
+
+    def __setitem__(self, fund: str, holdings: pd.DataFrame) -> None:
+        """ interns a fund's holdings, keeping every row, column and value of the DataFrame """
+        info = {x: holdings[x] for x in self._master.info_columns if x in holdings.columns}
+        ids, info_codes = self._master.intern_rows(holdings[self._key_column], info)
+        ids = ids.astype(np.int32)
+        weights = np.ascontiguousarray(holdings[self._weight_column].to_numpy(dtype=float))
+        held = ids >= 0
+        stored = {self._key_column, self._weight_column, *info_codes}
+
+        self._rows[fund] = {
+            'columns': list(holdings.columns),
+            'ids': ids,
+            'weights': weights,
+            'info_codes': info_codes,
+            # rows without a security key keep the missing value they had
+            'missing_keys': None if held.all() else holdings[self._key_column].to_numpy(dtype=object)[~held],
+            'other_columns': holdings[[x for x in holdings.columns if x not in stored]].reset_index(drop=True) if len(stored) < holdings.shape[1] else None,
+        }
+        self._holdings[fund] = (ids, weights) if held.all() else (ids[held], weights[held])
+
+    def __getitem__(self, fund: str) -> pd.DataFrame:
+        """ builds the holdings DataFrame of a fund as it was stored, see the class docstring """
+        rows = self._rows[fund]
+        ids = rows['ids']
+        columns = {}
+
+        for column in rows['columns']:
+            if column == self._key_column:
+                keys = np.empty(len(ids), dtype=object)
+                held = ids >= 0
+                keys[held] = self._master.keys[ids[held]]
+                if rows['missing_keys'] is not None:
+                    keys[~held] = rows['missing_keys']
+                columns[column] = pd.Series(keys, dtype=object, copy=False)
+            elif column == self._weight_column:
+                columns[column] = rows['weights']
+            elif column in rows['info_codes']:
+                columns[column] = pd.Categorical.from_codes(rows['info_codes'][column], dtype=self._master.info_dtype(column), validate=False)
+            else:
+                columns[column] = rows['other_columns'][column]
+
+        return pd.DataFrame(columns, copy=False)
+
+    def __delitem__(self, fund: str) -> None:
+        del self._holdings[fund]
+        del self._rows[fund]
+
+    def __contains__(self, fund) -> bool:
+        return fund in self._holdings
+
+    def __iter__(self):
+        return iter(self._holdings)
+
+    def __len__(self) -> int:
+        return len(self._holdings)
+
+    def memory_usage(self) -> int:
+        """ approximate bytes held by the holdings arrays, other columns and the security master """
+        total = self._master.memory_usage()
+        for fund, rows in self._rows.items():
+            total += rows['ids'].nbytes + rows['weights'].nbytes + sum(x.nbytes for x in rows['info_codes'].values())
+            if self._holdings[fund][0] is not rows['ids']:
+                total += self._holdings[fund][0].nbytes + self._holdings[fund][1].nbytes
+            if rows['other_columns'] is not None:
+                total += int(rows['other_columns'].memory_usage(index=False, deep=True).sum())
+        return total
@@ -0,0 +1,178 @@
+import pandas as pd
+
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from typing import List
+
+from holdings_storage import STORAGE_FORMATS, holdings_file_pathway, move_into_place, temporary_file, write_fund_holdings
+
+
+def file_hash(file_pathway: str, chunk_size: int = 1 << 20) -> str:
+    """ returns the SHA-256 hex digest of a file's contents """
+    digest = hashlib.sha256()
+    with open(file_pathway, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_file(source: str, destination: str) -> None:
+    """ makes destination refer to source without copying it: a hard link, else a symlink, else a copy
+
+    The link is made under a temporary name and renamed over destination, so readers see either the
+    old file or the new one, never a missing or half copied file.
+    """
+    with temporary_file(os.path.dirname(destination)) as temp_pathway:
+        # the link is made under the temporary file's name, which has to be free
+        os.remove(temp_pathway)
+        try:
+            os.link(source, temp_pathway)
+        except OSError:
+            try:
+                os.symlink(os.path.abspath(source), temp_pathway)
+            except OSError:
+                shutil.copyfile(source, temp_pathway)
+        # not chmodded: a link shares the snapshot's permissions and a copy already has open()'s
+        os.replace(temp_pathway, destination)
+
+
+class SnapshotStore:
+    """ content-addressed store of fund holdings snapshots, one per fund and N-PORT filing accession
+
+    Each distinct holdings file is kept once under snapshots/<hash[:2]>/<hash>.<format>, and a
+    SQLite table records which fund and accession every file belongs to. The dated holdings folders
+    are views: they link to the snapshots of the funds' latest filings, so funds whose filing has
+    not changed are neither downloaded nor stored again.
+    """
+
+    def __init__(self, root_pathway: str):
+        """
+        Args:
+            root_pathway (str): folder holding the snapshot files and their snapshots.sqlite index
+        """
+        self._root_pathway = root_pathway
+        self._db_pathway = os.path.join(root_pathway, "snapshots.sqlite")
+        self._lock = threading.Lock()
+        os.makedirs(root_pathway, exist_ok=True)
+        self.create_table()
+
+    @property
+    def root_pathway(self):
+        return self._root_pathway
+
+    @property
+    def db_pathway(self):
+        return self._db_pathway
+
+    @contextmanager
+    def connect(self):
+        """ yields a connection that commits (or rolls back) and is closed when the block exits """
+        with closing(sqlite3.connect(self.db_pathway, timeout=30)) as conn, conn:
+            yield conn
+
+    def create_table(self) -> None:
+        """ creates the snapshot table if it does not exist yet """
+        with self._lock, self.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                "fund TEXT NOT NULL, "
+                "accession_no TEXT NOT NULL, "
+                "filed_at TEXT NOT NULL, "
+                "content_hash TEXT NOT NULL, "
+                "storage_format TEXT NOT NULL, "
+                "rows INTEGER NOT NULL, "
+                "stored_at REAL NOT NULL, "
+                "PRIMARY KEY (fund, accession_no, storage_format))"
+            )
+
+    def snapshot_pathway(self, content_hash: str, storage_format: str) -> str:
+        """ returns where the file with this content hash is stored """
+        return os.path.join(self.root_pathway, content_hash[:2], content_hash + STORAGE_FORMATS[storage_format])
+
+    def put(self, fund: str, accession_no: str, filed_at: str, fund_holdings: pd.DataFrame, storage_format: str = "csv") -> dict:
+        """ stores a fund's holdings for a filing, reusing the stored file if the same content is already there
+
+        The holdings are written to a temporary file, hashed and then renamed into place, so a
+        snapshot file is never seen half written.
+
+        Returns:
+            dict: the snapshot, as returned by get
+        """
+        if storage_format not in STORAGE_FORMATS:
+            raise ValueError(f"Unknown storage format: {storage_format}. Options are {list(STORAGE_FORMATS)}")
+
+        with temporary_file(self.root_pathway) as temp_pathway:
+            write_fund_holdings(fund_holdings, temp_pathway, storage_format)
+            content_hash = file_hash(temp_pathway)
+            pathway = self.snapshot_pathway(content_hash, storage_format)
+            # the same content is already stored, the temporary file is removed on exit
+            if not os.path.exists(pathway):
+                os.makedirs(os.path.dirname(pathway), exist_ok=True)
+                move_into_place(temp_pathway, pathway)
+
+        with self._lock, self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshots (fund, accession_no, filed_at, content_hash, storage_format, rows, stored_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (fund, accession_no, filed_at, content_hash, storage_format, len(fund_holdings), time.time()),
+            )
+
+        return self.get(fund, accession_no, storage_format)
+
+    def row_to_snapshot(self, row: tuple) -> dict:
+        snapshot = dict(zip(["fund", "accession_no", "filed_at", "content_hash", "storage_format", "rows", "stored_at"], row))
+        snapshot['pathway'] = self.snapshot_pathway(snapshot['content_hash'], snapshot['storage_format'])
+        return snapshot
+
+    def get(self, fund: str, accession_no: str, storage_format: str = None) -> dict:
+        """ returns the snapshot of a fund for a filing, None if it is not stored or its file is missing
+
+        Returns:
+            dict: keys fund, accession_no, filed_at, content_hash, storage_format, rows, stored_at and pathway
+        """
+        query = "SELECT fund, accession_no, filed_at, content_hash, storage_format, rows, stored_at FROM snapshots WHERE fund = ? AND accession_no = ?"
+        params = [fund, accession_no]
+        if storage_format is not None:
+            query += " AND storage_format = ?"
+            params.append(storage_format)
+
+        with self._lock, self.connect() as conn:
+            rows = conn.execute(query + " ORDER BY stored_at DESC", params).fetchall()
+
+        for row in rows:
+            snapshot = self.row_to_snapshot(row)
+            if os.path.exists(snapshot['pathway']):
+                return snapshot
+
+        return None
+
+    def history(self, fund: str = None) -> List[dict]:
+        """ returns every stored snapshot, oldest filing first, optionally only those of one fund """
+        query = "SELECT fund, accession_no, filed_at, content_hash, storage_format, rows, stored_at FROM snapshots"
+        params = []
+        if fund is not None:
+            query += " WHERE fund = ?"
+            params.append(fund)
+
+        with self._lock, self.connect() as conn:
+            rows = conn.execute(query + " ORDER BY filed_at, fund", params).fetchall()
+
+        return [self.row_to_snapshot(x) for x in rows]
+
+    def link_into_view(self, snapshot: dict, view_pathway: str) -> str:
+        """ makes a snapshot appear as <view_pathway>/<fund>.<format> without copying it
+
+        Returns:
+            str: the file in the view
+        """
+        os.makedirs(view_pathway, exist_ok=True)
+        pathway = holdings_file_pathway(view_pathway, snapshot['fund'], snapshot['storage_format'])
+        link_file(snapshot['pathway'], pathway)
+        logging.debug(f"Linked {snapshot['fund']} filing {snapshot['accession_no']} into {view_pathway}")
+        return pathway
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import asyncio
+import os
+import threading
+
+from aggregation_server import AggregationClient, AggregationServer
+from download_manifest import DownloadManifest
+from holdings_storage import holdings_file_pathway, write_fund_holdings
+from portfolio_aggregation import PortfolioConstructor
+
+
+FUNDS = {
+    'AAA': pd.DataFrame({'company_name': ["Apple", "Microsoft", "Nestle"], 'percent_of_portfolio': [50.0, 30.0, 20.0],
+                         'country': ["US", "US", "CH"], 'ticker': ["AAPL", "MSFT", "NESN"]}),
+    'BBB': pd.DataFrame({'company_name': ["Microsoft", "Toyota"], 'percent_of_portfolio': [60.0, 40.0],
+                         'country': ["US", "JP"], 'ticker': ["MSFT", "7203"]}),
+}
+
+PORTFOLIO = pd.DataFrame({'ticker': ["AAA", "BBB", "AAPL", "ZZZZ", "NOTAFUND"],
+                          'investment_amt': [1000.0, 2500.0, 300.0, 40.0, 10.0],
+                          'holding_type': ["fund", "fund", "stock", "stock", "fund"]})
+
+
+def write_folder(folder_pathway: str, funds: dict, failed_funds: dict = None, finished: bool = True) -> None:
+    """ writes fund holdings files and their manifest, as an import into the folder would """
+    os.makedirs(folder_pathway, exist_ok=True)
+    recorded = DownloadManifest(folder_pathway)
+    recorded.start_import()
+    for fund, holdings in funds.items():
+        pathway = holdings_file_pathway(folder_pathway, fund)
+        write_fund_holdings(holdings, pathway)
+        recorded.record(fund, pathway, len(holdings))
+    recorded.save()
+    if finished:
+        recorded.finish_import(failed_funds)
+
+
+def expected_holdings(portfolio: pd.DataFrame, folder_pathway: str) -> pd.Series:
+    funds = portfolio[(portfolio['holding_type'] == "fund") & portfolio['ticker'].isin(list(FUNDS))]
+    constructor = PortfolioConstructor(portfolio[portfolio['holding_type'] == "stock"], funds, folder_pathway)
+    return constructor.full_portfolio_holdings.set_index('ticker')['portfolio_holdings'].sort_index()
+
+
+@pytest.fixture
+def serve(tmp_path):
+    """ starts an AggregationServer on a background event loop, returning the holdings root and a client factory """
+    root = str(tmp_path)
+    write_folder(os.path.join(root, "2026-10-01"), FUNDS)
+    server = AggregationServer(holdings_root=root, port=0, reload_interval=0, batch_window=0.05)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        started.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    started.wait(timeout=30)
+    clients = []
+
+    def client():
+        clients.append(AggregationClient(port=server.port, timeout=30))
+        return clients[-1]
+
+    yield root, server, client
+
+    for x in clients:
+        x.close()
+    asyncio.run_coroutine_threadsafe(server.stop(), loop).result(timeout=30)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=30)
+
+
+def test_aggregate_matches_portfolio_constructor_and_reports_missing_funds(serve):
+    root, server, client = serve
+
+    aggregated = client().aggregate(PORTFOLIO)
+
+    expected = expected_holdings(PORTFOLIO, os.path.join(root, "2026-10-01"))
+    assert aggregated['ticker'].tolist() == sorted(aggregated['ticker'])
+    np.testing.assert_allclose(aggregated.set_index('ticker')['portfolio_holdings'].sort_index(), expected)
+    assert aggregated.attrs['missing_funds'] == ["NOTAFUND"]
+
+
+def test_invalid_portfolios_get_400_without_failing_others(serve):
+    root, server, client = serve
+    bad_amount = PORTFOLIO.assign(investment_amt=PORTFOLIO['investment_amt'].astype(object))
+    bad_amount.loc[0, 'investment_amt'] = "a lot"
+    bad_type = PORTFOLIO.assign(holding_type=["fund", "fund", "stock", "bond", "fund"])
+
+    with pytest.raises(RuntimeError, match="400"):
+        client().aggregate(bad_amount)
+    with pytest.raises(RuntimeError, match="400"):
+        client().aggregate(bad_type)
+
+    assert len(client().aggregate(PORTFOLIO)) > 0
+
+
+def test_concurrent_requests_are_aggregated_in_one_batch(serve):
+    root, server, client = serve
+    n_threads = 6
+    clients = [client() for _ in range(n_threads)]
+    barrier = threading.Barrier(n_threads)
+    results = [None] * n_threads
+
+    def request(i):
+        barrier.wait()
+        results[i] = clients[i].aggregate(PORTFOLIO.assign(investment_amt=PORTFOLIO['investment_amt'] * (i + 1)))
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # every client gets its own portfolio back
+    for i, result in enumerate(results):
+        np.testing.assert_allclose(result['portfolio_holdings'], results[0]['portfolio_holdings'] * (i + 1))
+    assert clients[0].metrics()['batches']['max_portfolios'] > 1
+
+
+def test_reload_waits_for_the_import_to_finish(serve):
+    root, server, client = serve
+    before = client().aggregate(PORTFOLIO)
+
+    # an empty folder, and one still being imported into, are not swapped in
+    os.makedirs(os.path.join(root, "2026-10-02"))
+    assert client().reload()['universe']['folder'] == os.path.join(root, "2026-10-01")
+    changed = {'AAA': FUNDS['AAA'].assign(percent_of_portfolio=[40.0, 40.0, 20.0]), 'BBB': FUNDS['BBB']}
+    write_folder(os.path.join(root, "2026-10-02"), changed, finished=False)
+    assert client().reload()['universe']['folder'] == os.path.join(root, "2026-10-01")
+    np.testing.assert_allclose(client().aggregate(PORTFOLIO)['portfolio_holdings'], before['portfolio_holdings'])
+
+    write_folder(os.path.join(root, "2026-10-02"), changed)
+    # a file still being written, not yet in the manifest, is not read
+    write_fund_holdings(FUNDS['BBB'], holdings_file_pathway(os.path.join(root, "2026-10-02"), "CCC"))
+    reloaded = client().reload()
+
+    assert reloaded['universe']['folder'] == os.path.join(root, "2026-10-02")
+    assert reloaded['universe']['funds'] == 2
+    after = client().aggregate(PORTFOLIO)
+    np.testing.assert_allclose(after.set_index('ticker')['portfolio_holdings'].sort_index(),
+                               expected_holdings(PORTFOLIO, os.path.join(root, "2026-10-02")))
+    assert after.attrs['universe']['folder'] == os.path.join(root, "2026-10-02")
+
+
+def test_a_fund_dropping_out_does_not_hold_back_newer_folders(serve):
+    root, server, client = serve
+
+    write_folder(os.path.join(root, "2026-10-02"), {'AAA': FUNDS['AAA']}, failed_funds={'BBB': "no N-PORT filing found"})
+    client().reload()
+    write_folder(os.path.join(root, "2026-10-03"), {'AAA': FUNDS['AAA']})
+    client().reload()
+
+    universe = client().health()['universe']
+    assert universe['folder'] == os.path.join(root, "2026-10-03")
+    assert universe['dropped_funds'] == []
+    aggregated = client().aggregate(PORTFOLIO)
+    assert aggregated.attrs['missing_funds'] == ["BBB", "NOTAFUND"]
+
+
+def test_health_reports_failed_and_dropped_funds(serve):
+    root, server, client = serve
+
+    write_folder(os.path.join(root, "2026-10-02"), {'AAA': FUNDS['AAA']}, failed_funds={'BBB': "no N-PORT filing found"})
+    universe = client().reload()['universe']
+
+    assert universe['folder'] == os.path.join(root, "2026-10-02")
+    assert universe['dropped_funds'] == ["BBB"]
+    assert universe['failed_funds'] == {'BBB': "no N-PORT filing found"}
+    # reloading the same folder keeps reporting the fund it dropped
+    assert client().reload()['universe']['dropped_funds'] == ["BBB"]
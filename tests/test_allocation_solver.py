@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+from allocation_solver import AllocationSolver, solve_many
+from exposure_matrix import FundExposureMatrix
+
+
+def holdings(tickers: list, weights: list, country: str = "US") -> pd.DataFrame:
+    return pd.DataFrame({'ticker': tickers, 'company_name': tickers, 'country': country, 'percent_of_portfolio': weights})
+
+
+def lookthrough_percents(result: dict, amount: float = 100.0) -> pd.Series:
+    """ percent of the amount invested in each security, from the solved scenario's holdings """
+    return result['holdings'].set_index('ticker')['portfolio_holdings'] / amount
+
+
+def random_universe(n_funds: int, n_securities: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    countries = np.where(np.arange(n_securities) % 3 == 0, "GB", "US")
+    funds = {}
+    for i in range(n_funds):
+        held = rng.choice(n_securities, size=rng.integers(5, 30), replace=False)
+        weights = rng.dirichlet(np.ones(len(held))) * 100
+        funds[f"F{i}"] = pd.DataFrame({'ticker': [f"S{x}" for x in held], 'company_name': "", 'country': countries[held],
+                                       'percent_of_portfolio': weights})
+    return funds
+
+
+def test_cap_counts_a_security_held_by_several_funds():
+    # X is 8% of both funds, so any allocation holds 8% of X however it is split
+    fund_holdings = {
+        'A': holdings(["X"] + [f"A{i}" for i in range(23)], [8.0] + [4.0] * 23),
+        'B': holdings(["X"] + [f"B{i}" for i in range(23)], [8.0] + [4.0] * 23),
+    }
+    solver = AllocationSolver(FundExposureMatrix(fund_holdings))
+    scenario = {'targets': {'domestic': 100}, 'max_fund_weight': 50}
+
+    assert not solver.solve({**scenario, 'max_security_weight': 5})['success']
+
+    result = solver.solve({**scenario, 'max_security_weight': 8})
+    assert result['success']
+    assert lookthrough_percents(result)['X'] <= 8 + 1e-6
+
+
+def test_solved_allocations_respect_every_cap():
+    solver = AllocationSolver(FundExposureMatrix(random_universe(40, 60, seed=3)))
+    scenarios = {f"cap {cap} fund {fund_cap}": {'targets': {'domestic': 60, 'international': 40}, 'max_security_weight': cap,
+                                               'max_fund_weight': fund_cap}
+                 for cap in [2, 3, 5] for fund_cap in [10, 25, None]}
+
+    results = solver.solve_batch(scenarios)
+
+    assert any(x['success'] for x in results.values())
+    for name, result in results.items():
+        if not result['success']:
+            continue
+        allocation = result['allocation']
+        assert abs(allocation['investment_amt'].sum() - 100) < 1e-6, name
+        if scenarios[name]['max_fund_weight'] is not None:
+            assert allocation['investment_amt'].max() <= scenarios[name]['max_fund_weight'] + 1e-6, name
+        assert lookthrough_percents(result).max() <= scenarios[name]['max_security_weight'] + 1e-6, name
+
+
+def test_feasible_targets_are_hit_exactly():
+    fund_holdings = {
+        'DOMESTIC': holdings(["D1", "D2"], [50.0, 50.0], "US"),
+        'GLOBAL': holdings(["D1", "I1", "I2"], [20.0, 40.0, 40.0], "GB"),
+        'INTL': holdings(["I2", "I3"], [50.0, 50.0], "FR"),
+    }
+    solver = AllocationSolver(FundExposureMatrix(fund_holdings))
+
+    for method in ["lp", "least_squares"]:
+        result = solver.solve({'targets': {'domestic': 60, 'international': 40}, 'method': method})
+        assert result['success']
+        assert result['deviation'] < 1e-6
+        assert abs(result['rollup']['domestic'] - 60) < 1e-6
+        assert abs(result['rollup']['international'] - 40) < 1e-6
+
+
+def test_unreachable_targets_report_their_deviation():
+    solver = AllocationSolver(FundExposureMatrix({'US': holdings(["D1"], [100.0], "US")}))
+
+    result = solver.solve({'targets': {'domestic': 60, 'international': 40}})
+
+    assert result['success']
+    assert abs(result['deviation'] - 80) < 1e-6
+
+
+def test_invalid_scenarios_fail_without_losing_the_batch():
+    solver = AllocationSolver(FundExposureMatrix(random_universe(10, 60, seed=5)))
+    targets = {'targets': {'domestic': 60, 'international': 40}}
+    scenarios = {
+        'valid': targets,
+        'capped_least_squares': {**targets, 'method': "least_squares", 'max_security_weight': 5},
+        'unknown_dimension': {**targets, 'by': "planet"},
+        'also_valid': {**targets, 'max_fund_weight': 30},
+    }
+
+    for n_processes in [1, 2]:
+        results = solve_many(solver, scenarios, n_processes=n_processes, chunk_size=2)
+
+        assert results['valid']['success'] and results['also_valid']['success']
+        assert not results['capped_least_squares']['success']
+        assert "max_security_weight" in results['capped_least_squares']['message']
+        assert not results['unknown_dimension']['success']
+        assert "planet" in results['unknown_dimension']['message']
+        assert results['unknown_dimension']['holdings'].empty
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import os
+
+from batch_aggregation import BatchAggregator, aggregate_many
+from exposure_matrix import FundExposureMatrix
+from holdings_storage import holdings_file_pathway, write_fund_holdings
+from portfolio_aggregation import PortfolioConstructor
+
+
+def random_universe(n_funds: int, n_securities: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    funds = {}
+    for i in range(n_funds):
+        held = rng.choice(n_securities, size=rng.integers(3, 25), replace=False)
+        funds[f"F{i}"] = pd.DataFrame({'company_name': [f"Company {x}" for x in held], 'percent_of_portfolio': rng.dirichlet(np.ones(len(held))) * 100,
+                                       'country': "US", 'ticker': [f"S{x:03d}" for x in held]})
+    return funds
+
+
+def random_portfolios(funds: dict, n_clients: int, seed: int) -> dict:
+    """ clients holding a few funds, stocks some funds hold and stocks none do """
+    rng = np.random.default_rng(seed)
+    portfolios = {}
+    for i in range(n_clients):
+        held_funds = list(rng.choice(list(funds), size=rng.integers(1, 4), replace=False))
+        stocks = [f"S{x:03d}" for x in rng.choice(40, size=2, replace=False)] + [f"OWN{rng.integers(5)}"]
+        portfolios[f"client{i}"] = pd.DataFrame({'ticker': held_funds + stocks,
+                                                 'investment_amt': rng.uniform(100, 10_000, len(held_funds) + len(stocks)),
+                                                 'holding_type': ["fund"] * len(held_funds) + ["stock"] * len(stocks)})
+    return portfolios
+
+
+@pytest.fixture
+def universe(tmp_path):
+    """ (fund holdings, folder they are saved in, client portfolios) """
+    funds = random_universe(12, 60, seed=0)
+    for fund, holdings in funds.items():
+        write_fund_holdings(holdings, holdings_file_pathway(str(tmp_path), fund))
+    return funds, str(tmp_path), random_portfolios(funds, 9, seed=1)
+
+
+def expected_holdings(portfolio: pd.DataFrame, folder_pathway: str) -> pd.DataFrame:
+    """ the client's holdings aggregated on their own by PortfolioConstructor, without zero rows """
+    is_fund = portfolio['holding_type'] == "fund"
+    holdings = PortfolioConstructor(portfolio[~is_fund], portfolio[is_fund], folder_pathway).full_portfolio_holdings
+    return holdings[holdings['portfolio_holdings'] != 0].sort_values('ticker', kind="stable").reset_index(drop=True)
+
+
+def assert_matches(result: pd.DataFrame, expected: pd.DataFrame) -> None:
+    assert result['ticker'].tolist() == expected['ticker'].tolist()
+    np.testing.assert_allclose(result['portfolio_holdings'].to_numpy(), expected['portfolio_holdings'].to_numpy(), rtol=1e-12)
+
+
+def test_aggregate_matches_portfolio_constructor_for_every_client(universe):
+    funds, folder, portfolios = universe
+
+    # small chunks so clients are aggregated over several matrix products
+    results = BatchAggregator(FundExposureMatrix(funds)).aggregate(portfolios, chunk_size=4)
+
+    assert list(results) == list(portfolios)
+    for client, portfolio in portfolios.items():
+        assert_matches(results[client], expected_holdings(portfolio, folder))
+
+
+def test_output_folder_streams_each_client_to_csv(universe, tmp_path):
+    funds, folder, portfolios = universe
+    output_folder = str(tmp_path / "clients")
+
+    results = aggregate_many(FundExposureMatrix(funds), portfolios, output_folder=output_folder, chunk_size=4)
+
+    for client, portfolio in portfolios.items():
+        assert results[client] == os.path.join(output_folder, f"{client}.csv")
+        assert_matches(pd.read_csv(results[client], dtype={'ticker': str}), expected_holdings(portfolio, folder))
+
+
+def test_process_pool_gives_the_same_holdings(universe):
+    funds, folder, portfolios = universe
+    exposure_matrix = FundExposureMatrix(funds)
+
+    in_process = aggregate_many(exposure_matrix, portfolios, chunk_size=3)
+    across_processes = aggregate_many(exposure_matrix, portfolios, n_processes=2, chunk_size=3)
+
+    assert list(across_processes) == list(portfolios)
+    for client in portfolios:
+        pd.testing.assert_frame_equal(across_processes[client], in_process[client])
+        assert_matches(across_processes[client], expected_holdings(portfolios[client], folder))
+
+
+def test_ticker_ranks_order_universe_and_extra_stocks_by_ticker():
+    rng = np.random.default_rng(0)
+    universe = [f"S{x:03d}" for x in rng.permutation(200)]
+    funds = {f"F{i}": pd.DataFrame({'ticker': rng.choice(universe, size=30, replace=False), 'percent_of_portfolio': 100 / 30})
+             for i in range(10)}
+    aggregator = BatchAggregator(FundExposureMatrix(funds))
+    n_universe = aggregator.exposure_matrix.weights.shape[1]
+
+    # stocks no fund holds sort before, between and after the universe tickers, and among themselves
+    for extra in [[], ["S050x", "A", "S050y", "ZZZ", "S1005"], ["S10", "S0999", "S199z"]]:
+        securities = np.concatenate([aggregator.exposure_matrix.securities[:n_universe], np.asarray(extra, dtype=object)])
+
+        ranks = aggregator.ticker_ranks(securities)
+
+        assert len(ranks) == len(securities)
+        assert securities[np.argsort(ranks, kind="stable")].tolist() == sorted(securities.tolist())
@@ -0,0 +1,44 @@
+import pandas as pd
+
+import os
+import sqlite3
+
+from cusip_cache import CUSIPCache
+from filing_index import FilingIndex
+from snapshot_store import SnapshotStore
+from yahoo_enrichment import MetadataCache
+
+
+def test_cache_calls_close_their_connections(tmp_path, monkeypatch):
+    opened = []
+
+    def connect(*args, **kwargs):
+        opened.append(sqlite3.Connection(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(sqlite3, "connect", connect)
+
+    cusips = CUSIPCache(os.path.join(tmp_path, "cusips.sqlite"))
+    cusips.set_many({'037833100': "AAPL"})
+    assert cusips.get_many(["037833100"]) == {'037833100': "AAPL"}
+
+    index = FilingIndex(os.path.join(tmp_path, "filings.sqlite"))
+    index.update("0000000001", "S000000001", "0000000000-24-000001", "2024-03-01T16:00:00-05:00")
+    assert index.get("0000000001", "S000000001")['accession_no'] == "0000000000-24-000001"
+
+    metadata = MetadataCache(os.path.join(tmp_path, "metadata.sqlite"))
+    metadata.set_many({'AAPL': {'sector': "Technology"}})
+    assert metadata.get_many(["AAPL"])['AAPL']['sector'] == "Technology"
+
+    store = SnapshotStore(os.path.join(tmp_path, "snapshots"))
+    store.put("FUND", "0000000000-24-000001", "2024-03-01", pd.DataFrame({'ticker': ["AAPL"], 'percent_of_portfolio': [100.0]}))
+    assert len(store.history("FUND")) == 1
+
+    assert opened
+    for conn in opened:
+        # a closed connection refuses to open a cursor
+        try:
+            conn.cursor()
+        except sqlite3.ProgrammingError:
+            continue
+        raise AssertionError("connection left open")
@@ -0,0 +1,64 @@
+import pytest
+
+import os
+import re
+
+from data_collection import DataImport
+from download_manifest import DownloadManifest
+
+
+def filing(i: int) -> dict:
+    holdings = [{'name': f"Company {j}", 'cusip': f"{j:08d}0", 'balance': 1.0, 'valUSD': 10.0, 'pctVal': 25.0,
+                 'invCountry': "US", 'identifiers': {}} for j in range(i, i + 4)]
+    return {'accessionNo': f"0000000000-24-{i:06d}", 'filedAt': "2024-03-01T16:00:00-05:00",
+            'genInfo': {'regCik': "0000000001", 'seriesId': f"S{i:09d}"}, 'invstOrSecs': holdings}
+
+
+class FakeNportApi:
+    """ answers series queries, interrupting the run like Ctrl-C when asked for interrupt_series """
+
+    def __init__(self, filings: dict, interrupt_series: str = None):
+        self._filings = filings
+        self._interrupt_series = interrupt_series
+        self.series_queried = []
+
+    def get_data(self, query: dict) -> dict:
+        series = re.search(r"genInfo\.seriesId:(\S+)", query['query']['query_string']['query']).group(1)
+        if series == self._interrupt_series:
+            raise KeyboardInterrupt
+        self.series_queried.append(series)
+        return {'filings': [self._filings[series]]}
+
+
+class FakeMappingApi:
+    def resolve(self, parameter: str, value: str) -> list:
+        return [{'ticker': f"T{value[:-1]}"}]
+
+
+def data_import(folder: str, nport_api: FakeNportApi) -> DataImport:
+    filings = {f"S{i:09d}": filing(i) for i in range(5)}
+    funds = [(f"FUND{i}", "0000000001", series) for i, series in enumerate(filings)]
+    DI = DataImport(funds, folder, requests_per_second=1e6, chunk_size=2)
+    DI._nportAPI = nport_api
+    DI._mappingAPI = FakeMappingApi()
+    return DI
+
+
+def test_an_interrupted_import_keeps_the_chunks_already_saved(tmp_path):
+    folder = os.path.join(tmp_path, "2026-10-01")
+    filings = {f"S{i:09d}": filing(i) for i in range(5)}
+
+    with pytest.raises(KeyboardInterrupt):
+        data_import(folder, FakeNportApi(filings, interrupt_series="S000000003")).generate_and_save_holdings()
+
+    manifest = DownloadManifest(folder)
+    assert sorted(manifest) == ["FUND0", "FUND1"]
+    assert manifest.import_finished is False
+
+    nport_api = FakeNportApi(filings)
+    assert data_import(folder, nport_api).generate_and_save_holdings() == {}
+
+    assert nport_api.series_queried == ["S000000002", "S000000003", "S000000004"]
+    manifest = DownloadManifest(folder)
+    assert sorted(manifest) == [f"FUND{i}" for i in range(5)]
+    assert manifest.import_finished is True
@@ -0,0 +1,68 @@
+import pytest
+
+import io
+import json
+import os
+import urllib.request
+
+from fund_lookthrough import FundRegistry
+
+
+def sec_file(symbol: str) -> bytes:
+    return json.dumps({'fields': ["cik", "seriesId", "classId", "symbol"], 'data': [[36405, "S000002848", "C000007800", symbol]]}).encode()
+
+
+@pytest.fixture
+def sec(monkeypatch):
+    """ answers SEC requests with a ticker file for VTSAX, recording the User-Agent of each """
+    user_agents = []
+
+    def urlopen(request, timeout=None):
+        user_agents.append(request.get_header("User-agent"))
+        return io.BytesIO(sec_file("VTSAX"))
+
+    monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+    monkeypatch.delenv("SEC_USER_AGENT", raising=False)
+    return user_agents
+
+
+def test_downloading_requires_a_user_agent(tmp_path, sec, monkeypatch):
+    pathway = str(tmp_path / "company_tickers_mf.json")
+
+    with pytest.raises(ValueError, match="SEC_USER_AGENT"):
+        FundRegistry.from_sec(pathway)
+    assert sec == [] and not os.path.exists(pathway)
+
+    monkeypatch.setenv("SEC_USER_AGENT", "Jane Doe jane@example.org")
+    registry = FundRegistry.from_sec(pathway)
+
+    assert registry.get("VTSAX") == ("0000036405", "S000002848")
+    assert sec == ["Jane Doe jane@example.org"]
+
+
+def test_cached_file_is_refreshed_once_out_of_date(tmp_path, sec):
+    pathway = str(tmp_path / "company_tickers_mf.json")
+    with open(pathway, "wb") as f:
+        f.write(sec_file("OLDFX"))
+
+    assert "OLDFX" in FundRegistry.from_sec(pathway, user_agent="Jane Doe jane@example.org")
+    assert sec == []
+
+    old = os.path.getmtime(pathway) - 8 * 86400
+    os.utime(pathway, (old, old))
+    assert "VTSAX" in FundRegistry.from_sec(pathway, user_agent="Jane Doe jane@example.org")
+    assert len(sec) == 1
+
+    # a recent file is downloaded again when asked to
+    FundRegistry.from_sec(pathway, user_agent="Jane Doe jane@example.org", refresh=True)
+    assert len(sec) == 2
+
+
+def test_stale_cache_is_used_when_it_cannot_be_refreshed(tmp_path, sec):
+    pathway = str(tmp_path / "company_tickers_mf.json")
+    with open(pathway, "wb") as f:
+        f.write(sec_file("OLDFX"))
+
+    # no User-Agent to refresh with
+    assert "OLDFX" in FundRegistry.from_sec(pathway, refresh=True)
+    assert sec == []
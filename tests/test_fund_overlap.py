@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from exposure_matrix import FundExposureMatrix
+from fund_overlap import FundOverlap
+
+
+def random_universe(n_funds: int, n_securities: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    funds = {}
+    for i in range(n_funds):
+        held = rng.choice(n_securities, size=rng.integers(1, n_securities), replace=False)
+        # rounded weights so some securities have several holders with the same weight
+        weights = np.round(rng.dirichlet(np.ones(len(held))) * 100, 1)
+        funds[f"F{i}"] = pd.DataFrame({'ticker': [f"S{x}" for x in held], 'percent_of_portfolio': weights})
+    return funds
+
+
+def dense_weights(overlap: FundOverlap) -> np.ndarray:
+    return overlap.weights.toarray()
+
+
+def test_weighted_overlap_is_the_sum_of_the_smaller_weights():
+    # small chunks so the pairs are expanded over several passes
+    overlap = FundOverlap(FundExposureMatrix(random_universe(25, 40, seed=1)), chunk_pairs=50)
+    W = dense_weights(overlap)
+
+    expected = np.array([[np.minimum(W[i], W[j]).sum() for j in range(len(W))] for i in range(len(W))])
+
+    np.testing.assert_allclose(overlap.weighted, expected, atol=1e-9)
+
+
+def test_count_and_correlation_match_dense_computations():
+    overlap = FundOverlap(FundExposureMatrix(random_universe(25, 40, seed=2)))
+    W = dense_weights(overlap)
+    held = (W != 0).astype(float)
+
+    np.testing.assert_array_equal(overlap.count, held @ held.T)
+    np.testing.assert_allclose(overlap.correlation, np.corrcoef(W), atol=1e-9)
+
+
+def test_most_similar_ranks_by_the_metric_and_skips_the_fund_itself():
+    overlap = FundOverlap(FundExposureMatrix(random_universe(25, 40, seed=3)))
+    fund = overlap.funds[0]
+
+    similar = overlap.most_similar(fund, k=5)
+
+    scores = overlap.matrix('weighted').loc[fund].drop(fund).sort_values(ascending=False, kind="stable")
+    assert fund not in similar['other_fund'].tolist()
+    np.testing.assert_allclose(similar['weighted'].to_numpy(), scores.iloc[:5].to_numpy())
+
+
+def test_pairs_lists_every_pair_once():
+    overlap = FundOverlap(FundExposureMatrix(random_universe(6, 10, seed=4)))
+
+    pairs = overlap.pairs()
+
+    assert len(pairs) == 6 * 5 // 2
+    row = pairs.iloc[0]
+    assert row['weighted'] == overlap.matrix('weighted').loc[row['fund'], row['other_fund']]
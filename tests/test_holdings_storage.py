@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+import os
+import stat
+
+from download_manifest import atomic_write_text
+from holdings_storage import read_fund_holdings, replace_fund_holdings
+from snapshot_store import SnapshotStore
+
+
+HOLDINGS = pd.DataFrame({'ticker': ["A", "B"], 'percent_of_portfolio': [60.0, 40.0]})
+
+
+def mode(pathway: str) -> int:
+    return stat.S_IMODE(os.stat(pathway).st_mode)
+
+
+def test_replaced_files_get_default_permissions(tmp_path):
+    replace_fund_holdings(HOLDINGS, str(tmp_path / "FUND.csv"))
+    atomic_write_text("{}", str(tmp_path / "manifest.json"))
+    snapshot = SnapshotStore(str(tmp_path / "store")).put("FUND", "0001", "2024-03-01", HOLDINGS)
+    # what open() gives a new file under the umask
+    with open(tmp_path / "default.txt", "w"):
+        pass
+
+    for pathway in [tmp_path / "FUND.csv", tmp_path / "manifest.json", snapshot['pathway']]:
+        assert mode(pathway) == mode(tmp_path / "default.txt")
+
+
+def test_failed_write_keeps_the_old_file_and_leaves_no_temporary_file(tmp_path):
+    pathway = str(tmp_path / "FUND.csv")
+    replace_fund_holdings(HOLDINGS, pathway)
+
+    with pytest.raises(ValueError):
+        replace_fund_holdings(HOLDINGS, pathway, storage_format="xlsx")
+
+    assert os.listdir(tmp_path) == ["FUND.csv"]
+    assert read_fund_holdings(pathway)['ticker'].tolist() == ["A", "B"]
+
+
+def test_storing_the_same_content_twice_keeps_one_file(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    first = store.put("FUND", "0001", "2024-03-01", HOLDINGS)
+    second = store.put("OTHER", "0002", "2024-03-01", HOLDINGS)
+
+    assert first['pathway'] == second['pathway']
+    assert not [x for x in os.listdir(tmp_path) if x.endswith(".tmp")]
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import time
+
+from exposure_matrix import FundExposureMatrix
+from incremental_aggregation import IncrementalPortfolio
+
+
+FUND_HOLDINGS = {
+    'AAA': pd.DataFrame({'ticker': ["X", "Y", "Z"], 'company_name': ["x", "y", "z"], 'country': "US", 'percent_of_portfolio': [50.0, 30.0, 20.0]}),
+    'BBB': pd.DataFrame({'ticker': ["Y", "W"], 'company_name': ["y", "w"], 'country': "GB", 'percent_of_portfolio': [60.0, 40.0]}),
+    'CCC': pd.DataFrame({'ticker': ["V", "X"], 'company_name': ["v", "x"], 'country': "US", 'percent_of_portfolio': [10.0, 90.0]}),
+}
+
+
+def recomputed(portfolio: IncrementalPortfolio) -> pd.Series:
+    """ full_portfolio_holdings aggregated from scratch out of the current positions """
+    totals = {}
+    for fund, amount in portfolio.fund_amounts.items():
+        holdings = FUND_HOLDINGS[fund]
+        for ticker, weight in zip(holdings['ticker'], holdings['percent_of_portfolio']):
+            totals[ticker] = totals.get(ticker, 0.0) + weight * amount
+    for ticker, amount in portfolio.stock_amounts.items():
+        totals[ticker] = totals.get(ticker, 0.0) + amount
+    return pd.Series(totals, dtype=float).sort_index()
+
+
+def assert_matches(portfolio: IncrementalPortfolio):
+    holdings = portfolio.full_portfolio_holdings()
+    expected = recomputed(portfolio)
+    assert holdings['ticker'].tolist() == expected.index.tolist()
+    np.testing.assert_allclose(holdings['portfolio_holdings'].to_numpy(), expected.to_numpy())
+
+
+def test_reads_follow_every_kind_of_change():
+    portfolio = IncrementalPortfolio(FundExposureMatrix({x: FUND_HOLDINGS[x] for x in ["AAA", "BBB"]}), {'AAA': 100.0}, {'Y': 5.0, 'Q': 1.0})
+    assert_matches(portfolio)
+
+    portfolio.update_position("AAA", 250.0)
+    assert_matches(portfolio)
+    portfolio.update_position("Y", 7.0)
+    assert_matches(portfolio)
+    portfolio.update_position("BBB", 40.0)
+    assert_matches(portfolio)
+    portfolio.update_position("A0", 3.0)
+    assert_matches(portfolio)
+    portfolio.add_fund("CCC", 10.0, FUND_HOLDINGS['CCC'])
+    assert_matches(portfolio)
+    portfolio.remove_fund("AAA")
+    assert_matches(portfolio)
+    portfolio.remove_stock("Q")
+    assert_matches(portfolio)
+    portfolio.remove_fund("BBB")
+    assert_matches(portfolio)
+
+
+def test_update_then_read_does_not_rebuild_the_rows():
+    n_securities = 50_000
+    tickers = [f"S{i:06d}" for i in range(n_securities)]
+    fund_holdings = {
+        'BIG': pd.DataFrame({'ticker': tickers, 'company_name': tickers, 'country': "US", 'percent_of_portfolio': 100.0 / n_securities}),
+        'SMALL': pd.DataFrame({'ticker': tickers[:10], 'company_name': tickers[:10], 'country': "US", 'percent_of_portfolio': 10.0}),
+    }
+    portfolio = IncrementalPortfolio(FundExposureMatrix(fund_holdings), {'BIG': 1000.0, 'SMALL': 10.0}, {'S000001': 5.0})
+    first = portfolio.full_portfolio_holdings()
+
+    start = time.perf_counter()
+    for i in range(100):
+        portfolio.update_position("SMALL", 10.0 + i)
+        portfolio.update_position("S000001", float(i))
+        holdings = portfolio.full_portfolio_holdings()
+    per_read = (time.perf_counter() - start) / 100
+
+    assert holdings['ticker'].tolist() == first['ticker'].tolist()
+    assert holdings['portfolio_holdings'].iloc[1] == pytest.approx(1000.0 * 100.0 / n_securities + 109.0 * 10.0 + 99.0)
+    # a rebuild sorts and sums all 50,000 rows, a refresh only the ten the small fund holds
+    assert per_read < 0.005
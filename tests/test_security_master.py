@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from security_master import CompactFundHoldings, SecurityMaster
+
+
+FUNDS = {
+    'AAA': pd.DataFrame({'company_name': ["Apple", "Microsoft", "Cash"], 'percent_of_portfolio': [50.0, 30.0, 20.0],
+                         'country': ["US", "US", None], 'ticker': ["AAPL", "MSFT", None],
+                         'cusip': ["037833100", "594918104", None]}, index=[7, 8, 9]),
+    'BBB': pd.DataFrame({'ticker': ["MSFT", "7203"], 'company_name': ["Microsoft Corp", "Toyota"],
+                         'country': ["US", "JP"], 'percent_of_portfolio': [60.0, 40.0]}),
+}
+
+
+def test_lookup_returns_each_funds_own_holdings():
+    compact = CompactFundHoldings.from_frames(FUNDS)
+
+    for fund, holdings in FUNDS.items():
+        rebuilt = compact[fund]
+        assert list(rebuilt.columns) == list(holdings.columns)
+        assert isinstance(rebuilt.index, pd.RangeIndex)
+        assert isinstance(rebuilt['company_name'].dtype, pd.CategoricalDtype)
+        pd.testing.assert_frame_equal(rebuilt.astype(object), holdings.reset_index(drop=True).astype(object))
+
+    assert compact.n_rows == 5
+    assert sorted(compact) == ["AAA", "BBB"] and "AAA" in compact and len(compact) == 2
+
+
+def test_funds_share_the_security_master():
+    compact = CompactFundHoldings.from_frames(FUNDS)
+    master = compact.master
+
+    # MSFT is stored once, described by the first fund that reported it
+    assert len(master) == 3
+    assert master.keys.tolist() == ["AAPL", "MSFT", "7203"]
+    assert master.info['company_name'].tolist() == ["Apple", "Microsoft", "Toyota"]
+    assert master.ids(["7203", "MSFT", "NOPE"]).tolist() == [2, 1, -1]
+
+    # arrays skip the row without a ticker
+    ids, weights = compact.arrays('AAA')
+    assert ids.tolist() == [0, 1]
+    np.testing.assert_allclose(weights, [50.0, 30.0])
+    ids, weights = compact.arrays('BBB')
+    assert ids.tolist() == [1, 2]
+    np.testing.assert_allclose(weights, [60.0, 40.0])
+
+
+def test_interning_fills_in_missing_descriptions():
+    master = SecurityMaster()
+
+    assert master.intern(["AAPL", None], {'country': [None, "US"]}).tolist() == [0, -1]
+    assert master.info['country'].isna().tolist() == [True]
+    assert master.intern(["MSFT", "AAPL"], {'country': ["US", "US"]}).tolist() == [1, 0]
+    assert master.info['country'].tolist() == ["US", "US"]
+
+
+def test_deleting_a_fund():
+    compact = CompactFundHoldings.from_frames(FUNDS)
+    del compact['AAA']
+
+    assert list(compact) == ["BBB"]
+    assert compact.n_rows == 2
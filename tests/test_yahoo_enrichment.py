@@ -0,0 +1,27 @@
+import numpy as np
+
+from yahoo_enrichment import METADATA_FIELDS, YahooEnricher
+
+
+class FlakyEnricher(YahooEnricher):
+    """ answers from a dict, raising for tickers that are not in it """
+
+    def __init__(self, answers: dict):
+        super().__init__(max_workers=2, max_retries=1, backoff_base=0)
+        self._answers = answers
+
+    def query_info(self, ticker: str) -> dict:
+        if ticker not in self._answers:
+            raise ConnectionError("Yahoo Finance is down")
+        return self._answers[ticker]
+
+
+def test_failed_lookups_are_not_passed_to_on_result():
+    answers = {'AAPL': dict(zip(METADATA_FIELDS, ["United States", "Technology", "Consumer Electronics", 3e12]))}
+    resolved = {}
+
+    results = FlakyEnricher(answers).enrich(["AAPL", "MSFT"], on_result=resolved.__setitem__)
+
+    assert list(resolved) == ["AAPL"]
+    assert results['AAPL'] == ("United States", "Technology", "Consumer Electronics", 3e12)
+    assert np.isnan(results['MSFT']).all()
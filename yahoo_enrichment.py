@@ -0,0 +1,266 @@
+import numpy as np
+
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from typing import Callable, Dict, Iterable
+
+from instrumentation import RunMetrics
+
+
+# fields pulled from Yahoo Finance for every stock, in the order they are returned
+METADATA_FIELDS = ["country", "sector", "industry", "market_cap"]
+
+# Yahoo Finance info key for each field
+YF_INFO_KEYS = {"country": "country", "sector": "sector", "industry": "industry", "market_cap": "marketCap"}
+
+# how long each field stays fresh: market cap moves daily, classifications rarely change
+DEFAULT_FIELD_TTL_DAYS = {"country": 180, "sector": 90, "industry": 90, "market_cap": 1}
+
+
+def import_yfinance():
+    """ imports yfinance when the first ticker is queried, so runs served from the cache do not load it """
+    import yfinance as yf
+    return yf
+
+
+def run_coroutine(coroutine):
+    """ runs a coroutine to completion, also when called from inside a running event loop (e.g. Jupyter) """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+class MetadataCache:
+    """ on-disk SQLite store of Yahoo Finance metadata with a separate TTL for each field """
+
+    def __init__(self, db_pathway: str, field_ttl_days: Dict[str, float] = None):
+        self._db_pathway = db_pathway
+        field_ttl_days = {**DEFAULT_FIELD_TTL_DAYS, **(field_ttl_days or {})}
+        self._field_ttl_seconds = {field: days * 24 * 60 * 60 for field, days in field_ttl_days.items()}
+        self._lock = threading.Lock()
+        self.create_table()
+
+    @property
+    def db_pathway(self):
+        return self._db_pathway
+
+    @property
+    def field_ttl_seconds(self):
+        return self._field_ttl_seconds
+
+    @contextmanager
+    def connect(self):
+        """ yields a connection that commits (or rolls back) and is closed when the block exits """
+        with closing(sqlite3.connect(self.db_pathway, timeout=30)) as conn, conn:
+            yield conn
+
+    def create_table(self) -> None:
+        """ creates the metadata table if it does not exist yet """
+        with self._lock, self.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stock_metadata ("
+                "ticker TEXT NOT NULL, "
+                "field TEXT NOT NULL, "
+                "value TEXT, "
+                "fetched_at REAL NOT NULL, "
+                "PRIMARY KEY (ticker, field))"
+            )
+
+    def get_many(self, tickers: Iterable[str]) -> Dict[str, dict]:
+        """ returns the unexpired fields cached for each ticker
+
+        Returns:
+            Dict[str, dict]: ticker to {field: value}. Expired and missing fields are left out
+        """
+        tickers = list(dict.fromkeys(tickers))
+        now = time.time()
+        result = {}
+
+        with self._lock, self.connect() as conn:
+            for i in range(0, len(tickers), 500):
+                chunk = tickers[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT ticker, field, value, fetched_at FROM stock_metadata WHERE ticker IN ({placeholders})", chunk
+                ).fetchall()
+                for ticker, field, value, fetched_at in rows:
+                    if now - fetched_at <= self.field_ttl_seconds.get(field, 0):
+                        result.setdefault(ticker, {})[field] = json.loads(value) if value is not None else None
+
+        return result
+
+    def set_many(self, metadata: Dict[str, dict]) -> None:
+        """ stores fetched fields, None values are cached as well so unknown tickers are not re-queried
+
+        Args:
+            metadata (Dict[str, dict]): ticker to {field: value}
+        """
+        now = time.time()
+        rows = [
+            (ticker, field, json.dumps(value) if value is not None else None, now)
+            for ticker, fields in metadata.items() for field, value in fields.items()
+        ]
+
+        with self._lock, self.connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO stock_metadata (ticker, field, value, fetched_at) VALUES (?, ?, ?, ?)", rows
+            )
+
+
+class YahooEnricher:
+    """ pulls country, sector, industry and market cap for many tickers with bounded concurrency
+
+    Every request gets a real timeout and is retried with exponential backoff. Results are
+    cached per field so only tickers with a stale or missing field are sent to Yahoo Finance.
+    """
+
+    def __init__(self, cache: MetadataCache = None, max_workers: int = 8, timeout: float = 10, max_retries: int = 2,
+                 backoff_base: float = 1.0, metrics: RunMetrics = None):
+        """
+        Args:
+            cache (MetadataCache, optional): metadata cache. Without one every ticker is queried
+            max_workers (int): maximum number of Yahoo Finance requests in flight
+            timeout (float): seconds to wait for a single request
+            max_retries (int): retries for a failed or timed out request
+            backoff_base (float): seconds to wait before the first retry, doubled on each further retry
+            metrics (RunMetrics, optional): records request timings, retries and cache hits. A new one is created if not given
+        """
+        self._cache = cache
+        self._metrics = metrics if metrics is not None else RunMetrics()
+        self._max_workers = max(1, max_workers)
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    def query_info(self, ticker: str) -> dict:
+        """ queries Yahoo Finance once for a ticker
+
+        Returns:
+            dict: field to value, every value None if Yahoo Finance has no data on the ticker
+        """
+        info = import_yfinance().Ticker(ticker).info or {}
+
+        if info.get('regularMarketPrice') is None and info.get('marketCap') is None:
+            logging.warning(f"Unable to find information on {ticker} on Yahoo Finance")
+            return {field: None for field in METADATA_FIELDS}
+
+        return {field: info.get(key) for field, key in YF_INFO_KEYS.items()}
+
+    async def fetch(self, ticker: str, executor: ThreadPoolExecutor, semaphore: asyncio.Semaphore) -> dict:
+        """ queries a ticker in the thread pool with a timeout, retrying with backoff
+
+        Returns:
+            dict: field to value, None if every attempt failed
+        """
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(self._max_retries + 1):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    result = await asyncio.wait_for(loop.run_in_executor(executor, self.query_info, ticker), self.timeout)
+                    self.metrics.record_api_call("yahoo", time.perf_counter() - start)
+                    return result
+                except asyncio.TimeoutError:
+                    reason = f"timed out after {self.timeout} seconds"
+                except Exception as e:
+                    reason = str(e)
+                self.metrics.record_api_call("yahoo", time.perf_counter() - start, success=False)
+
+            if attempt < self._max_retries:
+                self.metrics.record_retry("yahoo", reason)
+                wait_time = self._backoff_base * (2 ** attempt) * (1 + random.random() * 0.1)
+                logging.warning(f"Yahoo Finance query for {ticker} failed ({reason}), retrying in {wait_time:.1f} seconds")
+                await asyncio.sleep(wait_time)
+
+        logging.warning(f"Yahoo Finance query failed {self._max_retries + 1} times. Unable to pull information on {ticker}: {reason}")
+        return None
+
+    async def fetch_all(self, tickers: list, on_result: Callable = None) -> Dict[str, dict]:
+        """ queries all tickers with at most max_workers requests in flight """
+        semaphore = asyncio.Semaphore(self.max_workers)
+        # timed out requests keep their thread until they return, so leave room for a few of them
+        executor = ThreadPoolExecutor(max_workers=self.max_workers * 2)
+        results = {}
+
+        async def run(ticker):
+            results[ticker] = await self.fetch(ticker, executor, semaphore)
+            if on_result is not None:
+                on_result(ticker, results[ticker])
+
+        try:
+            await asyncio.gather(*(run(ticker) for ticker in tickers))
+        finally:
+            executor.shutdown(wait=False)
+
+        return results
+
+    def enrich(self, tickers: Iterable[str], on_result: Callable = None) -> Dict[str, tuple]:
+        """ returns (country, sector, industry, market_cap) for every ticker, querying only stale ones
+
+        Args:
+            tickers (Iterable[str]): tickers to look up
+            on_result (Callable, optional): called with (ticker, metadata tuple) as each ticker is resolved, not for tickers whose queries failed
+
+        Returns:
+            Dict[str, tuple]: ticker to (country, sector, industry, market_cap), np.nan where unknown
+        """
+        tickers = [x for x in dict.fromkeys(tickers) if isinstance(x, str)]
+        cached = self.cache.get_many(tickers) if self.cache is not None else {}
+        results = {}
+
+        def as_tuple(fields):
+            return tuple(np.nan if fields.get(field) is None else fields[field] for field in METADATA_FIELDS)
+
+        def store(ticker, fields):
+            if fields is None:
+                # failed lookups are not passed on, so a journal or cache does not keep them as unknown
+                results[ticker] = (np.nan, np.nan, np.nan, np.nan)
+                return
+            results[ticker] = as_tuple(fields)
+            if on_result is not None:
+                on_result(ticker, results[ticker])
+
+        to_query = []
+        for ticker in tickers:
+            fields = cached.get(ticker, {})
+            if all(field in fields for field in METADATA_FIELDS):
+                store(ticker, fields)
+            else:
+                to_query.append(ticker)
+
+        self.metrics.record_cache("stock_metadata", hits=len(tickers) - len(to_query), misses=len(to_query))
+        logging.info(f"Querying Yahoo Finance for {len(to_query)} of {len(tickers)} tickers")
+        fetched = run_coroutine(self.fetch_all(to_query, on_result=store)) if to_query else {}
+
+        if self.cache is not None:
+            self.cache.set_many({ticker: fields for ticker, fields in fetched.items() if fields is not None})
+
+        return results